@@ -4,10 +4,61 @@ import atexit
 import os
 from types import MethodType
 
+class LazyNamespace(dict):
+    """
+    Namespace dictionary with a live view of a mechanism.  Names that are
+    not set in the dictionary are looked up when used in (first match):
+    mechanism methods, process_dict, nreaction_dict, irr_dict, 
+    reaction_dict and species_dict.  Mechanism edits are visible without
+    copying, and lazy values (e.g., irr_dict) are only made when used.
+    """
+    _sources = ('process_dict', 'nreaction_dict', 'irr_dict', 'reaction_dict', 'species_dict')
+    _hidden_methods = ('set_mrg', 'set_irr', 'set_ipr')
+    
+    def __init__(self, *args, **kwds):
+        dict.__init__(self, *args, **kwds)
+        self.mech = None
+    
+    def __method(self, key):
+        if self.mech is None or not isinstance(key, str) or '__' in key or key in self._hidden_methods:
+            return None
+        value = getattr(self.mech, key, None)
+        if isinstance(value, MethodType):
+            return value
+        return None
+    
+    def __source(self, key):
+        if self.mech is not None:
+            for source in self._sources:
+                mapping = getattr(self.mech, source, None)
+                if mapping is not None and key in mapping:
+                    return mapping
+        return None
+    
+    def __missing__(self, key):
+        method = self.__method(key)
+        if method is not None:
+            return method
+        mapping = self.__source(key)
+        if mapping is not None:
+            return mapping[key]
+        raise KeyError(key)
+    
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self.__method(key) is not None or self.__source(key) is not None
+    
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
 class PERMConsole(code.InteractiveConsole):
     def __init__(self, locals = None, filename = '<console>',
                 histfile = os.path.expanduser("~/.permm-history")):
-        code.InteractiveConsole.__init__(self)
+        if locals is None:
+            locals = LazyNamespace(__name__ = '__console__', __doc__ = None)
+        code.InteractiveConsole.__init__(self, locals = locals, filename = filename)
         self.init_history(histfile)
     
     def init_history(self, histfile):
@@ -26,6 +77,10 @@ class PERMConsole(code.InteractiveConsole):
 def load_environ(mech, locals_dict):
     if 'mech' not in locals_dict:
         locals_dict['mech'] = mech
+    if isinstance(locals_dict, LazyNamespace):
+        # live view; nothing is copied
+        locals_dict.mech = mech
+        return
     locals_dict.update(mech.species_dict)
     locals_dict.update(mech.reaction_dict)
     try:
@@ -7,10 +7,19 @@ from .mechanisms import mechanism_dict, atoms
 from . import mechanisms
 from . import getmech
 from . import Shell
-from . import GUI
 from .getmech import get_pure_mech, get_prepared_mech
 get_mech = get_pure_mech
 
+def __getattr__(name):
+    """
+    GUI is imported on first use; wx/Tk are slow to import and
+    unavailable on headless systems
+    """
+    if name == 'GUI':
+        from importlib import import_module
+        return import_module('.GUI', __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 if __name__ == '__main__':
     from permm.main import parse_and_run
     parse_and_run()
\ No newline at end of file
@@ -2,6 +2,7 @@ from __future__ import print_function
 from pdb import set_trace
 from numpy import zeros, exp, newaxis, rollaxis
 from permm.core.Species import Species
+from permm.core.Mechanism import _block_axis
 from functools import reduce
 
 class matrix(object):
@@ -51,11 +52,11 @@ class matrix(object):
         tmp_init = mech('INIT')
         self.__old_shape = tmp_init[list(tmp_init.keys())[0]].shape
         self.__shape = [i for i in self.__old_shape]
-        self.__ntimes = mech.mrg.variables['TFLAG'].shape[-3]
-        for i, s in enumerate(self.__shape):
-            if s == self.__ntimes:
-                self.__shape[i] = self.__ntimes + 1
-                self.__time_dim = i
+        tflag = mech.mrg.variables['TFLAG']
+        self.__ntimes = tflag.shape[-3]
+        # time axis of process arrays from the merged file dimensions
+        self.__time_dim = len(self.__shape) + _block_axis(mech.mrg, tflag.dimensions[-3])
+        self.__shape[self.__time_dim] = self.__ntimes + 1
         self.__shape = tuple(self.__shape)
         
         self.run()
@@ -89,12 +90,12 @@ class matrix(object):
         ztemp = zeros(self.__old_shape, dtype = 'd')
 
         try:
-            Initial = mech('Initial')[node].array()
-            H_Trans = mech('H_Trans')[node].array()
-            V_Trans = mech('V_Trans')[node].array()
-            Motion = mech('Motion')[node].array()
-            Emissions = mech('Emissions')[node].array()
-            Deposition = mech('Deposit')[node].array()
+            Initial = mech.get_spc('Initial', node).array().copy()
+            H_Trans = mech.get_spc('H_Trans', node).array()
+            V_Trans = mech.get_spc('V_Trans', node).array()
+            Motion = mech.get_spc('Motion', node).array()
+            Emissions = mech.get_spc('Emissions', node).array()
+            Deposition = mech.get_spc('Deposit', node).array()
             
             # Initial concentrations are production terms only for the first hour
             rollaxis(Initial, self.__time_dim)[1:] = 0
@@ -131,9 +132,9 @@ class matrix(object):
         
         # Add initial, final, and (if available average) concentration
         try:
-            self.concentrations.setdefault(node.name,{})['Initial'] = mech('Initial')[node].array()
-            self.concentrations[node.name]['Final'] = mech('Final')[node].array()
-            average = self.concentrations[node.name]['Average'] = 0.5 * (mech('Final')[node].array() + mech('Initial')[node].array())
+            self.concentrations.setdefault(node.name,{})['Initial'] = mech.get_spc('Initial', node).array()
+            self.concentrations[node.name]['Final'] = mech.get_spc('Final', node).array()
+            average = self.concentrations[node.name]['Average'] = 0.5 * (mech.get_spc('Final', node).array() + mech.get_spc('Initial', node).array())
         except:
             self.concentrations.setdefault(node.name,{})['Initial'] = ztemp.copy()
             self.concentrations[node.name]['Final'] = ztemp.copy()
@@ -142,7 +143,7 @@ class matrix(object):
         
         # Add chemical losses
         for rxn in consumers:
-            total_loss += mech(rxn)[node]
+            total_loss += mech.get_spc(rxn, node)
         
         # For each producing reaction, trace traceable reactants
         for rxn in producers:
@@ -150,7 +151,7 @@ class matrix(object):
             reactants = mech.reaction_dict[rxn].reactants()
             
             # Get total net production of node by this reaction
-            produces = mech(rxn)[node].copy()
+            produces = mech.get_spc(rxn, node).copy()
             
             # Increment chemistry process
             self.producers[node.name]['Chemistry'] += produces
@@ -221,7 +222,7 @@ class matrix(object):
 
             # Load sources with initial values
             origin_sources['Initial'] = zeros(self.__shape, dtype = 'd')
-            origin_sources['Initial'][..., :-1] = self.concentrations[node]['Initial'][..., :]
+            rollaxis(origin_sources['Initial'], self.__time_dim)[:-1] = rollaxis(self.concentrations[node]['Initial'], self.__time_dim)
             
             # Losses are not origin specific
             loss_rate = self.losses[node]
@@ -22,7 +22,14 @@ def VOCTable(mech):
     result += PhyTable(mech, 'VOCC', speciated = True)
     return result
     
-def PhyTable(mech, spc, extended = True, process_list = default_procs, split_list = default_proc_split, speciated = False, initial = 'Initial'):
+def PhyTable(mech, spc, extended = True, process_list = default_procs, split_list = default_proc_split, speciated = False, initial = 'Initial', max_bytes = None):
+    """
+    Return a table of process values for spc at each time and their sum
+    
+    max_bytes - when provided, process values are computed from blocks
+                of time steps that fit in max_bytes (see 
+                Mechanism.run_blocks)
+    """
     tag = ('', '  --XT')[extended]
     
     result = '%s%s\n' % (spc, tag)
@@ -35,6 +42,9 @@ def PhyTable(mech, spc, extended = True, process_list = default_procs, split_lis
         spcs = spc_grp.names()+[spc]
     else:
         spcs = [spc]
+    
+    if max_bytes is not None:
+        mech = block_values(mech, ["%s[%s].array()" % (process, spc) for process in process_list for spc in spcs], max_bytes)
         
     for process in process_list:
         if speciated:
@@ -82,6 +92,27 @@ def PhyTable(mech, spc, extended = True, process_list = default_procs, split_lis
 
     return result
     
+def block_values(mech, exprs, max_bytes):
+    """
+    Return a function that looks up mech(expr) for exprs; values are
+    computed together from blocks of time steps that fit in max_bytes
+    (see Mechanism.run_blocks).  Expressions that raise KeyError raise
+    KeyError on lookup.
+    """
+    def evaluate(mech):
+        values = {}
+        for expr in exprs:
+            try:
+                values[expr] = mech(expr)
+            except KeyError:
+                pass
+        return values
+    
+    values = mech.run_blocks(evaluate, max_bytes = max_bytes)
+    def lookup(expr):
+        return values[expr].copy()
+    return lookup
+
 def display(mech, spc, process, label, condition = None, agg = lambda x: x.sum(), chemdetail = False):
     if condition is None:
         condition = lambda x: x
@@ -21,9 +21,31 @@ def time_line(hourly):
     
     return template % values
     
-def SumTable(mech):
-    nrxns = mech.nreaction_dict
+_net_rxn_names = ['Inorganic New Radical', 'ORG+hv radical source', 'Ox+org radical source', 'OH+(organic+NO2)', 'PAN Production',
+                  'CXO3 -> Radical', 'C2O3 -> Radical', 'MEO2 -> Radical', 'Whole_Mechanism', 'XO2_N_TO2 -> Radical', 
+                  'XO2_TO2 -> Radical', 'XO2N -> Radical', 'HCO3 -> Radical', 'HO2 -> Radical', 'Total OH Reacted', 
+                  'NO2 Photolysis1', 'NO+RO2 Oxidation', 'NO3+org radical source', 'NO2 Termination',
+                  'RXN_108', 'RXN_13', 'RXN_137', 'RXN_34', 'RXN_35', 'RXN_43', 'RXN_44', 'RXN_48', 'RXN_56', 'RXN_57', 
+                  'RXN_69', 'RXN_92', 'RXN_30']
+_exprs = ['make_net_rxn([OH, CO], [])', 'make_net_rxn([OH, VOC], [])', 'make_net_rxn([OH, HC], [])', 'make_net_rxn([OH, NO2], [])'] + \
+         ['%s[%s].array()' % (process, spc) for spc in ('NO2', 'NO') for process in ('Initial', 'Emissions', 'H_Trans', 'V_Trans', 'Motion', 'Final', 'Deposit')]
+
+def SumTable(mech, max_bytes = None):
+    """
+    Return radical and NOx budget tables for each time and their sum
+    
+    max_bytes - when provided, net reactions and process values are
+                computed from blocks of time steps that fit in max_bytes
+                (see Mechanism.run_blocks)
+    """
     globals().update(mech.species_dict)
+    if max_bytes is None:
+        nrxns = mech.nreaction_dict
+        evaluate = mech
+    else:
+        from .PhyTableMaker import block_values
+        evaluate = block_values(mech, _net_rxn_names + _exprs, max_bytes)
+        nrxns = dict([(name, evaluate(name)) for name in _net_rxn_names])
     time = mech.mrg.variables['TFLAG'][:,0,1]
     def header(title):
         result = '\n%s\n' % (title,)
@@ -230,13 +252,13 @@ def SumTable(mech):
     oh_propef = 1 - 1/oh_chain_length
     oh_propef_agg = 1 - 1/oh_chain_length_agg
 
-    oh_reacted_with_co = -mech.make_net_rxn([OH,CO],[])[OH]
+    oh_reacted_with_co = -evaluate('make_net_rxn([OH, CO], [])')[OH]
 
-    oh_reacted_with_voc = -mech.make_net_rxn([OH,VOC],[])[OH]
+    oh_reacted_with_voc = -evaluate('make_net_rxn([OH, VOC], [])')[OH]
     
-    oh_reacted_with_hc = -mech.make_net_rxn([OH, HC],[])[OH]
+    oh_reacted_with_hc = -evaluate('make_net_rxn([OH, HC], [])')[OH]
 
-    oh_reacted_with_no2 = -mech.make_net_rxn([OH,NO2],[])[OH]
+    oh_reacted_with_no2 = -evaluate('make_net_rxn([OH, NO2], [])')[OH]
 
     result += header('OH New, Prod, and Loss')
     result += sum_line('  nOH from CXO3', oh_from_new_cxo3)
@@ -257,19 +279,19 @@ def SumTable(mech):
     result += sum_line('OH + NO2', oh_reacted_with_no2)
 
     ### NO2 New, Prod, and Loss
-    no2_emissions = mech('Emissions[NO2].array()')
-    no2_htrans = mech('H_Trans[NO2].array()')
+    no2_emissions = evaluate('Emissions[NO2].array()')
+    no2_htrans = evaluate('H_Trans[NO2].array()')
     no2_htrans_gain = where(no2_htrans > 0, no2_htrans, 0)
     no2_htrans_loss = where(no2_htrans < 0, no2_htrans, 0)
-    no2_vtrans = mech('V_Trans[NO2].array()')
+    no2_vtrans = evaluate('V_Trans[NO2].array()')
     no2_vtrans_gain = where(no2_vtrans > 0, no2_vtrans, 0)
     no2_vtrans_loss = where(no2_vtrans < 0, no2_vtrans, 0)
-    no2_motion = mech('Motion[NO2].array()')
+    no2_motion = evaluate('Motion[NO2].array()')
     no2_motion_gain = where(no2_motion > 0, no2_motion, 0)
     no2_motion_loss = where(no2_motion < 0, no2_motion, 0)
   
-    no2_initial = mech('Initial[NO2]').array()
-    no2_carry  = mech('Initial[NO2]').array()
+    no2_initial = evaluate('Initial[NO2].array()').copy()
+    no2_carry  = evaluate('Initial[NO2].array()').copy()
     no2_initial[1:] = 0
     no2_carry[:1] = 0
 
@@ -320,8 +342,8 @@ def SumTable(mech):
     result += sum_line('Total Available NO2', no2_available, no2_available_agg)
     result += sum_line('Frac NO2 from chem', no2_frac_from_chem, no2_frac_from_chem_agg)
     
-    no2_final = -mech('Final[NO2]').array()
-    no2_dep = mech('Deposit[NO2]').array()
+    no2_final = -evaluate('Final[NO2].array()')
+    no2_dep = evaluate('Deposit[NO2].array()')
     
     no2_phy_loss = no2_final + no2_dep + no2_htrans_loss + no2_vtrans_loss + no2_motion_loss
     no2_phy_loss_agg = no2_final[-1] + (no2_dep + no2_htrans_loss + no2_vtrans_loss + no2_motion_loss).sum()
@@ -351,18 +373,18 @@ def SumTable(mech):
     no2_term = no2_to_pans + no2_to_ntr + no2_to_hno3
     no_new_sec = no2_new * no_per_no2
 
-    no_initial = mech('Initial[NO]').array()
-    no_carry  = mech('Initial[NO]').array()
+    no_initial = evaluate('Initial[NO].array()').copy()
+    no_carry  = evaluate('Initial[NO].array()').copy()
     no_initial[1:] = 0
     no_carry[:1] = 0
-    no_emissions = mech('Emissions[NO].array()')
-    no_htrans = mech('H_Trans[NO].array()')
+    no_emissions = evaluate('Emissions[NO].array()')
+    no_htrans = evaluate('H_Trans[NO].array()')
     no_htrans_gain = where(no_htrans > 0, no_htrans, 0)
     no_htrans_loss = where(no_htrans < 0, no_htrans, 0)
-    no_vtrans = mech('V_Trans[NO].array()')
+    no_vtrans = evaluate('V_Trans[NO].array()')
     no_vtrans_gain = where(no_vtrans > 0, no_vtrans, 0)
     no_vtrans_loss = where(no_vtrans < 0, no_vtrans, 0)
-    no_motion = mech('Motion[NO].array()')
+    no_motion = evaluate('Motion[NO].array()')
     no_motion_gain = where(no_motion > 0, no_motion, 0)
     no_motion_loss = where(no_motion < 0, no_motion, 0)
     no_from_o3_oxid = where(no2_phot[O3]<0, no2_phot[NO], 0)
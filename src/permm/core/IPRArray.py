@@ -1,5 +1,6 @@
 import sys
 from collections import defaultdict
+from functools import reduce
 from warnings import warn
 import unittest
 
@@ -8,14 +9,46 @@ from numpy import ndarray, \
                   array, \
                   newaxis, \
                   rollaxis, \
-                  arange
-
-from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+                  arange, \
+                  zeros, \
+                  number, \
+                  einsum, \
+                  ix_, \
+                  shares_memory
 
 from .Species import Species
 
 def Processes_ProcDelimSpcDict(proc_names, variables, delim = '_'):
-    return dict([(k, Process_ProcDelimSpcDict(k, variables, delim = delim)) for k in proc_names])
+    """
+    Create processes (proc_names) for all species in the variables
+    dictionary where each species/process combination is variable
+    with the key <proc_name><delim><spec name>.  All processes are
+    views of one dense IPRArray.
+    """
+    proc_names = list(proc_names)
+    species = []
+    proc_keys = []
+    for proc_name in proc_names:
+        prefix = '%s%s' % (proc_name, delim)
+        lp = len(prefix)
+        keys = dict([(k[lp:], k) for k in variables.keys() if k[:lp] == prefix])
+        species.extend([k for k in keys if k not in species])
+        proc_keys.append(keys)
+    
+    ipr = None
+    units = {}
+    for pi, keys in enumerate(proc_keys):
+        prc_units = units[proc_names[pi]] = {}
+        for spc, key in keys.items():
+            var = variables[key]
+            if ipr is None:
+                ipr = IPRArray(zeros((len(species), len(proc_names)) + var.shape, dtype = var[...].dtype), species, proc_names)
+            ipr.values[ipr.species_index[spc], pi] = var[...]
+            if hasattr(var, 'units'):
+                prc_units[spc] = var.units
+    if ipr is None:
+        ipr = IPRArray(zeros((0, len(proc_names))), species, proc_names)
+    return dict([(k, ipr.process(k, units = units[k], species = proc_keys[pi].keys())) for pi, k in enumerate(proc_names)])
 
 def Process_ProcDelimSpcDict(proc_name, variables, delim = '_'):
     """
@@ -26,20 +59,162 @@ def Process_ProcDelimSpcDict(proc_name, variables, delim = '_'):
     variables - dictionary with '%s%s%s' % (name, delim, speciesname)
     delim - delimiter
     """
-    prefix = '%s%s' % (proc_name, delim)
-    lp = len(prefix)
-    proc_keys = [k for k in list(variables.keys()) if k[:lp] == prefix]
-    process_variables = dict([(k[lp:], variables[k]) for k in proc_keys])
-    return Process(proc_name, **process_variables)
+    return Processes_ProcDelimSpcDict([proc_name], variables, delim = delim)[proc_name]
+
+def process_sums(term_lists):
+    """
+    Return a list of processes; each is the sum of weight * process for a
+    list of (weight, Process) terms in term_lists.  Values are the same as
+    reduce(Process.__add__, [weight * process, ...]).
+    
+    Terms that view one IPRArray are accumulated in a single pass into a
+    process weight vector; sums with identical weights share one vector.
+    Other sums are evaluated term by term.
+    
+    term_lists - list of lists of (weight, Process)
+    """
+    results = []
+    shared = {}
+    for terms in term_lists:
+        ipr = terms[0][1]._ipr
+        if not all([prc._ipr is ipr for weight, prc in terms]):
+            results.append(reduce(Process.__add__, [prc * weight for weight, prc in terms]))
+            continue
+        weights = zeros(len(ipr.processes), dtype = 'd')
+        names = ()
+        units = {}
+        species = _union([prc.keys() for weight, prc in terms])
+        for weight, prc in terms:
+            weights += weight * prc._weights
+            names += prc.names
+            for key in prc.keys():
+                prc_unit = prc.get_units(key)
+                unit = units.setdefault(key, prc_unit)
+                if unit != prc_unit:
+                    units[key] = '%s + %s' % (unit, prc_unit)
+        weights = shared.setdefault((id(ipr), weights.tobytes()), weights)
+        results.append(_process_view(' + '.join([prc.name for weight, prc in terms]), names, ipr, weights, units, species))
+    return results
+
+class IPRArray(object):
+    """
+    IPR values for a file held as one dense array with dimensions
+    (species, process, time...) and named-index lookups on the first
+    two axes.  Processes and process groups are views that carry a
+    vector of process weights.
+    """
+    def __init__(self, values, species, processes):
+        self.values = values
+        self.species = tuple(species)
+        self.processes = tuple(processes)
+        self.species_index = dict([(k, i) for i, k in enumerate(self.species)])
+        self.process_index = dict([(k, i) for i, k in enumerate(self.processes)])
+        if values.shape[:2] != (len(self.species), len(self.processes)):
+            raise ValueError("IPR values have shape %s; expected (%d species, %d processes, ...)" % (values.shape, len(self.species), len(self.processes)))
+    
+    def __getitem__(self, key):
+        """
+        Index the time dimension(s); the result shares memory
+        with this array wherever numpy indexing allows.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        return IPRArray(self.values[(slice(None), slice(None)) + key], self.species, self.processes)
+    
+    def process_weights(self, processes):
+        """
+        Unit weight vector for a process name or sequence of names
+        """
+        if isinstance(processes, str):
+            processes = [processes]
+        weights = zeros(len(self.processes), dtype = 'd')
+        for prc in processes:
+            weights[self.process_index[prc]] += 1
+        return weights
+    
+    def species_weights(self, species):
+        """
+        Indices and stoichiometric weights for a Species or species name
+        """
+        if isinstance(species, Species):
+            items = [(self.species_index[spc], prop['stoic']) for spc, prop in species.spc_dict.items()]
+        else:
+            items = [(self.species_index[species], 1.)]
+        return [i for i, w in items], array([w for i, w in items], dtype = 'd')
+    
+    def weighted_sum(self, species, process_weights):
+        """
+        Sum values over the species and process axes using
+        the stoichiometry of species and process_weights; floating
+        point values keep their dtype (e.g., float32 stays float32)
+        """
+        sidx, sweights = self.species_weights(species)
+        pidx = process_weights.nonzero()[0]
+        if len(sidx) == 1 and len(pidx) == 1 and sweights[0] == 1 and process_weights[pidx[0]] == 1:
+            return self.values[sidx[0], pidx[0]].copy()
+        result_type = self.values.dtype if self.values.dtype.kind in 'fc' else None
+        return einsum('s,p,sp...->...', sweights, process_weights[pidx], self.values[ix_(sidx, pidx)], dtype = result_type, casting = 'same_kind')
+    
+    def process(self, name, units = {}, species = None):
+        """
+        Process view of process name with keys species
+        (default: all species)
+        """
+        if species is None:
+            species = self.species
+        return _process_view(name, (name,), self, self.process_weights(name), units, species)
+    
+def _process_view(name, names, ipr, weights, units, species):
+    result = Process.__new__(Process)
+    result.name = name
+    result.names = names
+    result._Process__units = units.copy()
+    result._Process__default_unit = 'Unknown'
+    result._ipr = ipr
+    result._weights = weights
+    result._species = tuple(species)
+    return result
+
+def _union(key_lists):
+    """
+    Keys in any of key_lists in order of first appearance
+    """
+    keys = []
+    seen = set()
+    for key_list in key_lists:
+        for key in key_list:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+    return keys
+
+def _single_process(name, species, values):
+    """
+    IPRArray for one process from a list of values for species
+    """
+    if len(values) > 0:
+        values = array(values)[:, newaxis]
+    else:
+        values = zeros((0, 1))
+    return IPRArray(values, species, (name,))
+
+def _is_scalar(value):
+    return isinstance(value, (int, float, number)) or (isinstance(value, ndarray) and value.ndim == 0)
 
 class Process(object):
-    def __init__(self, name, units = {}, default_unit = None, **kwds):
+    """
+    A view of an IPRArray as a weighted sum of its processes
+    """
+    def __init__(self, name, units = {}, default_unit = 'Unknown', **kwds):
         self.name = name
         self.names = (name,)
         self.__units = units.copy()
-        self.data = {}
-        for k in list(kwds.keys()):
-            self.data[k] = kwds[k][:]
+        self.__default_unit = default_unit
+        species = list(kwds.keys())
+        self._ipr = _single_process(name, species, [kwds[k][...] for k in species])
+        self._weights = self._ipr.process_weights(name)
+        self._species = self._ipr.species
+        for k in species:
             if k in units:
                 self.__units[k] = units[k]
             elif hasattr(kwds[k], 'units'):
@@ -48,34 +223,64 @@ class Process(object):
                     self.__units[k] = kwdunits[k]
                 else:
                     self.__units[k] = kwdunits
-                    
-            
+    
+    @property
+    def data(self):
+        return dict([(k, self.__values(k)) for k in self.keys()])
+    
+    def __values(self, key):
+        names = key.spc_dict.keys() if isinstance(key, Species) else [key]
+        for spc in names:
+            if spc not in self._species:
+                raise KeyError(spc)
+        return self._ipr.weighted_sum(key, self._weights)
+    
     def __getitem__(self, key):
-        units = self.__units
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
         if isinstance(key, Species):
-            values = array([self.data[spc] * prop['stoic'] for spc, prop in list(key.spc_dict.items())]).sum(0)
-            units = dict([(k, self.__units[k]) for k in list(key.spc_dict.keys())])
-        elif key in list(self.data.keys()):
-            values = self.data[key]
-            units = {key: self.__units[key]}
+            values = self.__values(key)
+            units = dict([(k, self.__units.get(k, self.__default_unit)) for k in list(key.spc_dict.keys())])
+        elif isinstance(key, str):
+            values = self.__values(key)
+            units = {key: self.__units.get(key, self.__default_unit)}
         else:
-            new_data = dict([(k, v[key]) for k, v in self.data.items()])
-            units = {key: self.__units[key]}
-            return Process(self.name, self.__units, **new_data)
+            return _process_view(self.name, self.names, self._ipr[key], self._weights, self.__units, self._species)
         return PseudoNetCDFVariable(self, self.name, values.dtype.char, ('TSTEP',), values = values, units = units)
 
     def __setitem__(self, key, value):
-        return self.data.__setitem__(key, value)
+        """
+        Set values of species key; this process is first copied out
+        of the shared IPRArray so other views are unchanged
+        """
+        data = self.data
+        data[key] = value
+        species = list(data.keys())
+        self._ipr = _single_process(self.name, species, [data[k] for k in species])
+        self._weights = self._ipr.process_weights(self.name)
+        self._species = self._ipr.species
     
     def keys(self):
-        return list(self.data.keys())
+        return list(self._species)
+    
+    @property
+    def nbytes(self):
+        """
+        Bytes held by this view (the IPRArray is shared)
+        """
+        return self._weights.nbytes
+    
+    def rename(self, name):
+        """
+        View of this process named name
+        """
+        return _process_view(name, (name,), self._ipr, self._weights, self.__units, self._species)
         
     def set_units(self, k, units):
         if isinstance(k, Species):
             if set([k.name]) == set(k.names()) and not k.exclude:
                 self.__units[k.name] = units
             else:
-                result = set([self.__units[key] for key in k.names() if key in self.data])
+                result = set([self.get_units(key) for key in k.names() if key in self._species])
                 if len(result) == 1:
                     self.__units[k.name] = units
                 else:
@@ -88,52 +293,64 @@ class Process(object):
             if k.name in self.__units:
                 return self.__units.get(k.name, defaultunits)
             else:
-                result = set([self.__units[key] for key in k.names() if key in self.data])
+                result = set([self.get_units(key) for key in k.names() if key in self._species])
                 if len(result) == 1:
                     return result.pop()
                 else:
                     return defaultunits or 'mixed'
-        else:
+        elif k in self.__units:
             return self.__units[k]
+        elif k in self._species:
+            return self.__default_unit
+        else:
+            raise KeyError(k)
         
     def __getslice__(self, *args, **kwds):
         """
         Use standard ndarray.__getitem__, but retain
         NetRxnArray type
         """
-        result = Process(self.name, self.__units, **dict([('%s' % (k), v.__getslice__(*args, **kwds)) for k, v in self.data.items()]))
-        return result
+        return self[slice(*args)]
 
+    def __combine_units(self, result, rhs, operation):
+        for key in list(rhs.keys()):
+            rhs_unit = rhs.get_units(key)
+            if key in self._species:
+                result_unit = self.get_units(key)
+                if rhs_unit != result_unit:
+                    result.set_units(key, '%s %s %s' % (result_unit, operation, rhs_unit))
+            else:
+                result.set_units(key, rhs_unit)
+    
     def __generic_math_operator(self, rhs, operation):
         operator = {'+': ndarray.__add__,
                     '-': ndarray.__sub__,
-                    '/': ndarray.__div__,
+                    '/': ndarray.__truediv__,
                     '*': ndarray.__mul__
                    }[operation]
         if isinstance(rhs, self.__class__):
-            result = Process(name = '%s %s %s' % (self.name, operation, rhs.name))
-            result.names = self.names + rhs.names
-            for key in list(self.keys()):
-                result[key] = self.data[key].copy()
-                result.set_units(key, self.get_units(key))
-                
-            for key in list(rhs.keys()):
-                rhs_unit = rhs.get_units(key)
-                if key in result.data:
-                    result[key] = operator(result[key], rhs[key])
-                    result_unit = result.get_units(key)
-                    if rhs_unit != result_unit:
-                        result.set_units(key, '%s %s %s' % (result_unit, operation, rhs_unit))
-                else:
-                    result[key] = rhs[key].copy()
-                    result.set_units(key, rhs_unit)
+            name = '%s %s %s' % (self.name, operation, rhs.name)
+            if rhs._ipr is self._ipr and operation in '+-':
+                # Sums of processes from one array are just new weights
+                result = _process_view(name, self.names + rhs.names, self._ipr, operator(self._weights, rhs._weights), self.__units, _union([self._species, rhs._species]))
+            else:
+                data = self.data
+                for key, value in rhs.data.items():
+                    if key in data:
+                        data[key] = operator(data[key], value)
+                    else:
+                        data[key] = value
+                result = Process(name, units = self.__units, default_unit = self.__default_unit, **data)
+                result.names = self.names + rhs.names
+            self.__combine_units(result, rhs, operation)
+        elif _is_scalar(rhs) and operation in '*/':
+            result = _process_view(self.name, self.names, self._ipr, operator(self._weights, rhs), self.__units, self._species)
         else:
-            result = Process(name = self.name, units = self.__units.copy())
-            for key in list(self.keys()):
-                try:
-                    result[key] = operator(self[key], rhs)
-                except:
-                    raise TypeError("It is unclear how to %s IPR and %s; scalars, arrays, species and processes should have meaningful results" % (operation, type(rhs)))
+            try:
+                data = dict([(key, operator(self.__values(key), rhs)) for key in self.keys()])
+            except:
+                raise TypeError("It is unclear how to %s IPR and %s; scalars, arrays, species and processes should have meaningful results" % (operation, type(rhs)))
+            result = Process(self.name, units = self.__units, default_unit = self.__default_unit, **data)
             
         return result
         
@@ -145,7 +362,9 @@ class Process(object):
         
     def __div__(self,rhs):
         return self.__generic_math_operator(rhs, '/')
-        
+    
+    __truediv__ = __div__
+    
     def __mul__(self,rhs):
         return self.__generic_math_operator(rhs, '*')
         
@@ -153,15 +372,16 @@ class Process(object):
         """
         Sum species over time
         """
-        result = Process(name = self.name)
-        for key in list(self.keys()):
-            result[key] = array(self.data[key].sum(), ndmin = 1)
-        
-        return result
+        pidx = self._weights.nonzero()[0]
+        values = self._ipr.values[:, pidx]
+        values = values.reshape(values.shape[:2] + (-1,)).sum(-1)[..., newaxis]
+        ipr = IPRArray(values, self._ipr.species, [self._ipr.processes[i] for i in pidx])
+        return _process_view(self.name, self.names, ipr, self._weights[pidx], self.__units, self._species)
     
 class TestProcess(unittest.TestCase):
     def setUp(self):
         from PseudoNetCDF import PseudoNetCDFFile
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
         mrg = self.mrg = PseudoNetCDFFile()
         mrg.createDimension('TSTEP', 9)
         mrg.variables = dict(EMIS_NO = PseudoNetCDFVariable(mrg, 'EMIS', 'f', ('TSTEP'), values = arange(9), units = 'ppb'),
@@ -218,5 +438,67 @@ class TestProcess(unittest.TestCase):
         self.assertTrue(self.processes['EMIS'].get_units(NO) == 'ppb')
         self.assertTrue(self.processes['CHEM'].get_units(NO) == 'Unknown')
 
+    def testKeys(self):
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+        self.mrg.variables['EMIS_CO'] = PseudoNetCDFVariable(self.mrg, 'EMIS', 'f', ('TSTEP'), values = arange(9), units = 'ppb')
+        processes = Processes_ProcDelimSpcDict('EMIS CHEM'.split(), self.mrg.variables)
+        emis, chem = processes['EMIS'], processes['CHEM']
+        self.assertEqual(set(emis.keys()), set(['NO', 'NO2', 'CO']))
+        self.assertEqual(set(chem.keys()), set(['NO', 'NO2']))
+        self.assertRaises(KeyError, chem.__getitem__, 'CO')
+        self.assertRaises(KeyError, chem.get_units, 'CO')
+        self.assertEqual(set((emis + chem).keys()), set(['NO', 'NO2', 'CO']))
+        self.assertEqual(set(chem[:3].keys()), set(['NO', 'NO2']))
+    
+    def testSetItem(self):
+        emis = self.processes['EMIS']
+        chem = self.processes['CHEM']
+        total = emis + chem
+        emis['NO'] = arange(9) * 3
+        self.assertTrue((emis['NO'] == arange(9) * 3).all())
+        self.assertTrue((chem['NO'] == arange(9)).all())
+        self.assertTrue((total['NO'] == arange(9) * 2).all())
+        self.assertTrue((emis['NO2'] == arange(9)).all())
+
+class TestIPRArray(unittest.TestCase):
+    def setUp(self):
+        self.ipr = IPRArray(arange(2 * 3 * 4, dtype = 'f').reshape(2, 3, 4), ['NO', 'NO2'], ['EMIS', 'CHEM', 'DDEP'])
+        self.NOx = Species('NO') + Species('NO2')
+
+    def testViews(self):
+        ipr = self.ipr
+        emis = ipr.process('EMIS')
+        chem = ipr.process('CHEM')
+        self.assertFalse(shares_memory(emis['NO'], ipr.values))
+        self.assertTrue(shares_memory(emis[:2]._ipr.values, ipr.values))
+        total = emis + chem - ipr.process('DDEP') * .5
+        self.assertTrue(total._ipr is ipr)
+        self.assertEqual(total.names, ('EMIS', 'CHEM', 'DDEP'))
+        check = ipr.values[:, 0] + ipr.values[:, 1] - ipr.values[:, 2] * .5
+        self.assertTrue((total[self.NOx] == check.sum(0)).all())
+        self.assertTrue((total.sum()[self.NOx] == check.sum()).all())
+
+    def testProcessSums(self):
+        ipr = self.ipr
+        emis = ipr.process('EMIS')
+        chem = ipr.process('CHEM')
+        ddep = ipr.process('DDEP')
+        total, check, other = process_sums([[(1, emis), (1, chem), (2, ddep)], [(1, chem), (1, emis), (2, ddep)], [(1, emis)]])
+        self.assertTrue(total._weights is check._weights)
+        self.assertEqual(total.names, ('EMIS', 'CHEM', 'DDEP'))
+        self.assertTrue((total[self.NOx] == (emis + chem + ddep * 2)[self.NOx]).all())
+        self.assertTrue((other['NO'] == emis['NO']).all())
+        self.assertEqual(total[self.NOx].dtype, ipr.values.dtype)
+        self.assertEqual((emis - chem * .5)['NO'].dtype, ipr.values.dtype)
+
+    def testNamedIndex(self):
+        ipr = self.ipr
+        self.assertEqual(ipr.species_index['NO2'], 1)
+        self.assertEqual(ipr.process_index['DDEP'], 2)
+        self.assertTrue((ipr.process_weights(['EMIS', 'DDEP']) == [1, 0, 1]).all())
+        self.assertTrue((ipr.weighted_sum(self.NOx, ipr.process_weights('CHEM')) == ipr.values[:, 1].sum(0)).all())
+        self.assertRaises(KeyError, ipr.process, 'WADV')
+        self.assertRaises(ValueError, IPRArray, ipr.values, ['NO'], ipr.processes)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
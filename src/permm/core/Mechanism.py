@@ -3,22 +3,33 @@ import operator
 import yaml
 import re
 import sys
+import os
+import ast
+import builtins
+import pickle
+import hashlib
 from numpy import * # Explicitly using dtype, array and ndarray; providing all default numpy to __call__interface
 from warnings import warn
 
-from PseudoNetCDF.sci_var import PseudoNetCDFVariable
 
-from .Species import Species, species_sum
-from .Reaction import Reaction
-from .IPRArray import Processes_ProcDelimSpcDict, Process
+from .Species import Species, species_sum, species_from_defs
+from .Reaction import Reaction, LazyReaction, ParseReactionStrings, reaction_sum, reaction_sums
+from .StoicMatrix import StoicMatrix
+from .IPRArray import Processes_ProcDelimSpcDict, Process, IPRArray, process_sums
 
-from permm.graphing.timeseries import irr_plot, phy_plot, plot as tplot
-from permm.Shell import load_environ
-from permm.netcdf import NetCDFVariable
+from permm.Shell import load_environ, LazyNamespace
+from permm.utils import AttrDict, LazyDict, LRUCache
 from functools import reduce
 
 __all__ = ['Mechanism']
 
+_cache_version = 3
+_missing = object()
+_block_overhead = 4 # bytes in memory for each byte of IRR/IPR in a block (values, reactions and results)
+_tile_task = None
+_block_state = ('mrg', 'irr', 'irr_dict', 'nreaction_dict', 'process_dict', '_Mechanism__use_net_rxns', '_Mechanism__workers', '_Mechanism__query_cache')
+_code_signature = None
+
 _spc_def_re = re.compile(r'(?P<stoic>[-+]?[0-9]*\.?[0-9]+)(?P<atom>\S+)(?=\s*\+\s*)?')
 _numre = re.compile('(\d+)')
 
@@ -51,6 +62,7 @@ class Mechanism(object):
         eqnmech = cls.from_eqns(eqnm[0][:-1], verbose=verbose)
         varmech.species_dict.update(fixmech.species_dict)
         varmech.reaction_dict.update(eqnmech.reaction_dict)
+        varmech.__update_stoic_matrix()
         return varmech
 
     @classmethod
@@ -83,20 +95,19 @@ class Mechanism(object):
         """
         Create a mechanism from a KPP-style eqn string
         """
+        eqnstr = re.compile(r'^\s*#EQUATIONS.*$', re.MULTILINE).sub(r'', eqnstr)
+        eqnstr = re.compile(r'//.*$', re.MULTILINE).sub(r'', eqnstr)
         eqnstr = re.compile(r'(?<![;}])\s*\n').sub(r'', eqnstr)
-        eqnstr = re.compile(r'^//.+?$', re.MULTILINE).sub(r'', eqnstr)
         textlines = eqnstr.split('\n')
         rxnlines = [l.split(':')[0] for l in textlines if l.strip() != '#EQUATIONS' and l.strip() != '']
         rxntxt = '\n'.join(rxnlines)
         rxntxt = re.compile(r'[ \t]+').sub(' ', rxntxt)
         rxntxt = re.compile(r'^\s*[<{](.+?)\.?[>}]', re.MULTILINE).sub(r'    IRR_\1: ', rxntxt)
         rxntxt = re.compile(r'{(.+?)}').sub(r'\1', rxntxt)
-        rxntxt = 'reaction_list:\n' + rxntxt
-        from io import StringIO
         if verbose > 0:
-            print(rxntxt)
-        rxndict = yaml.load(StringIO(rxntxt))
-        return cls(rxndict)
+            print('reaction_list:\n' + rxntxt)
+        rxnlist = dict([(l.partition(':')[0].strip(), l.partition(':')[2].strip()) for l in rxntxt.split('\n') if l.strip() != ''])
+        return cls(dict(reaction_list = rxnlist))
         
     def __init__(self, yaml_path):
         """
@@ -111,43 +122,103 @@ class Mechanism(object):
                             (i.e. NAME: RXN_01 + RXN_02)
         process_group_list - a dictionary of process additions
                             (i.e. VertAdv = Top_Adv + Bottom_Adv)
+        
+        When $PERMM_CACHE is set, mechanisms from yaml paths or text 
+        are cached (see _cache_path)
         """
-        import os
+        cache_path = None
         if isinstance(yaml_path,str):
             if os.path.exists(yaml_path):
-                yaml_file = yaml.load(open(yaml_path))
+                yaml_text = open(yaml_path).read()
             else:
-                yaml_file = yaml.load(yaml_path)
+                yaml_text = yaml_path
+            cache_path = _cache_path(yaml_text)
+            if self.__load_cache(cache_path):
+                return
+            yaml_file = yaml.load(yaml_text)
         elif isinstance(yaml_path,dict):
             yaml_file = yaml_path
         
+        self.__data_version = 0
+        self.result_cache = None
+        self.__lazy = False
         self.__yaml_file = yaml_file
         self.mechanism_comment = yaml_file.get('comment', '')
-        self.species_dict = dict()
-
-        for spc, spc_def in yaml_file.get('species_list', {}).items():
-            self.species_dict[spc] = Species("'" + spc + "': " + spc_def)
+        self.species_dict = species_from_defs(yaml_file.get('species_list', {}))
                         
+        stoics, reaction_types, failed = ParseReactionStrings(yaml_file.get('reaction_list', {}))
+        if len(failed) > 0:
+            raise SyntaxError("Reactions must match the following patter\n\n<%%d> stoic*spc ([+-] stoic*spc)* =[kjude]> [stoic*spc] ([+-] stoic*spc)*\n\n%s" % '\n'.join(['%s: %s' % (k, v) for k, v in sorted(failed.items())]))
+        
         self.reaction_dict = dict()
-        reaction_species = []
-        for rxn_name, rxn_str in yaml_file.get('reaction_list', {}).items():
-            rxn = self.reaction_dict[rxn_name] = Reaction(rxn_str)
-            reaction_species += rxn.species()
+        reaction_species = set()
+        for rxn_name, stoic in stoics.items():
+            self.reaction_dict[rxn_name] = Reaction(stoic, reaction_types[rxn_name], copy = False)
+            reaction_species.update([spc for spc, role in stoic])
         
-        reaction_species = set(reaction_species)
-        for spc in [spc for spc in reaction_species if spc not in self.species_dict]:
-            self.species_dict[spc] = Species(spc + ': IGNORE')
+        self.species_dict.update(species_from_defs(dict([(spc, 'IGNORE') for spc in reaction_species if spc not in self.species_dict])))
+
+        self.__update_stoic_matrix()
 
         for spc_grp_def in yaml_file.get('species_group_list',[]):
             grp_name = spc_grp_def.split('=')[0].strip()
             if (spc_grp_def.count('+') + spc_grp_def.count('-')) > 4:
                 spc_grp_def = '=species_sum(['.join(spc_grp_def.replace('+',',').replace('-',',').split('='))+'])'
             exec(spc_grp_def, None, self.species_dict)
-            self.species_dict[grp_name].name = grp_name
+            spc_grp = self.species_dict[grp_name]
+            self.species_dict[grp_name] = Species(spc_grp, name = grp_name, exclude = spc_grp.exclude)
 
         self.net_reaction_dict = yaml_file.get('net_reaction_list',{})
-        self.variables = {}
+        self.__net_weights = dict([(nrxn, _linear_weights(nrxn)) for nrxn in self.net_reaction_dict.values()])
+        self.__process_weights = dict([(prc_name, _linear_weights(prc)) for prc_name, prc in yaml_file.get('process_group_list', {}).items()])
+        self.__save_cache(cache_path)
+        self.__expressions = {}
+        self.variables = LazyNamespace()
+        load_environ(self, self.variables)
+    
+    def __load_cache(self, cache_path):
+        """
+        Restore a compiled mechanism from cache_path; returns False when
+        there is no usable cache
+        """
+        if cache_path is None or not os.path.exists(cache_path):
+            return False
+        if hasattr(os, 'getuid') and os.stat(cache_path).st_uid != os.getuid():
+            warn("Ignoring %s; it is owned by another user" % cache_path)
+            return False
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                version, state = pickle.load(cache_file)
+        except Exception:
+            return False
+        if version != _cache_version:
+            return False
+        self.__dict__.update(state)
+        self.__expressions = {}
+        self.result_cache = None
+        self.__lazy = False
+        self.variables = LazyNamespace()
         load_environ(self, self.variables)
+        return True
+    
+    def __save_cache(self, cache_path):
+        """
+        Save the compiled mechanism to cache_path; failures (e.g., read 
+        only cache directories) are ignored
+        """
+        if cache_path is None:
+            return
+        state = dict([(k, v) for k, v in self.__dict__.items() if k != 'variables'])
+        try:
+            cache_dir = os.path.dirname(cache_path)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump((_cache_version, state), cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            pass
             
     def __call__(self, expr, env = None):
         """
@@ -156,14 +227,99 @@ class Mechanism(object):
         
         expr - string to evaluate
         env - optional, global environment that defaults to globals()
+        
+        Expressions are compiled once (see _Expression); names are 
+        resolved again only after mechanism data changes and linear
+        sums of reactions or processes are evaluated in one pass.  With
+        a result cache (see set_result_cache), results are reused.
         """
+        if env is None and self.result_cache is not None and isinstance(expr, str):
+            return self.__cached_result((expr, self.__bound_names(expr)), lambda: self.__evaluate(expr, globals()))
+        return self.__evaluate(expr, env)
+    
+    def __evaluate(self, expr, env):
         if env is None:
             env = globals()
 
-        try:
-            return self.variables[expr]
-        except:
-            return eval(expr, env, self.variables)
+        compiled = self.__expressions.get(expr) if isinstance(expr, str) else None
+        if compiled is None:
+            try:
+                return self.variables[expr]
+            except:
+                pass
+            if not isinstance(expr, str):
+                return eval(expr, env, self.variables)
+            compiled = self.__expressions[expr] = _Expression(expr)
+        return compiled(self.variables, env, self.__data_version, self.__lazy)
+    
+    def get_spc(self, expr, species):
+        """
+        Return mech(expr)[species] (e.g., mech.get_spc('Initial', NO2));
+        the result is cached when the result cache is on
+        """
+        if self.result_cache is not None and isinstance(expr, str):
+            return self.__cached_result((expr, self.__bound_names(expr), species), lambda: self(expr)[species])
+        return self(expr)[species]
+    
+    def set_result_cache(self, max_bytes = 2**28):
+        """
+        Cache results of mech(expr) and get_spc in up to max_bytes 
+        (least recently used results are evicted); max_bytes = None
+        turns the cache off.  Results are shared between calls, so
+        they should not be modified in place.  The cache is emptied
+        when data change (e.g., set_mrg, set_irr or set_ipr).
+        
+        Statistics are available from mech.result_cache.stats()
+        """
+        if max_bytes is None:
+            self.result_cache = None
+        else:
+            self.result_cache = LRUCache(max_bytes)
+    
+    def __bound_names(self, expr):
+        """
+        Return references (see _Bound) to values of names in expr that
+        are set in variables (e.g., by the Shell); cached results are
+        reused only while these names are bound to the same objects
+        """
+        compiled = self.__expressions.get(expr)
+        if compiled is None:
+            try:
+                compiled = self.__expressions[expr] = _Expression(expr)
+            except SyntaxError:
+                compiled = None
+        names = [expr] if compiled is None else compiled.names
+        return tuple([_Bound(dict.__getitem__(self.variables, name)) if dict.__contains__(self.variables, name) else None for name in names])
+    
+    def __cached_result(self, key, evaluate):
+        """
+        Return the cached result for key and the current data version,
+        calling evaluate() when it is not cached
+        """
+        key = key + (self.__data_version,)
+        result = self.result_cache.get(key, _missing)
+        if result is _missing:
+            result = evaluate()
+            self.result_cache.put(key, result)
+        return result
+    
+    def set_lazy(self, lazy = True):
+        """
+        Evaluate reactions in mech(expr) with deferred algebra (see 
+        Reaction.LazyReaction); values are computed when results are 
+        summed, averaged, converted to arrays or printed
+        """
+        self.__lazy = lazy
+        self.__data_changed()
+    
+    def __data_changed(self):
+        """
+        Mark mechanism data as changed; compiled names are resolved 
+        again and cached results are dropped
+        """
+        self.__data_version += 1
+        if self.result_cache is not None:
+            self.result_cache.clear()
     
     def __getitem__(self,item):
         """
@@ -171,7 +327,43 @@ class Mechanism(object):
         groups, reactions, net reactions and processes
         """
         return self.variables[item]
-        
+
+    def __update_stoic_matrix(self):
+        """
+        Rebuild the sparse species x reaction stoichiometry matrix
+        (stoic_matrix); must be called whenever reaction_dict changes
+        """
+        self.stoic_matrix = StoicMatrix.from_reactions(self.reaction_dict)
+        self.__query_cache = {}
+        self.__data_changed()
+
+    def __query_key(self, *args):
+        """
+        Normalize query arguments for the query cache; species are
+        represented by their subspecies roles, stoichiometry and exclude
+        and reaction types are order independent
+        """
+        key = []
+        for arg in args:
+            if isinstance(arg, Species):
+                arg = (frozenset([(spc, frozenset(props['role']), props['stoic']) for spc, props in arg.spc_dict.items()]), arg.exclude)
+            elif isinstance(arg, list):
+                arg = self.__query_key(*arg)
+            key.append(arg)
+        return tuple(key)
+    
+    def __cached_query(self, key, query):
+        """
+        Return a copy of the cached result for key, calling query() 
+        when key is not cached; the cache is cleared when reactions 
+        or IRR change
+        """
+        try:
+            result = self.__query_cache[key]
+        except KeyError:
+            result = self.__query_cache[key] = query()
+        return list(result)
+
     def __add_spc_to_reactions(self,rxn_list, spc):
         """
         Add a species to a reaction as an accumulation of components
@@ -190,6 +382,7 @@ class Mechanism(object):
         for rxn in rxn_list:
             self.reaction_dict[rxn] = self.reaction_dict[rxn] + spc
         
+        self.__update_stoic_matrix()
         return len(rxn_list)
     
     def __ensure_species(self,spc):
@@ -243,6 +436,7 @@ class Mechanism(object):
                 new_rxn_def[rxn_name] = rxn
         
         self.reaction_dict.update(new_rxn_def)
+        self.__update_stoic_matrix()
 
         return len(new_rxn_def)
     
@@ -268,6 +462,18 @@ class Mechanism(object):
                       True: reaction is in both filters (i.e. reactants AND products)
                       False: reaction is in either filter (i.e. reactants OR products)
         """
+        if isinstance(reactants, (Species, str)):
+            reactants = [reactants]
+        reactants = [self.__ensure_species(spc) for spc in reactants]
+        if isinstance(products, (Species, str)):
+            products = [products]
+        products = [self.__ensure_species(spc) for spc in products]
+        if sortby is not None:
+            sortby = self.__ensure_species(sortby)
+        key = self.__query_key('get_irrs', reactants, products, bool(logical_and), _type_key(reaction_type), sortby)
+        return self.__cached_query(key, lambda: self.__get_irrs(reactants, products, logical_and, reaction_type, sortby))
+    
+    def __get_irrs(self, reactants, products, logical_and, reaction_type, sortby):
         result = [self(rk) for rk in self.find_rxns(reactants = reactants, products = products, logical_and = logical_and, reaction_type = reaction_type)]
         if sortby is None:
             return result
@@ -288,17 +494,24 @@ class Mechanism(object):
         
         
         """
-        result = [(rxn_name, rxn) for rxn_name, rxn in self.reaction_dict.items()]
-        if not reaction_type is None:
-            result = [(rn, rx) for rn, rx in result if rx.reaction_type in reaction_type]
-        
         if not spcs is None:
             if not isinstance(spcs, list):
                 spcs = [spcs]
             spcs = [self.__ensure_species(spc) for spc in spcs]
         
-            result = [(rn, rx) for rn, rx in result if all([spc in rx for spc in spcs])]
-        return [rn for rn, rx in result]
+        key = self.__query_key('filter_rxns', spcs, _type_key(reaction_type))
+        return self.__cached_query(key, lambda: self.__filter_rxns(spcs, reaction_type))
+    
+    def __filter_rxns(self, spcs, reaction_type):
+        index = self.stoic_matrix
+        result = index.all_bits
+        if not reaction_type is None:
+            result &= index.type_bits(reaction_type)
+        
+        if not spcs is None:
+            for spc in spcs:
+                result &= index.bits(spc)
+        return index.names(result)
     
     def find_rxns(self, reactants = [], products = [], logical_and = True, reaction_type = None):
         """
@@ -319,34 +532,30 @@ class Mechanism(object):
             products = [products]
 
         products = [self.__ensure_species(spc) for spc in products]
-            
-        result = [(rxn_name, rxn) for rxn_name, rxn in self.reaction_dict.items()]
         
-        if reactants != []:
-            reactant_result = [rxn_name for rxn_name, rxn in result if all([rxn.has_rct(rct) for rct in reactants])]
-        else:
-            reactant_result = [rn for rn, rv in result]
+        key = self.__query_key('find_rxns', reactants, products, bool(logical_and), _type_key(reaction_type))
+        return self.__cached_query(key, lambda: self.__find_rxns(reactants, products, logical_and, reaction_type))
+    
+    def __find_rxns(self, reactants, products, logical_and, reaction_type):
+        index = self.stoic_matrix
         
-        if products != []:
-            product_result = [rxn_name for rxn_name, rxn in result if all([rxn.has_prd(prd) for prd in products])]
-        else:
-            product_result = [rn for rn, rv in result]
-                
+        reactant_result = index.all_bits
+        for rct in reactants:
+            reactant_result &= index.bits(rct, 'r')
+        
+        product_result = index.all_bits
+        for prd in products:
+            product_result &= index.bits(prd, 'p')
             
         if logical_and:
-            reaction_list = set(reactant_result).intersection(product_result)
+            reaction_list = reactant_result & product_result
         else:
-            reaction_list = set(reactant_result + product_result)
+            reaction_list = reactant_result | product_result
 
         if reaction_type is not None:
-            reaction_result = [rn for rn, rv in result if rv.reaction_type in reaction_type]
-            reaction_list = reaction_list.intersection(reaction_result)
+            reaction_list &= index.type_bits(reaction_type)
 
-        
-        result = list(reaction_list)
-        result.sort()
-        
-        return result
+        return index.names(reaction_list)
     
     def yaml_net_rxn(self, rxns):
         """
@@ -375,19 +584,19 @@ class Mechanism(object):
         """
         rxns = self.find_rxns(reactants = reactants, products = products, logical_and = logical_and, reaction_type = reaction_type)
         if len(rxns) > 1:
-            eval_str = ' + '.join(rxns)
             if name is None:
-                name = eval_str.replace(' + ', 'pl')
-            nrxn = eval(eval_str, globals(), self.irr_dict)
+                name = 'pl'.join(rxns)
+            nrxn = reaction_sum([self.irr_dict[rxn] for rxn in rxns])
             if netspc:
                 nrxn = nrxn.net()
             
             for rxn in rxns:
                 del self.irr_dict[rxn]
                 del self.reaction_dict[rxn]
-                del self.variables[rxn]
+                self.variables.pop(rxn, None)
             self.irr_dict[name] = nrxn
             self.reaction_dict[name] = nrxn.sum()
+            self.__update_stoic_matrix()
             load_environ(self, self.variables)
 
     def subst_these_rxns(self, rxns, name = None):
@@ -410,7 +619,7 @@ class Mechanism(object):
             irrs = rxns
             rxns = []
             for irr in irrs:
-                for rxnkey, crxn in self.irr_dict.items():
+                for rxnkey, crxn in self.irr_dict.loaded_items():
                     if irr is crxn:
                         rxns.append(rxnkey)
                         break
@@ -422,16 +631,16 @@ class Mechanism(object):
             raise ValueError('Reactions must be all strings (i.e. keys) or objects')
                 
         if len(rxns) > 1:
-            eval_str = ' + '.join(rxns)
             if name is None:
-                name = eval_str.replace(' + ', 'pl')
-            nrxn = eval(eval_str, globals(), self.irr_dict)
+                name = 'pl'.join(rxns)
+            nrxn = reaction_sum([self.irr_dict[rxn] for rxn in rxns])
             for rxn in rxns:
                 del self.irr_dict[rxn]
                 del self.reaction_dict[rxn]
-                del self.variables[rxn]
+                self.variables.pop(rxn, None)
             self.irr_dict[name] = nrxn
             self.reaction_dict[name] = nrxn.sum()
+            self.__update_stoic_matrix()
             load_environ(self, self.variables)
         
         
@@ -445,10 +654,152 @@ class Mechanism(object):
         rxns = self.find_rxns(reactants = reactants, products = products, logical_and = logical_and, reaction_type = reaction_type)
         if len(rxns) == 0:
             return Reaction(stoic = dict())
-        result = self(' + '.join(rxns))
+        if not hasattr(self, 'irr_dict'):
+            # Without IRR, reactions are scalar and can be net in the matrix
+            stoic, reaction_type = self.stoic_matrix.net(rxns)
+            return Reaction(stoic, reaction_type = reaction_type)
+        return reaction_sum([self(rxn) for rxn in rxns])
+
+    def get_budget(self):
+        """
+        Return gross production, gross loss (positive) and net chemical
+        change for every species in the reactions as an AttrDict with
+        keys species, production, loss and net.  production, loss and net
+        are arrays with dimensions (species, ...) where ... are the IRR 
+        dimensions.
+        
+        All species are computed in one contraction of the stoichiometry
+        matrix with the IRR; for a single species, the result is 
+        equivalent to nrxn.produces(spc), nrxn.consumes(spc) and nrxn[spc]
+        where nrxn = make_net_rxn(spc, spc, logical_and = False).
+        """
+        if not hasattr(self, 'irr_dict'):
+            raise ValueError("IRR data is required for budgets; use set_irr or set_mrg")
+        rates, explicit = self.__irr_stack()
+        production, loss = self.stoic_matrix.budget(rates)
+        species_index = self.stoic_matrix.species_index
+        for ri, rxn in explicit:
+            for (spc, role), value in rxn._stoic.items():
+                si = species_index[spc]
+                value = asarray(value)
+                if role == 'p':
+                    production[si] += value
+                elif role == 'r':
+                    loss[si] -= value
+                else:
+                    production[si] += maximum(value, 0.)
+                    loss[si] -= minimum(value, 0.)
+        return AttrDict(species = self.stoic_matrix.species, production = production, loss = loss, net = production - loss)
+    
+    def get_family_budget(self, families = None):
+        """
+        Return gross production, gross loss (positive) and net chemical
+        change of species families in every reaction as an AttrDict with
+        keys families, reactions, production, loss and net.  production,
+        loss and net are arrays with dimensions (family, reaction, ...) 
+        where ... are the IRR dimensions.
+        
+        families - list of Species or names; defaults to the species 
+                   groups of the mechanism (e.g., NOx, NOy)
+        
+        Families are stacked into one weight matrix (see 
+        StoicMatrix.family_weights); net is equivalent to rxn[family] 
+        for each reaction in irr_dict.
+        """
+        if not hasattr(self, 'irr_dict'):
+            raise ValueError("IRR data is required for budgets; use set_irr or set_mrg")
+        if families is None:
+            families = [spc_grp_def.split('=')[0].strip() for spc_grp_def in self.__yaml_file.get('species_group_list', [])]
+        families = [self.species_dict[family] if isinstance(family, str) else family for family in families]
+        weights = self.stoic_matrix.family_weights(families)
+        rates, explicit = self.__irr_stack()
+        production, loss = self.stoic_matrix.family_budget(weights, rates)
+        species_index = self.stoic_matrix.species_index
+        for ri, rxn in explicit:
+            for (spc, role), value in rxn._stoic.items():
+                value = asarray(value)
+                # planes are reactant, product, positive and negative unspecified
+                plane = weights[:, species_index[spc]].reshape((len(families), 4) + (1,) * value.ndim)
+                if role == 'p':
+                    production[:, ri] += plane[:, 1] * value
+                elif role == 'r':
+                    loss[:, ri] -= plane[:, 0] * value
+                else:
+                    production[:, ri] += plane[:, 2] * maximum(value, 0.)
+                    loss[:, ri] -= plane[:, 3] * minimum(value, 0.)
+        return AttrDict(families = [family.name for family in families], reactions = self.stoic_matrix.reactions, production = production, loss = loss, net = production - loss)
+    
+    def get_atom_balance(self, elements = ('C', 'N', 'O', 'H', 'S')):
+        """
+        Return the element imbalance (products - reactants) of every 
+        reaction as an AttrDict with keys elements, reactions, composition,
+        imbalance, incomplete and, when IRR is loaded, flux.
+        
+            composition - array (species, element) from species atoms
+            imbalance - array (reaction, element) of atoms per reaction
+            incomplete - boolean array (reaction,); True for reactions
+                         with species that have no atoms (e.g., IGNORE)
+            flux - imbalance * IRR with dimensions (reaction, element, ...)
+                   where ... are the IRR dimensions
         
+        elements - atoms to check
+        """
+        matrix = self.stoic_matrix
+        composition = zeros((len(matrix.species), len(elements)), dtype = 'd')
+        has_atoms = zeros(len(matrix.species), dtype = 'bool')
+        for si, spc in enumerate(matrix.species):
+            spc_dict = self.species_dict[spc].spc_dict if spc in self.species_dict else {}
+            atoms = spc_dict.get(spc, {}).get('atoms', {})
+            has_atoms[si] = len(atoms) > 0
+            for ei, element in enumerate(elements):
+                composition[si, ei] = atoms.get(element, 0)
+        
+        imbalance = matrix.element_balance(composition)
+        incomplete = zeros(len(matrix.reactions), dtype = 'bool')
+        incomplete[matrix.rxn_idx[~has_atoms[matrix.spc_idx]]] = True
+        result = AttrDict(elements = list(elements), reactions = matrix.reactions, composition = composition, imbalance = imbalance, incomplete = incomplete)
+        if hasattr(self, 'irr_dict'):
+            rates, explicit = self.__irr_stack()
+            result.flux = flux = imbalance.reshape(imbalance.shape + (1,) * (rates.ndim - 1)) * rates[:, newaxis]
+            for ri, rxn in explicit:
+                for (spc, role), value in rxn._stoic.items():
+                    value = asarray(value)
+                    flux[ri] += composition[matrix.species_index[spc]].reshape((-1,) + (1,) * value.ndim) * value
         return result
-
+    
+    def __irr_stack(self):
+        """
+        Return IRR rates (reaction, ...) in stoic_matrix reaction order 
+        and [(reaction index, Reaction)] for irr_dict reactions without
+        a shared rate (e.g., from subst_net_rxn or add_rxn).  Rates of 
+        those reactions and of reactions without IRR are zero; budgets
+        add the stoichiometry arrays of those reactions instead.
+        
+        Rates of irr_dict reactions that have not been made are read 
+        from the IRR; they are not made.  Reactions that the IRR does 
+        not contain are not in irr_dict (see apply_irr).
+        """
+        loaded = dict(self.irr_dict.loaded_items()) if isinstance(self.irr_dict, LazyDict) else dict(self.irr_dict)
+        rates = []
+        explicit = []
+        for ri, rxn_name in enumerate(self.stoic_matrix.reactions):
+            if rxn_name in loaded:
+                rxn = loaded[rxn_name]
+                rates.append(rxn._rate)
+                if rxn._rate is None and len(rxn._stoic) > 0:
+                    explicit.append((ri, rxn))
+            elif rxn_name in self.irr_dict:
+                rates.append(self.__irr_rate(rxn_name))
+            else:
+                rates.append(None)
+        shapes = [rate.shape for rate in rates if rate is not None] + [rxn.shape for ri, rxn in explicit]
+        shape = (shapes or [()])[0]
+        stack = zeros((len(rates),) + shape, dtype = 'd')
+        for ri, rate in enumerate(rates):
+            if rate is not None:
+                stack[ri] = rate
+        return stack, explicit
+    
     def make_net_filter_rxn(self, spcs = [], reaction_type = None):
         """
         Sum each reaction in find_rxns(reactants, procucts, logical_and)
@@ -459,9 +810,10 @@ class Mechanism(object):
         rxns = self.filter_rxns(spcs = spcs, reaction_type = reaction_type)
         if len(rxns) == 0:
             return Reaction(stoic = dict())
-        result = self(' + '.join(rxns))
-        
-        return result
+        if not hasattr(self, 'irr_dict'):
+            stoic, reaction_type = self.stoic_matrix.net(rxns)
+            return Reaction(stoic, reaction_type = reaction_type)
+        return reaction_sum([self(rxn) for rxn in rxns])
 
     def print_net_rxn(self, reactants = [], products = [], logical_and = True, reaction_type = None):
         """
@@ -511,6 +863,7 @@ class Mechanism(object):
         Other keywords:
             accepts any keyword accepted by permm.graphing.timeseries.irr_plot
         """
+        from permm.graphing.timeseries import irr_plot
         if plot_spc is None:
             plot_spc = self((reactions[0][0].products() + reactions[0][0].reactants())[0])
             
@@ -527,6 +880,7 @@ class Mechanism(object):
         """
         plot creates a timeseries plot of any numerical array.
         """
+        from permm.graphing.timeseries import plot as tplot
         fig = tplot(self, y, stepped = stepped, end_date = end_date,
                     figure_settings = figure_settings,
                     axis_settings = axis_settings,
@@ -630,16 +984,20 @@ class Mechanism(object):
         for rxn, irr in irrs:
             print(rxn, (irr * factor).display(nspc = nspc, digits = digits))
         
-    def set_mrg(self, mrg, use_net_rxns = True, use_irr = True, use_ipr = True):
+    def set_mrg(self, mrg, use_net_rxns = True, use_irr = True, use_ipr = True, workers = None):
         """
         Add process analysis from a 1D merged IRR/IPR file
+        
+        workers - optional number of threads for IRR reactions and net
+                  reactions (see apply_irr)
         """
         self.mrg = mrg
+        self.__data_changed()
         if use_irr:
             try:
-                self.set_irr(mrg.variables['IRR'], mrg.Reactions.split(), use_net_rxns = use_net_rxns)
+                self.set_irr(mrg.variables['IRR'], mrg.Reactions.split(), use_net_rxns = use_net_rxns, workers = workers)
             except:
-                self.set_irr()
+                self.set_irr(workers = workers)
         if use_ipr:
             try:
                 self.set_ipr(mrg.variables['IPR'])
@@ -649,57 +1007,173 @@ class Mechanism(object):
         
         load_environ(self, self.variables)
         
-    def set_irr(self, irr = None, ReactionNames = None, use_net_rxns = True):
+    def set_irr(self, irr = None, ReactionNames = None, use_net_rxns = True, workers = None):
         """
-        Add process analysis from a 2D merged IRR array dim(TIME,RXN)
+        Add process analysis from a 2D merged IRR array dim(TIME,RXN); 
+        reaction rates have all dimensions of irr except RXN
+        
+        workers - optional number of threads (see apply_irr)
         """
         if not irr is None:
+            from PseudoNetCDF.sci_var import PseudoNetCDFVariable
             irr_type = dtype(dict(names = ReactionNames, formats = irr[:].dtype.char*len(ReactionNames)))
                 
-            self.irr = irr[:].view(dtype = irr_type).squeeze().view(type = PseudoNetCDFVariable)
+            self.irr = irr[:].view(dtype = irr_type)[..., 0].view(type = PseudoNetCDFVariable)
             self.irr.units = irr.units
 
         self.__use_net_rxns = use_net_rxns
-        self.apply_irr()
+        self.apply_irr(workers = workers)
 
-    def apply_irr(self):
-        self.irr_dict = {}
-        for rxn_name, rxn in self.reaction_dict.items():
-            if hasattr(self, 'irr'):
-                try:
-                    self.irr_dict[rxn_name] = rxn * self.irr[rxn_name].view(ndarray)
-                except ValueError as xxx_todo_changeme:
-                    (e) = xxx_todo_changeme
-                    self.irr_dict[rxn_name] = rxn * zeros(self.irr.shape, 'f')
+    def apply_irr(self, workers = None):
+        """
+        Make irr_dict (and nreaction_dict) from reactions and IRR.  Both
+        are lazy; a reaction is multiplied by its IRR when first used.
+        Reactions that the IRR does not contain are left out with a 
+        warning, as are net reactions that use them.
+        
+        workers - optional number of threads; when provided, all 
+                  reactions and net reactions are made at once by a 
+                  thread pool.  Each value is made by one task from the
+                  same inputs, so results do not depend on workers.
+        """
+        self.__query_cache = {}
+        self.__workers = workers
+        self.__data_changed()
+        rxn_names = []
+        if hasattr(self, 'irr'):
+            irr_names = set(self.irr.dtype.names or ())
+            for rxn_name in self.reaction_dict:
+                if rxn_name in irr_names:
+                    rxn_names.append(rxn_name)
+                else:
                     warn("IRR does not contain %s: skipped." % rxn_name)
-            else:
-                try:
-                    self.irr_dict[rxn_name] = rxn * self.mrg.variables[rxn_name][:].view(type = PseudoNetCDFVariable).view(ndarray)
-                except (KeyError, ValueError) as xxx_todo_changeme1:
-                    (e) = xxx_todo_changeme1
+        else:
+            for rxn_name in self.reaction_dict:
+                if rxn_name in self.mrg.variables:
+                    rxn_names.append(rxn_name)
+                else:
                     warn("IRR does not contain %s: skipped." % rxn_name)
+        
+        self.irr_dict = LazyDict(rxn_names, self.__irr_reaction)
                 
         if self.__use_net_rxns and len(self.irr_dict)>0:
-            self.nreaction_dict = {}
+            nrxn_names = []
             for nrxn_name, nrxn in self.net_reaction_dict.items():
                 try:
-                    self.nreaction_dict[nrxn_name] = eval(nrxn, None, self.irr_dict)
-                except Exception as xxx_todo_changeme2:
-                    (e) = xxx_todo_changeme2
+                    missing = [name for name in compile(nrxn, nrxn_name, 'eval').co_names if name not in self.irr_dict and name not in globals() and not hasattr(builtins, name)]
+                    if len(missing) > 0:
+                        raise NameError("name '%s' is not defined" % missing[0])
+                    nrxn_names.append(nrxn_name)
+                except Exception as e:
                     warn("Predefined net rxn %s is not available; %s" % (nrxn_name, str(e)))
+            self.nreaction_dict = LazyDict(nrxn_names, self.__net_reaction)
+        
+        if workers is not None:
+            self.__load_irr(workers)
 
         load_environ(self, self.variables)
     
+    def __load_irr(self, workers):
+        """
+        Make all irr_dict and nreaction_dict values with a pool of 
+        workers threads; linear net reactions are summed together (see 
+        reaction_sums) and other net reactions are evaluated by the pool
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            rxn_names = self.irr_dict.unloaded_keys()
+            for rxn_name, rxn in zip(rxn_names, pool.map(self.__irr_reaction, rxn_names)):
+                self.irr_dict[rxn_name] = rxn
+            if not self.__use_net_rxns or not hasattr(self, 'nreaction_dict'):
+                return
+            compiled = [name for name in self.nreaction_dict.unloaded_keys() if self.__compiled_net_reaction(name) is not None]
+            term_lists = [[(weight, self.irr_dict[rxn_name]) for rxn_name, weight in self.__compiled_net_reaction(name).items()] for name in compiled]
+            for nrxn_name, nrxn in zip(compiled, reaction_sums(term_lists, workers = workers)):
+                self.nreaction_dict[nrxn_name] = nrxn
+            nrxn_names = self.nreaction_dict.unloaded_keys()
+            for nrxn_name, nrxn in zip(nrxn_names, pool.map(self.__net_reaction, nrxn_names)):
+                self.nreaction_dict[nrxn_name] = nrxn
+    
+    def __irr_reaction(self, rxn_name):
+        """
+        Return reaction rxn_name multiplied by its IRR
+        """
+        return self.reaction_dict[rxn_name] * self.__irr_rate(rxn_name)
+    
+    def __irr_rate(self, rxn_name):
+        """
+        Return the IRR array of reaction rxn_name
+        """
+        if hasattr(self, 'irr'):
+            return self.irr[rxn_name].view(ndarray)
+        else:
+            from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+            return self.mrg.variables[rxn_name][:].view(type = PseudoNetCDFVariable).view(ndarray)
+    
+    def __compiled_net_reaction(self, nrxn_name):
+        """
+        Return reaction weights ({rxn_name: weight}) of net reaction
+        nrxn_name or None if it is not a linear combination of irr_dict
+        reactions
+        """
+        nrxn = self.net_reaction_dict[nrxn_name]
+        try:
+            weights = self.__net_weights[nrxn]
+        except KeyError:
+            weights = self.__net_weights[nrxn] = _linear_weights(nrxn)
+        if weights is None or not all([rxn_name in self.irr_dict for rxn_name in weights]):
+            return None
+        return weights
+    
+    def __net_reaction(self, nrxn_name):
+        """
+        Return net reaction nrxn_name evaluated from irr_dict; compiled
+        net reactions are summed in one pass (see reaction_sums) and 
+        only their irr_dict reactions are made
+        """
+        weights = self.__compiled_net_reaction(nrxn_name)
+        if weights is None:
+            return eval(self.net_reaction_dict[nrxn_name], None, self.irr_dict)
+        return reaction_sums([[(weight, self.irr_dict[rxn_name]) for rxn_name, weight in weights.items()]], workers = self.__workers)[0]
+    
+    def __process_group_terms(self, prc_name, group_terms, pending = ()):
+        """
+        Return {process name: weight} for process group prc_name in terms 
+        of IPR processes.  Groups used in other groups are expanded once 
+        and shared through group_terms.
+        """
+        if prc_name in group_terms:
+            return group_terms[prc_name]
+        terms = {}
+        for name, weight in self.__process_weights[prc_name].items():
+            if name in self.process_dict and name not in self.__process_weights:
+                name_terms = {name: 1}
+            elif name in self.__process_weights and self.__process_weights[name] is not None and name not in pending + (prc_name,):
+                name_terms = self.__process_group_terms(name, group_terms, pending + (prc_name,))
+            elif name in self.process_dict:
+                name_terms = {name: 1}
+            else:
+                raise NameError("name '%s' is not defined" % name)
+            for key, value in name_terms.items():
+                terms[key] = terms.get(key, 0) + weight * value
+        group_terms[prc_name] = terms
+        return terms
+    
     def set_process(self, prc_name, variables):
         if not hasattr(self, 'process_dict'):
             self.process_dict = {}
+        self.__data_changed()
         
-        self.process_dict[prc_name] = Process(prc_name, **variables)
+        if isinstance(variables, Process):
+            self.process_dict[prc_name] = variables.rename(prc_name)
+        else:
+            self.process_dict[prc_name] = Process(prc_name, **variables)
         
-    def set_ipr(self, ipr = None, processes = None):
+    def set_ipr(self, ipr = None, processes = None, species = None):
         """
         Add process analysis from a 3D merged IPR array (TIME,SPC,PROC)
         """
+        self.__data_changed()
         if ipr is None:
             if hasattr(self.mrg, 'Processes'):
                 processes = self.mrg.Processes.split()
@@ -711,18 +1185,37 @@ class Mechanism(object):
             if processes is None:
                 raise ValueError("When ipr is a dictionary, processes must be provided as a list of process names")
             self.process_dict = Processes_ProcDelimSpcDict(processes, self.mrg.variables)
-        elif isinstance(ipr, (PseudoNetCDFVariable, NetCDFVariable)):
-            self.process_dict = {}
-            for pi, prc in enumerate(processes):
-                self.process_dict[prc] = Process(prc, default_unit = getattr(ipr, 'units', 'Unknown'), **dict([(spc, ipr[si, pi]) for si, spc in enumerate(species)]))
+        elif _is_variable(ipr):
+            if processes is None:
+                processes = self.mrg.Process.split()
+            if species is None:
+                species = self.mrg.Species.split()
+            values = ipr[:]
+            values = IPRArray(values.transpose((1, 2, 0) + tuple(range(3, values.ndim))), species, processes)
+            units = getattr(ipr, 'units', 'Unknown')
+            self.process_dict = dict([(prc, values.process(prc, units = dict([(spc, units) for spc in species]))) for prc in processes])
         else:
             return
 
-        for prc_name, prc in self.__yaml_file.get('process_group_list', {}).items():
+        process_groups = self.__yaml_file.get('process_group_list', {})
+        group_terms = {}
+        term_lists = []
+        for prc_name, prc in process_groups.items():
+            if self.__process_weights.get(prc_name) is None:
+                try:
+                    self.set_process(prc_name, eval(prc,{},self.process_dict))
+                except Exception as e:
+                    warn('Could not evaluate %s: %s' % (prc_name, str(e)))
+                continue
             try:
-                self.set_process(prc_name, eval(prc,{},self.process_dict))
-            except Exception as e:
+                terms = self.__process_group_terms(prc_name, group_terms)
+            except NameError as e:
                 warn('Could not evaluate %s: %s' % (prc_name, str(e)))
+                continue
+            term_lists.append((prc_name, [(weight, self.process_dict[name]) for name, weight in terms.items()]))
+        
+        for (prc_name, terms), prc in zip(term_lists, process_sums([terms for prc_name, terms in term_lists])):
+            self.set_process(prc_name, prc)
 
             
         # Add extra species for names in IPR
@@ -732,6 +1225,133 @@ class Mechanism(object):
             if name not in self.species_dict:
                 self.species_dict[name] = Species(name + ': IGNORE')
 
+    def iter_blocks(self, mrg = None, max_bytes = 2**28, dim = 'TSTEP', use_net_rxns = True):
+        """
+        Yield slices of dim for blocks of a merged IRR/IPR file; for each 
+        block, the mechanism is loaded (see set_mrg) with only that block
+        of mrg.  Data loaded before iteration are restored afterwards.
+        
+        mrg - merged file; defaults to self.mrg
+        max_bytes - memory budget for each block; the block length is 
+                    the number of dim steps whose IRR/IPR values and 
+                    derived reactions fit in max_bytes (see _block_slices)
+        dim - dimension to split (e.g., TSTEP or LAY)
+        """
+        if mrg is None:
+            mrg = self.mrg
+        for blocks in self.__iter_blocks(mrg, [{dim: block} for block in _block_slices(mrg, dim, max_bytes)], use_net_rxns):
+            yield blocks[dim]
+    
+    def __iter_blocks(self, mrg, blocks_list, use_net_rxns):
+        """
+        Yield each of blocks_list ({dim: slice}) with the mechanism loaded
+        with that block of mrg; data loaded before are restored afterwards
+        """
+        state = dict([(key, self.__dict__[key]) for key in _block_state if key in self.__dict__])
+        try:
+            for blocks in blocks_list:
+                self.set_mrg(_MrgBlock(mrg, blocks), use_net_rxns = use_net_rxns)
+                yield blocks
+        finally:
+            for key in _block_state:
+                self.__dict__.pop(key, None)
+            self.__dict__.update(state)
+            self.__data_changed()
+            load_environ(self, self.variables)
+    
+    def run_blocks(self, analysis, mrg = None, max_bytes = 2**28, dim = 'TSTEP', use_net_rxns = True, combine = 'concatenate'):
+        """
+        Return analysis(mech) for all of mrg evaluated block by block 
+        (see iter_blocks), so that only one block of IRR/IPR data is in
+        memory.  combine says how values of block results are combined:
+        
+            - 'concatenate' joins arrays along dim, which is counted from 
+              the end (e.g., net reactions, process arrays and budgets 
+              keep the IRR/IPR dimensions last; see _block_axis)
+            - 'sum' adds arrays and numbers (e.g., time sums)
+            - a function of the list of block values returns the value
+              (e.g., max); other reductions such as means or ratios
+              must be made from concatenated values or by a function
+            - a dictionary, list or tuple with the structure of the 
+              result gives combine for each item; dictionary items 
+              that are not given are concatenated
+        
+        Reactions are combined by stoichiometry; dictionaries, lists and
+        tuples are combined by item; other values (e.g., names) must be
+        the same in every block.
+        
+        analysis - function of the mechanism 
+                   (e.g., lambda mech: mech('NO2 Photolysis1')[NO2])
+        combine - see above (e.g., dict(hourly = 'concatenate', total = 'sum'))
+        
+        mrg, max_bytes, dim and use_net_rxns are as in iter_blocks.
+        """
+        _check_combine(combine)
+        if mrg is None:
+            mrg = self.mrg
+        axis = _block_axis(mrg, dim)
+        results = [analysis(self) for block in self.iter_blocks(mrg, max_bytes = max_bytes, dim = dim, use_net_rxns = use_net_rxns)]
+        return _combine_blocks(results, combine, lambda values: _concatenate(values, axis, dim))
+    
+    def run_tiles(self, analysis, mrg = None, max_bytes = 2**28, processes = None, use_net_rxns = True, combine = 'concatenate'):
+        """
+        Return analysis(mech) for all of a 4-D (TSTEP, LAY, ROW, COL) 
+        merged IRR/IPR file evaluated for tiles of ROW and COL on a pool
+        of processes.  Tile results are combined as in run_blocks; 
+        concatenated values (e.g., irr_dict reactions, net reactions and
+        family budgets) are stitched along ROW and COL and functions
+        receive the tile values in row-major order.
+        
+        For example, origins of a history analysis:
+        
+            mech.run_tiles(lambda mech: matrix(mech, nodes, traceable, intermediates).origins)
+        
+        analysis - function of the mechanism; results are sent from the
+                   worker processes, so they must be picklable
+        mrg - merged file; defaults to self.mrg
+        max_bytes - memory budget for each tile (see _tile_slices)
+        processes - number of worker processes; defaults to the number of 
+                    CPUs; with 1 (or when processes cannot be forked), 
+                    tiles are evaluated in this process
+        combine - 'concatenate', 'sum', a function or a structure of 
+                  them (see run_blocks)
+        """
+        global _tile_task
+        import multiprocessing
+        _check_combine(combine)
+        if mrg is None:
+            mrg = self.mrg
+        tiles = _tile_slices(mrg, max_bytes)
+        row_axis, col_axis = _block_axis(mrg, 'ROW'), _block_axis(mrg, 'COL')
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = min(processes, len(tiles))
+        if processes > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            warn("Processes cannot be forked; tiles are evaluated in one process")
+            processes = 1
+        
+        if processes > 1:
+            _tile_task = (self, mrg, analysis, use_net_rxns)
+            try:
+                pool = multiprocessing.get_context('fork').Pool(processes)
+                try:
+                    results = pool.map(_run_tile, tiles)
+                finally:
+                    pool.terminate()
+            finally:
+                _tile_task = None
+        else:
+            results = [analysis(self) for blocks in self.__iter_blocks(mrg, tiles, use_net_rxns)]
+        
+        rows = []
+        for blocks in tiles:
+            if blocks['ROW'] not in rows:
+                rows.append(blocks['ROW'])
+        def stitch(values):
+            bands = [_concatenate([value for value, blocks in zip(values, tiles) if blocks['ROW'] == row], col_axis, 'COL') for row in rows]
+            return _concatenate(bands, row_axis, 'ROW')
+        return _combine_blocks(results, combine, stitch)
+
     def add_rxn(self, rxn_key, rxn_str):
         """
         Synopsis:
@@ -742,6 +1362,7 @@ class Mechanism(object):
             rxn_str - string that defines the reaction (e.g., N2O + 2 H2O ->[k] HNO3
         """
         self.reaction_dict[rxn_key] = Reaction(rxn_str)
+        self.__update_stoic_matrix()
         if hasattr(self, 'irr_dict'):
             self.irr_dict[rxn_key] = Reaction(rxn_str)
             self.irr_dict[rxn_key] *= self.irr[rxn_key]
@@ -773,6 +1394,7 @@ class Mechanism(object):
                
                
         """
+        from permm.graphing.timeseries import phy_plot
         fig = phy_plot(self, species, **kwds)
         if path is not None:
             fig.savefig(path)
@@ -785,12 +1407,355 @@ class Mechanism(object):
     def globalize(self, env):
         load_environ(self, env)
 
+def _is_variable(x):
+    """
+    True if x is a PseudoNetCDF or netCDF4 variable
+    """
+    from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+    if isinstance(x, PseudoNetCDFVariable):
+        return True
+    from permm.netcdf import NetCDFVariable
+    return isinstance(x, NetCDFVariable)
+
+def _block_bytes(mrg, dims):
+    """
+    Return the bytes of variables of mrg with all of dims for one 
+    element of dims and the number of elements
+    """
+    for dim in dims:
+        if dim not in mrg.dimensions:
+            raise KeyError("%s is not a dimension of the merged file" % dim)
+    nsteps = int(prod([len(mrg.dimensions[dim]) for dim in dims]))
+    step_bytes = 0
+    for var in mrg.variables.values():
+        if builtins.all([dim in var.dimensions for dim in dims]):
+            step_bytes += dtype(var.dtype).itemsize * int(prod(var.shape)) // max(nsteps, 1)
+    return step_bytes * _block_overhead, nsteps
+
+def _block_slices(mrg, dim, max_bytes):
+    """
+    Return slices of dim that split mrg into blocks; each step of dim
+    costs _block_overhead times the bytes of the variables with dim.
+    """
+    step_bytes, nsteps = _block_bytes(mrg, (dim,))
+    return _split(nsteps, int(max_bytes // max(step_bytes, 1)))
+
+def _tile_slices(mrg, max_bytes):
+    """
+    Return tiles ({'ROW': slice, 'COL': slice}) in row-major order that
+    split the ROW and COL dimensions of mrg; tiles are near square and
+    each cell costs _block_overhead times the bytes of the variables 
+    with ROW and COL
+    """
+    cell_bytes, ncells = _block_bytes(mrg, ('ROW', 'COL'))
+    cells = max(1, int(max_bytes // max(cell_bytes, 1)))
+    nrows = int(sqrt(cells))
+    return [dict(ROW = row, COL = col) for row in _split(len(mrg.dimensions['ROW']), nrows) for col in _split(len(mrg.dimensions['COL']), cells // nrows)]
+
+def _split(nsteps, length):
+    """
+    Return slices of range(nsteps) of at most length steps
+    """
+    nblocks = max(1, -(-nsteps // max(1, length)))
+    bounds = [0] + [len(block) for block in array_split(arange(nsteps), nblocks)]
+    bounds = cumsum(bounds)
+    return [slice(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def _block_axis(mrg, dim):
+    """
+    Return the axis of dim, counted from the end, in values made from 
+    mrg: reaction rates from IRR (without RXN; see set_irr), process 
+    arrays from IPR (without SPECIES and PROCESS; see set_ipr) and 
+    other variables
+    """
+    keys = [key for key in ('IRR', 'IPR') if key in mrg.variables] + [key for key in mrg.variables if key not in ('IRR', 'IPR')]
+    for key in keys:
+        dims = list(mrg.variables[key].dimensions)
+        if key == 'IRR':
+            dims = dims[:-1]
+        elif key == 'IPR':
+            dims = dims[:1] + dims[3:]
+        if dim in dims:
+            return dims.index(dim) - len(dims)
+    raise KeyError("%s is not a dimension of the merged file variables" % dim)
+
+def _concatenate(values, axis, dim):
+    """
+    Concatenate values of blocks along axis (counted from the end) of dim
+    """
+    for value in values:
+        if value.ndim < -axis:
+            raise ValueError("Block results of shape %s do not have a %s axis; use combine = 'sum' for totals or a combine function" % (repr(value.shape), dim))
+    return concatenate(values, axis = axis)
+
+def _check_combine(combine):
+    """
+    Raise ValueError unless combine is 'concatenate', 'sum', callable or
+    a dictionary, list or tuple of them (see Mechanism.run_blocks)
+    """
+    if isinstance(combine, dict):
+        for value in combine.values():
+            _check_combine(value)
+    elif isinstance(combine, (list, tuple)):
+        for value in combine:
+            _check_combine(value)
+    elif not callable(combine) and combine not in ('concatenate', 'sum'):
+        raise ValueError("combine must be 'concatenate', 'sum' or a function; got %s" % repr(combine))
+
+def _combine_blocks(results, combine, join):
+    """
+    Combine analysis results of blocks (see Mechanism.run_blocks); join
+    concatenates a list of block arrays
+    """
+    if callable(combine):
+        return combine(results)
+    first = results[0]
+    if isinstance(first, LazyReaction):
+        results = [result.evaluate() for result in results]
+        first = results[0]
+    if isinstance(first, dict):
+        keys = list(first.keys())
+        if not builtins.all([list(result.keys()) == keys for result in results]):
+            raise ValueError("Block results have different keys")
+        specs = dict([(key, combine.get(key, 'concatenate') if isinstance(combine, dict) else combine) for key in keys])
+        return type(first)([(key, _combine_blocks([result[key] for result in results], specs[key], join)) for key in keys])
+    if isinstance(first, (list, tuple)):
+        if not builtins.all([len(result) == len(first) for result in results]):
+            raise ValueError("Block results have different lengths")
+        specs = combine if isinstance(combine, (list, tuple)) else [combine] * len(first)
+        if len(specs) != len(first):
+            raise ValueError("combine has %d items for results with %d" % (len(specs), len(first)))
+        return type(first)([_combine_blocks(items, spec, join) for items, spec in zip(zip(*results), specs)])
+    if not isinstance(combine, str):
+        raise ValueError("combine %s does not match results of type %s" % (repr(combine), type(first).__name__))
+    if isinstance(first, Reaction):
+        keys = []
+        for result in results:
+            keys.extend([key for key in result._stoic.keys() if key not in keys])
+        stoic = {}
+        for key in keys:
+            stoic[key] = _combine_blocks([result._stoic[key] if key in result._stoic else zeros(result.shape) for result in results], combine, join)
+        return Reaction._adopt(stoic, first.reaction_type)
+    if isinstance(first, str):
+        if not builtins.all([result == first for result in results]):
+            raise ValueError("Block results %s cannot be combined" % repr(first))
+        return first
+    if hasattr(first, 'shape') or hasattr(first, '__array__') or isinstance(first, (int, float, complex)):
+        values = [asarray(result) for result in results]
+        if values[0].dtype.kind not in 'biufc':
+            if not builtins.all([array_equal(value, values[0]) for value in values]):
+                raise ValueError("Block results %s cannot be combined" % repr(first))
+            return first
+        if combine == 'sum':
+            return reduce(operator.add, values)
+        return join(values)
+    if not builtins.all([result is first for result in results]):
+        raise ValueError("Block results of type %s cannot be combined" % type(first).__name__)
+    return first
+
+def _run_tile(blocks):
+    """
+    Return the analysis of _tile_task (see Mechanism.run_tiles) for 
+    blocks ({dim: slice}) in a worker process; netCDF files are opened
+    again in each worker and in-memory files are copies of the parent's
+    """
+    mech, mrg, analysis, use_net_rxns = _tile_task
+    if hasattr(mrg, 'filepath'):
+        try:
+            path = mrg.filepath()
+        except ValueError as e:
+            warn("Tiles use the file handle inherited from the parent process; %s" % str(e))
+        else:
+            from permm.netcdf import NetCDFFile
+            mrg = NetCDFFile(path, 'r')
+    mech.set_mrg(_MrgBlock(mrg, blocks), use_net_rxns = use_net_rxns)
+    result = analysis(mech)
+    if isinstance(result, LazyReaction):
+        result = result.evaluate()
+    return result
+
 def _ensure_list(x):
     if isinstance(x, Species):
         return [x]
     else:
         return x
 
+def _cache_path(yaml_text):
+    """
+    Return the compiled mechanism cache path for yaml_text or None when 
+    caching is disabled.  Caching is opt-in: the cache directory is 
+    $PERMM_CACHE and cached files are unpickled, so it should only be
+    writable by you.  Files are keyed by a hash of the yaml text and the
+    permm.core source and are named mechanism-<source hash>-<key>.pickle,
+    so versions of permm that share the directory keep their own files.
+    """
+    cache_dir = os.environ.get('PERMM_CACHE', '')
+    if cache_dir == '':
+        return None
+    key = hashlib.sha1()
+    key.update(_source_signature().encode())
+    key.update(yaml_text.encode('utf-8'))
+    return os.path.join(cache_dir, 'mechanism-%s-%s.pickle' % (_source_signature()[:12], key.hexdigest()))
+
+def _source_signature():
+    """
+    Return a hash of the permm.core source
+    """
+    global _code_signature
+    if _code_signature is None:
+        code_hash = hashlib.sha1()
+        core_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(core_dir)):
+            if name.endswith('.py'):
+                code_hash.update(open(os.path.join(core_dir, name), 'rb').read())
+        _code_signature = code_hash.hexdigest()
+    return _code_signature
+
+def _linear_weights(expr):
+    """
+    Return {name: weight} when expr is a sum of names with optional 
+    numeric factors (e.g., RXN_01 + RXN_02 + 2 * RXN_03); otherwise, None
+    """
+    try:
+        node = ast.parse(expr, mode = 'eval').body
+    except (SyntaxError, TypeError):
+        return None
+    return _linear_node_weights(node)
+
+def _linear_node_weights(node):
+    """
+    Return {name: weight} when the ast node is a linear sum of names
+    (see _linear_weights); otherwise, None
+    """
+    weights = {}
+    def is_number(node):
+        return isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+    
+    def add_terms(node, factor):
+        if isinstance(node, ast.Name):
+            weights[node.id] = weights.get(node.id, 0) + factor
+            return True
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return add_terms(node.left, factor) and add_terms(node.right, factor)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult):
+            if is_number(node.left):
+                return add_terms(node.right, factor * node.left.value)
+            elif is_number(node.right):
+                return add_terms(node.left, factor * node.right.value)
+        return False
+    
+    if add_terms(node, 1):
+        return weights
+    return None
+
+class _FuseSums(ast.NodeTransformer):
+    """
+    Replace each largest linear sum of two or more names with a call
+    to __sum__(i); sums[i] holds its weights and compiled code
+    """
+    def __init__(self, sums):
+        self.sums = sums
+    
+    def visit_BinOp(self, node):
+        weights = _linear_node_weights(node)
+        if weights is None or len([n for n in ast.walk(node) if isinstance(n, ast.Name)]) < 2:
+            return self.generic_visit(node)
+        self.sums.append((weights, compile(ast.Expression(node), '<mechanism>', 'eval')))
+        call = ast.Call(func = ast.Name(id = '__sum__', ctx = ast.Load()), args = [ast.Constant(len(self.sums) - 1)], keywords = [])
+        return ast.copy_location(call, node)
+
+class _MrgBlock(object):
+    """
+    Merged file mrg where variables are read only for blocks ({dim: 
+    slice}); other attributes are from mrg
+    """
+    def __init__(self, mrg, blocks):
+        self._mrg = mrg
+        self._blocks = blocks
+        self.dimensions = dict(mrg.dimensions)
+        for dim, block in blocks.items():
+            self.dimensions[dim] = range(*block.indices(len(mrg.dimensions[dim])))
+        self.variables = LazyDict(list(mrg.variables.keys()), self.__variable)
+    
+    def __getattr__(self, key):
+        return getattr(self._mrg, key)
+    
+    def __variable(self, key):
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+        var = self._mrg.variables[key]
+        dims = tuple(var.dimensions)
+        if not builtins.any([dim in dims for dim in self._blocks]):
+            return var
+        index = tuple([self._blocks.get(dim, slice(None)) for dim in dims])
+        values = var[index]
+        attrs = dict([(k, var.getncattr(k)) for k in var.ncattrs()])
+        return PseudoNetCDFVariable(self, key, values.dtype.char, dims, values = values, **attrs)
+
+class _Bound(object):
+    """
+    Hashable reference to a value for result cache keys; it is equal
+    only to references to the same object and keeps the object alive
+    so that its id is not reused
+    """
+    __slots__ = ('value',)
+    def __init__(self, value):
+        self.value = value
+    
+    def __hash__(self):
+        return id(self.value)
+    
+    def __eq__(self, other):
+        return isinstance(other, _Bound) and other.value is self.value
+
+class _Expression(object):
+    """
+    A Mechanism expression parsed once.  Names are resolved from the
+    mechanism namespace and kept until the mechanism data version
+    changes.  Linear sums of reactions or processes are evaluated with
+    reaction_sums or process_sums; other sums use normal arithmetic.
+    """
+    def __init__(self, expr):
+        tree = ast.parse(expr.strip(), mode = 'eval')
+        self.names = sorted(set([node.id for node in ast.walk(tree) if isinstance(node, ast.Name)]))
+        self.sums = []
+        tree = _FuseSums(self.sums).visit(tree)
+        self.code = compile(ast.fix_missing_locations(tree), '<mechanism>', 'eval')
+        self.version = None
+        self.resolved = {}
+    
+    def __call__(self, variables, env, version, lazy = False):
+        if version != self.version:
+            self.resolved = {}
+            self.version = version
+        namespace = dict(self.resolved)
+        for name in self.names:
+            if dict.__contains__(variables, name):
+                namespace[name] = dict.__getitem__(variables, name)
+            elif name not in namespace:
+                try:
+                    namespace[name] = self.resolved[name] = variables[name]
+                except KeyError:
+                    pass
+            if lazy and isinstance(namespace.get(name), Reaction):
+                namespace[name] = self.resolved[name] = namespace[name].lazy()
+        if len(self.sums) > 0:
+            namespace['__sum__'] = lambda i: self.__sum(i, namespace, env)
+        return eval(self.code, env, namespace)
+    
+    def __sum(self, i, namespace, env):
+        weights, code = self.sums[i]
+        terms = [(weight, namespace.get(name)) for name, weight in weights.items()]
+        if builtins.all([isinstance(term, Reaction) and not isinstance(term, LazyReaction) for weight, term in terms]):
+            return reaction_sums([terms])[0]
+        if builtins.all([isinstance(term, Process) for weight, term in terms]):
+            return process_sums([terms])[0]
+        return eval(code, env, namespace)
+
+def _type_key(reaction_type):
+    if reaction_type is None:
+        return None
+    return ''.join(sorted(set(reaction_type)))
+
 def _rxn_ordinal(rxnlabel):
     result = _numre.search(rxnlabel)
     if result is None:
@@ -802,3 +1767,460 @@ def _rxn_ordinal(rxnlabel):
         except:
             return int(val)
         
+
+import unittest
+
+_old_cache = None
+
+def setUpModule():
+    """
+    Tests cache compiled mechanisms in a temporary directory
+    """
+    import tempfile
+    global _old_cache
+    _old_cache = os.environ.get('PERMM_CACHE')
+    os.environ['PERMM_CACHE'] = tempfile.mkdtemp()
+
+def tearDownModule():
+    import shutil
+    shutil.rmtree(os.environ['PERMM_CACHE'], ignore_errors = True)
+    if _old_cache is None:
+        del os.environ['PERMM_CACHE']
+    else:
+        os.environ['PERMM_CACHE'] = _old_cache
+
+class MechanismTestCase(unittest.TestCase):
+    def setUp(self):
+        from os.path import join, dirname
+        self.mech = Mechanism(join(dirname(__file__), '..', 'mechanisms', 'cb05_camx.yaml'))
+
+    def _irr(self, rxns, scale = 1.):
+        """
+        IRR variable with 5 time steps of distinct rates for rxns
+        """
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+        values = arange(5 * len(rxns), dtype = 'f').reshape(5, len(rxns)) * scale
+        return PseudoNetCDFVariable(None, 'IRR', 'f', ('TSTEP', 'REACTIONS'), values = values, units = 'ppb')
+
+    def testFindRxns(self):
+        mech = self.mech
+        for spcn in ['NO2', 'O3', 'NOx', 'Radical', 'Ox']:
+            spc = mech(spcn)
+            for rcts, prds in [([spc], []), ([], [spc]), ([-spc], [spc])]:
+                for logical_and in (True, False):
+                    rct_check = set([rn for rn, rxn in mech.reaction_dict.items() if all([rxn.has_rct(r) for r in rcts])])
+                    prd_check = set([rn for rn, rxn in mech.reaction_dict.items() if all([rxn.has_prd(p) for p in prds])])
+                    if logical_and:
+                        check = sorted(rct_check.intersection(prd_check))
+                    else:
+                        check = sorted(rct_check.union(prd_check))
+                    self.assertEqual(mech.find_rxns(rcts, prds, logical_and), check)
+        self.assertEqual(mech.find_rxns(mech('NO2'), reaction_type = 'j'), ['RXN_01'])
+
+    def testFilterRxns(self):
+        mech = self.mech
+        spcs = [mech('NO2'), -mech('Radical')]
+        check = sorted([rn for rn, rxn in mech.reaction_dict.items() if all([spc in rxn for spc in spcs])])
+        self.assertEqual(mech.filter_rxns(spcs), check)
+
+    def testMakeNetRxn(self):
+        mech = self.mech
+        rxns = mech.find_rxns(mech('NO2'))
+        nrxn = mech.make_net_rxn(mech('NO2'))
+        check = reduce(operator.add, [mech.reaction_dict[rxn] for rxn in rxns])
+        self.assertEqual(nrxn.reaction_type, check.reaction_type)
+        self.assertEqual(set(nrxn._stoic.keys()), set(check._stoic.keys()))
+        for key, value in check._stoic.items():
+            self.assertAlmostEqual(nrxn._stoic[key], value)
+
+    def testGetBudget(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        budget = mech.get_budget()
+        for spcn in ['NO2', 'O3', 'PAR', 'HNO3']:
+            spc = mech(spcn)
+            si = budget.species.index(spcn)
+            nrxn = mech.make_net_rxn(spc, spc, logical_and = False)
+            self.assertTrue(allclose(budget.production[si], nrxn.produces(spc), rtol = 1e-5))
+            self.assertTrue(allclose(budget.loss[si], nrxn.consumes(spc), rtol = 1e-5))
+            self.assertTrue(allclose(budget.net[si], nrxn[spc], rtol = 1e-5))
+
+    def testSubstBudget(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        NO2, NOx = mech('NO2'), mech('NOx')
+        before = mech.get_atom_balance()
+        substituted = [before.reactions.index(rxn_name) for rxn_name in mech.find_rxns(NO2, [])]
+        mech.subst_net_rxn(NO2, [], name = 'NO2loss')
+        budget = mech.get_budget()
+        si = budget.species.index('NO2')
+        nrxn = reaction_sum([rxn for rxn in mech.irr_dict.values() if NO2 in rxn])
+        self.assertTrue(allclose(budget.production[si], nrxn.produces(NO2), rtol = 1e-5))
+        self.assertTrue(allclose(budget.loss[si], nrxn.consumes(NO2), rtol = 1e-5))
+        self.assertTrue(allclose(budget.net[si], nrxn[NO2], rtol = 1e-5))
+        family = mech.get_family_budget([NOx])
+        ri = family.reactions.index('NO2loss')
+        rxn = mech.irr_dict['NO2loss']
+        self.assertTrue(allclose(family.production[0, ri], rxn.produces(NOx), rtol = 1e-5))
+        self.assertTrue(allclose(family.loss[0, ri], rxn.consumes(NOx), rtol = 1e-5))
+        balance = mech.get_atom_balance()
+        flux = balance.flux[balance.reactions.index('NO2loss')]
+        self.assertTrue(abs(flux).max() > 1)
+        self.assertTrue(allclose(flux, before.flux[substituted].sum(0), rtol = 1e-5, atol = 1e-3))
+
+    def testFamilyBudget(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        budget = mech.get_family_budget()
+        self.assertTrue('NOx' in budget.families and 'NOy' in budget.families)
+        self.assertEqual(budget.net.shape, (len(budget.families), len(rxns), 5))
+        for famn in ['NOx', 'NOz', 'NOy']:
+            fi = budget.families.index(famn)
+            family = mech(famn)
+            for rxn_name in mech.find_rxns(family, family, logical_and = False):
+                ri = budget.reactions.index(rxn_name)
+                rxn = mech.irr_dict[rxn_name]
+                self.assertTrue(allclose(budget.production[fi, ri], rxn.produces(family), rtol = 1e-5))
+                self.assertTrue(allclose(budget.loss[fi, ri], rxn.consumes(family), rtol = 1e-5))
+                self.assertTrue(allclose(budget.net[fi, ri], rxn[family], rtol = 1e-5))
+        
+    def testAtomBalance(self):
+        mech = self.mech
+        balance = mech.get_atom_balance()
+        self.assertEqual(balance.imbalance.shape, (len(mech.reaction_dict), 5))
+        self.assertFalse('flux' in balance)
+        ri = balance.reactions.index('RXN_03')
+        self.assertFalse(balance.incomplete[ri])
+        self.assertTrue(allclose(balance.imbalance[ri], [0, 0, -2, 0, 0]))
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        balance = mech.get_atom_balance(['O'])
+        self.assertEqual(balance.flux.shape, (len(rxns), 1, 5))
+        self.assertTrue(allclose(balance.flux[ri, 0], -2 * mech.irr_dict['RXN_03']._rate))
+
+    def testQueryCache(self):
+        mech = self.mech
+        check = mech.find_rxns(mech('NO2'), reaction_type = 'kj')
+        result = mech.find_rxns('NO2', reaction_type = 'jk')
+        self.assertEqual(result, check)
+        result.append('TEST')
+        self.assertEqual(mech.find_rxns(mech('NO2'), reaction_type = 'kj'), check)
+        mech.add_rxn('TEST_01', 'NO2 + O3 ->[k] NO3 + O2')
+        self.assertEqual(mech.find_rxns(mech('NO2'), reaction_type = 'kj'), sorted(check + ['TEST_01']))
+        self.assertEqual(mech.filter_rxns(mech('NO2')), mech.filter_rxns([mech('NO2')]))
+
+    def testAugmentedAssignment(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        NO2 = mech('NO2')
+        nrxn = mech('NO2 Photolysis1')
+        check = nrxn[NO2].copy()
+        x = mech('NO2 Photolysis1')
+        x += mech('RXN_01')
+        x *= 2.
+        self.assertTrue(mech.nreaction_dict['NO2 Photolysis1'] is nrxn)
+        self.assertTrue(array_equal(mech('NO2 Photolysis1')[NO2], check))
+        rxn = mech.reaction_dict['RXN_02']
+        keys = set(rxn._stoic.keys())
+        t = mech.reaction_dict['RXN_02']
+        t += mech.reaction_dict['RXN_03']
+        self.assertTrue(mech.reaction_dict['RXN_02'] is rxn)
+        self.assertEqual(set(rxn._stoic.keys()), keys)
+
+    def testLazyIRR(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        self.assertEqual(mech.irr_dict.loaded_items(), [])
+        self.assertEqual(len(mech.irr_dict), len(rxns))
+        budget = mech.get_budget()
+        mech.get_family_budget()
+        mech.get_atom_balance()
+        self.assertEqual(mech.irr_dict.loaded_items(), [])
+        rxn = mech('RXN_01')
+        self.assertTrue(rxn is mech.irr_dict['RXN_01'])
+        self.assertTrue(allclose(rxn._rate, irr[:, rxns.index('RXN_01')]))
+        self.assertEqual([k for k, v in mech.irr_dict.loaded_items()], ['RXN_01'])
+        nrxn_name = sorted(mech.nreaction_dict.keys())[0]
+        nrxn = mech(nrxn_name)
+        check = eval(mech.net_reaction_dict[nrxn_name], None, dict(mech.irr_dict.items()))
+        for key, value in check._stoic.items():
+            self.assertTrue(allclose(nrxn._stoic[key], value))
+        self.assertEqual([k for k, v in mech.nreaction_dict.loaded_items()], [nrxn_name])
+        self.assertTrue(allclose(mech.get_budget().net, budget.net))
+
+    def testMissingIRR(self):
+        import warnings
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        rxns.remove('RXN_01')
+        irr = self._irr(rxns)
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter('always')
+            mech.set_irr(irr, rxns)
+        self.assertTrue(builtins.any(['IRR does not contain RXN_01' in str(w.message) for w in caught]))
+        self.assertFalse('RXN_01' in mech.irr_dict)
+        self.assertFalse('NO2 Photolysis1' in mech.nreaction_dict)
+        self.assertEqual(len(mech.irr_dict), len(rxns))
+
+    def testSetIPR(self):
+        mech = self.mech
+        from PseudoNetCDF.sci_var import PseudoNetCDFVariable
+        processes = ['INIT', 'CHEM', 'EMIS', 'PTEMIS', 'PIG', 'FCONC', 'DIL', 'HENT', 'VENT', 'HDET', 'VDET', 'EDHDIL', 'EDVDIL']
+        species = ['NO', 'NO2', 'O3']
+        ipr = PseudoNetCDFVariable(None, 'IPR', 'f', ('TSTEP', 'SPECIES', 'PROCESS'), values = arange(5 * 3 * 13, dtype = 'f').reshape(5, 3, 13), units = 'ppb')
+        mech.set_ipr(ipr, processes, species)
+        NOx = mech('NOx')
+        self.assertTrue(allclose(mech('CHEM')[NOx], ipr[:, 0, 1] + ipr[:, 1, 1]))
+        self.assertTrue(allclose(mech('Emissions')[NOx], ipr[:, :2, 2:5].sum(2).sum(1)))
+        self.assertEqual(mech('Emissions').names, ('Emissions',))
+        self.assertEqual(mech('Emissions').get_units(NOx), 'ppb')
+        self.assertTrue(mech('Emissions')._ipr is mech('INIT')._ipr)
+        self.assertTrue(allclose(mech('Motion')[NOx], ipr[:, :2, 6:].sum(2).sum(1)))
+        self.assertTrue(mech('Motion')._weights is mech('Entrain')._weights)
+
+    def testExpressions(self):
+        mech = self.mech
+        def check_equal(result, check):
+            self.assertEqual(set(result._stoic.keys()), set(check._stoic.keys()))
+            for key in check._stoic:
+                self.assertTrue(allclose(result._stoic[key], check._stoic[key]))
+        expr = 'RXN_01 + RXN_02 * 2 + RXN_01'
+        check_equal(mech(expr), mech('RXN_01') + mech('RXN_02') * 2 + mech('RXN_01'))
+        compiled = mech._Mechanism__expressions[expr]
+        self.assertEqual(len(compiled.sums), 1)
+        check_equal(mech(expr), mech('RXN_01') + mech('RXN_02') * 2 + mech('RXN_01'))
+        self.assertTrue(mech._Mechanism__expressions[expr] is compiled)
+        self.assertTrue(compiled.resolved['RXN_01'] is mech.reaction_dict['RXN_01'])
+        self.assertEqual(mech('(NO + NO2).names()'), mech('NOx').names())
+        mech.add_rxn('RXN_01', 'NO2 + O3 ->[k] NO3 + O2')
+        check_equal(mech(expr), mech('RXN_01') * 2 + mech('RXN_02') * 2)
+        self.assertTrue(compiled.resolved['RXN_01'] is mech.reaction_dict['RXN_01'])
+
+    def testResultCache(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        mech.set_result_cache(10 * 2**20)
+        result = mech('RXN_01 + RXN_02')
+        self.assertTrue(mech('RXN_01 + RXN_02') is result)
+        NO2 = mech('NO2')
+        values = mech.get_spc('RXN_01', NO2)
+        self.assertTrue(mech.get_spc('RXN_01', NO2) is values)
+        stats = mech.result_cache.stats()
+        self.assertEqual((stats.hits, stats.misses), (2, 4))
+        self.assertTrue(0 < stats.nbytes <= stats.max_bytes)
+        mech.set_irr(irr * 2, rxns)
+        self.assertEqual(len(mech.result_cache), 0)
+        self.assertTrue(allclose(mech.get_spc('RXN_01', NO2), values * 2))
+        result = mech('RXN_01 + RXN_02')
+        mech.variables['RXN_01'] = mech('RXN_03')
+        rebound = mech('RXN_01 + RXN_02')
+        self.assertTrue(rebound is not result)
+        self.assertTrue(allclose(rebound[NO2], (mech.irr_dict['RXN_03'] + mech.irr_dict['RXN_02'])[NO2]))
+        self.assertTrue(mech('RXN_01 + RXN_02') is rebound)
+        self.assertTrue(allclose(mech.get_spc('RXN_01', NO2), mech.irr_dict['RXN_03'][NO2]))
+        mech.set_result_cache(None)
+        self.assertTrue(mech('RXN_01 + RXN_02') is not mech('RXN_01 + RXN_02'))
+
+    def testSetLazy(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        expr = '(RXN_01 + RXN_02 * 2 + RXN_03)[:3][NO2].sum()'
+        check = mech(expr)
+        mech.set_lazy()
+        self.assertEqual(type(mech('RXN_01 + RXN_02')).__name__, 'LazyReaction')
+        self.assertTrue(allclose(mech(expr), check))
+        mech.set_lazy(False)
+        self.assertTrue(isinstance(mech('RXN_01 + RXN_02'), Reaction))
+
+    def testWorkers(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns, scale = 1. / 7)
+        mech.set_irr(irr, rxns)
+        check = dict([(name, mech.nreaction_dict[name]) for name in mech.nreaction_dict])
+        mech.set_irr(irr, rxns, workers = 3)
+        self.assertEqual(mech.irr_dict.unloaded_keys(), [])
+        self.assertEqual(mech.nreaction_dict.unloaded_keys(), [])
+        for name, nrxn in check.items():
+            self.assertEqual(set(mech.nreaction_dict[name]._stoic.keys()), set(nrxn._stoic.keys()))
+            for key, value in nrxn._stoic.items():
+                self.assertTrue(array_equal(mech.nreaction_dict[name]._stoic[key], value))
+
+    def testRunBlocks(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        from PseudoNetCDF import PseudoNetCDFFile
+        mrg = PseudoNetCDFFile()
+        mrg.createDimension('TSTEP', 7)
+        mrg.createDimension('RXN', len(rxns))
+        irr = mrg.createVariable('IRR', 'f', ('TSTEP', 'RXN'))
+        irr[:] = arange(7 * len(rxns), dtype = 'f').reshape(7, len(rxns)) % 13
+        irr.units = 'ppb'
+        mrg.Reactions = ' '.join(rxns)
+        mech.set_mrg(mrg, use_ipr = False)
+        NO2 = mech('NO2')
+        def analysis(mech):
+            return dict(nrxn = mech('NO2 Photolysis1'), total = mech('Whole_Mechanism').sum(), budget = mech.get_budget(), no2 = [rxn[NO2] for rxn in mech.get_irrs(NO2)])
+        check = analysis(mech)
+        self.assertEqual([(block.start, block.stop) for block in mech.iter_blocks(max_bytes = len(rxns) * 4 * 2 * _block_overhead)], [(0, 2), (2, 4), (4, 6), (6, 7)])
+        self.assertTrue(mech.mrg is mrg)
+        result = mech.run_blocks(analysis, max_bytes = 1, combine = dict(total = 'sum'))
+        for key in ('nrxn', 'total'):
+            self.assertEqual(set(result[key]._stoic.keys()), set(check[key]._stoic.keys()))
+            for spc_key, value in check[key]._stoic.items():
+                self.assertTrue(allclose(result[key]._stoic[spc_key], value))
+        self.assertEqual(result['budget'].species, check['budget'].species)
+        self.assertEqual(result['budget'].net.shape, check['budget'].net.shape)
+        self.assertTrue(allclose(result['budget'].net, check['budget'].net))
+        self.assertTrue(allclose(result['no2'], check['no2']))
+        self.assertTrue(allclose(mech('NO2 Photolysis1')[NO2], check['nrxn'][NO2]))
+        self.assertRaises(ValueError, mech.run_blocks, lambda mech: str(mech.irr.shape), max_bytes = len(rxns) * 4 * 2 * _block_overhead)
+        self.assertRaises(ValueError, mech.run_blocks, analysis, max_bytes = 1)
+        self.assertRaises(ValueError, mech.run_blocks, lambda mech: mech('NO2 Photolysis1')[NO2].mean(), max_bytes = 1)
+        self.assertRaises(ValueError, mech.run_blocks, analysis, max_bytes = 1, combine = 'mean')
+        self.assertEqual(mech.run_blocks(lambda mech: mech('NO2 Photolysis1')[NO2].max(), max_bytes = 1, combine = max), check['nrxn'][NO2].max())
+        self.assertTrue(allclose(mech.run_blocks(lambda mech: mech('NO2 Photolysis1')[NO2], max_bytes = 1), check['nrxn'][NO2]))
+        NO = mech('NO')
+        def totals(mech):
+            rxn = mech('Whole_Mechanism')
+            return array([rxn[NO2].sum(), rxn[NO].sum()])
+        self.assertTrue(allclose(mech.run_blocks(totals, max_bytes = len(rxns) * 4 * 2 * _block_overhead, combine = 'sum'), totals(mech)))
+        self.assertTrue(allclose(mech.run_blocks(lambda mech: (mech('NO2 Photolysis1')[NO2], totals(mech)), max_bytes = 1, combine = ('concatenate', 'sum'))[1], totals(mech)))
+
+    def testRunTiles(self):
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        from PseudoNetCDF import PseudoNetCDFFile
+        mrg = PseudoNetCDFFile()
+        for dim, length in [('TSTEP', 3), ('LAY', 2), ('ROW', 5), ('COL', 4), ('RXN', len(rxns))]:
+            mrg.createDimension(dim, length)
+        irr = mrg.createVariable('IRR', 'f', ('TSTEP', 'LAY', 'ROW', 'COL', 'RXN'))
+        irr[:] = arange(3 * 2 * 5 * 4 * len(rxns), dtype = 'f').reshape(3, 2, 5, 4, len(rxns)) % 17
+        irr.units = 'ppb'
+        mrg.Reactions = ' '.join(rxns)
+        mech.set_mrg(mrg, use_ipr = False)
+        NO2 = mech('NO2')
+        def analysis(mech):
+            return dict(irr = mech.irr_dict['RXN_01'], nrxn = mech('NO2 Photolysis1'), hourly = mech('NO2 Photolysis1')[NO2].sum(0), total = mech('Whole_Mechanism')[NO2].sum(), family = mech.get_family_budget(['NOx']))
+        check = analysis(mech)
+        cell_bytes, ncells = _block_bytes(mrg, ('ROW', 'COL'))
+        self.assertEqual(_tile_slices(mrg, 4 * cell_bytes), [dict(ROW = row, COL = col) for row in (slice(0, 2), slice(2, 4), slice(4, 5)) for col in (slice(0, 2), slice(2, 4))])
+        self.assertEqual(len(_tile_slices(mrg, 1)), 20)
+        for processes in (1, 2):
+            result = mech.run_tiles(analysis, max_bytes = 1, processes = processes, combine = dict(total = 'sum'))
+            for key in ('irr', 'nrxn'):
+                self.assertEqual(set(result[key]._stoic.keys()), set(check[key]._stoic.keys()))
+                for spc_key, value in check[key]._stoic.items():
+                    self.assertEqual(result[key]._stoic[spc_key].shape, value.shape)
+                    self.assertTrue(allclose(result[key]._stoic[spc_key], value))
+            self.assertTrue(allclose(result['hourly'], check['hourly']))
+            self.assertTrue(allclose(result['total'], check['total']))
+            self.assertEqual(result['family'].net.shape, check['family'].net.shape)
+            self.assertTrue(allclose(result['family'].net, check['family'].net))
+        self.assertRaises(ValueError, mech.run_tiles, lambda mech: mech('NO2 Photolysis1')[NO2].mean(), max_bytes = 1, processes = 1)
+        self.assertEqual(mech.run_tiles(lambda mech: mech('NO2 Photolysis1')[NO2].max(), max_bytes = 1, processes = 1, combine = max), check['nrxn'][NO2].max())
+        self.assertTrue(mech.mrg is mrg)
+
+    def testNetReactionWeights(self):
+        self.assertEqual(_linear_weights('RXN_01 + RXN_02 + 2 * RXN_01'), dict(RXN_01 = 3, RXN_02 = 1))
+        self.assertEqual(_linear_weights('RXN_01 * .5'), dict(RXN_01 = .5))
+        self.assertEqual(_linear_weights('RXN_01 - RXN_02'), None)
+        self.assertEqual(_linear_weights('RXN_01 +'), None)
+        mech = self.mech
+        rxns = sorted(mech.reaction_dict.keys())
+        irr = self._irr(rxns)
+        mech.set_irr(irr, rxns)
+        nrxn = mech('Whole_Mechanism')
+        self.assertEqual([k for k, v in mech.nreaction_dict.loaded_items()], ['Whole_Mechanism'])
+        check = reduce(operator.add, [mech.irr_dict[rxn_name] for rxn_name in rxns])
+        self.assertEqual(nrxn.reaction_type, check.reaction_type)
+        self.assertEqual(set(nrxn._stoic.keys()), set(check._stoic.keys()))
+        for key, value in check._stoic.items():
+            self.assertTrue(allclose(nrxn._stoic[key], value, rtol = 1e-5))
+
+    def testLiveNamespace(self):
+        mech = self.mech
+        self.assertEqual(list(mech.variables.keys()), ['mech'])
+        self.assertTrue(mech('NO2') is mech.species_dict['NO2'])
+        self.assertEqual(mech('find_rxns'), mech.find_rxns)
+        self.assertFalse('set_irr' in mech.variables)
+        self.assertFalse('TEST_01' in mech.variables)
+        mech.add_rxn('TEST_01', 'NO2 + O3 ->[k] NO3 + O2')
+        self.assertTrue(mech('TEST_01') is mech.reaction_dict['TEST_01'])
+        mech.variables['TEST_01'] = 1
+        self.assertEqual(mech('TEST_01'), 1)
+
+    def testCache(self):
+        import tempfile
+        from os.path import join, dirname
+        old_cache = os.environ['PERMM_CACHE']
+        os.environ['PERMM_CACHE'] = tempfile.mkdtemp(dir = old_cache)
+        try:
+            path = join(dirname(__file__), '..', 'mechanisms', 'cb05_camx.yaml')
+            other = join(os.environ['PERMM_CACHE'], 'mechanism-000000000000-0.pickle')
+            open(other, 'wb').close()
+            cold = Mechanism(path)
+            self.assertTrue(os.path.exists(other))
+            self.assertTrue(os.path.exists(_cache_path(open(path).read())))
+            warm = Mechanism(path)
+            self.assertEqual(sorted(warm.species_dict.keys()), sorted(cold.species_dict.keys()))
+            self.assertEqual(warm.find_rxns(warm('NO2')), cold.find_rxns(cold('NO2')))
+            self.assertTrue(warm('NO2') is warm.species_dict['NO2'])
+            self.assertEqual(warm.net_reaction_dict, cold.net_reaction_dict)
+            del os.environ['PERMM_CACHE']
+            self.assertEqual(_cache_path(open(path).read()), None)
+        finally:
+            os.environ['PERMM_CACHE'] = old_cache
+
+    def testAddRxn(self):
+        mech = self.mech
+        mech.add_rxn('TEST_01', 'NO2 + O3 ->[k] NO3 + O2')
+        self.assertTrue('TEST_01' in mech.find_rxns(mech('NO2'), mech('NO3')))
+
+    def testFromEqns(self):
+        eqnstr = """#EQUATIONS
+// ozone photolysis
+<R1> O3 + hv = O1D + O2 : j(1) ;
+<R2> O1D + H2O = 2 OH :
+     2.2e-10 ;
+{R3.} OH + CO = HO2 + 0.5 CO2 : 1.5e-13 ;
+"""
+        mech = Mechanism.from_eqns(eqnstr)
+        self.assertEqual(sorted(mech.reaction_dict.keys()), ['IRR_R1', 'IRR_R2', 'IRR_R3'])
+        self.assertEqual(mech.reaction_dict['IRR_R2'][mech('OH')], 2.)
+        self.assertEqual(mech.reaction_dict['IRR_R3'][mech('CO2')], .5)
+        self.assertRaises(SyntaxError, Mechanism.from_eqns, '#EQUATIONS\n<R1> O3 + hv : j(1) ;\n')
+
+    def testImportTime(self):
+        """
+        import permm must not load plotting, GUI or netCDF backends and,
+        timed in a fresh interpreter, must stay within a generous budget
+        (seconds) so that only large regressions fail on slow machines
+        """
+        import subprocess
+        from os.path import join, dirname, abspath
+        budget = 5.
+        src = abspath(join(dirname(__file__), '..', '..'))
+        env = dict(os.environ, PYTHONPATH = os.pathsep.join([src, os.environ.get('PYTHONPATH', '')]))
+        code = "import sys, time; t = time.perf_counter(); import permm; print(time.perf_counter() - t); print(' '.join([k for k in ('matplotlib', 'pylab', 'netCDF4', 'PseudoNetCDF', 'wx', 'tkinter') if k in sys.modules]))"
+        out = subprocess.check_output([sys.executable, '-c', code], env = env, universal_newlines = True).split('\n')
+        self.assertEqual(out[1], '')
+        self.assertTrue(float(out[0]) < budget, 'import permm took %ss; the budget is %ss' % (out[0], budget))
+
+if __name__ == '__main__':
+    unittest.main()
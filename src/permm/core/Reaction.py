@@ -1,8 +1,10 @@
 from __future__ import print_function
 import operator
 import re
+import builtins
 from warnings import warn
 from copy import deepcopy
+from collections.abc import Mapping
 from numpy import ndarray, \
                   newaxis, \
                   float64, \
@@ -12,7 +14,13 @@ from numpy import ndarray, \
                   indices, \
                   equal, \
                   greater, \
-                  less
+                  less, \
+                  broadcast, \
+                  result_type, \
+                  empty, \
+                  asarray, \
+                  multiply, \
+                  broadcast_to
 from numpy.ma import sum, masked_less, masked_greater
 
 from permm.core.Species import Species
@@ -20,7 +28,7 @@ from functools import reduce
 
 ReactionGroup = str
 
-__all__ = ['Stoic', 'Reaction']
+__all__ = ['Stoic', 'FactorizedStoic', 'Reaction', 'LazyReaction', 'ParseReactionString', 'ParseReactionStrings', 'reaction_sum', 'reaction_sums']
 
 
 class Stoic(ndarray):
@@ -89,6 +97,35 @@ def StoicAdd(s1, s2):
 
 StoicAdd = vectorize(StoicAdd, otypes = [object])
 
+class FactorizedStoic(Mapping):
+    """
+    FactorizedStoic is a read-only stoichiometry mapping for reactions
+    whose stoichiometry is a scalar coefficient times one shared rate
+    array (e.g., a reaction multiplied by its IRR).
+    
+    Only the coefficients ({(spc, role): coeff}) and the rate are stored;
+    the array for a (spc, role) key is built when it is requested.
+    """
+    def __init__(self, coeff, rate):
+        self.coeff = coeff
+        self.rate = rate
+    
+    def __getitem__(self, key):
+        return self.coeff[key] * self.rate
+    
+    def __contains__(self, key):
+        return key in self.coeff
+    
+    def __iter__(self):
+        return iter(self.coeff)
+    
+    def __len__(self):
+        return len(self.coeff)
+
+_reaction_re = re.compile("(?P<reactants>.*)(?:=|->\\[(?P<rxn_type>[kjdeu])\\])\\s*(?P<products>.*)")
+
+_species_re = re.compile("(\\s?(?P<sign>[+-])?\\s?)?((?P<stoic>\\d{0,1}(\\.(\\d{1,3}(E\\d{2})?)?)?)[* ])?(?P<name>[a-zA-Z]\\w*)(?:[ +=]|$)+",re.M)
+
 def ParseReactionString(rxn_str):
     """
     ReactionFromString is a convenience function.  It creates
@@ -100,55 +137,78 @@ def ParseReactionString(rxn_str):
     For example:
         OH + OLE =k> 0.8*FORM + 0.33*ALD2 + 0.62*ALDX + 0.8*XO2 + 0.95*HO2 - 0.7 PAR
     """
+    parsed = _parse_reaction(rxn_str, {})
+    if parsed is None:
+        raise SyntaxError("Reactions must match the following patter\n\n<%%d> stoic*spc ([+-] stoic*spc)* =[kjude]> [stoic*spc] ([+-] stoic*spc)*\n\n%s" % (rxn_str,))
+    return parsed
+
+def ParseReactionStrings(rxn_strs):
+    """
+    ParseReactionStrings parses a whole reaction list in one pass 
+    (see ParseReactionString for the syntax).
+    
+        rxn_strs - dictionary of reaction name: reaction string
+    
+    Returns stoics, reaction_types, failed where stoics and reaction_types
+    are dictionaries keyed by reaction name and failed is a dictionary
+    of reaction name: reaction string for each line that did not parse.
+    stoics and reaction_types can be passed directly to 
+    StoicMatrix.from_stoics or Reaction(..., copy = False)
+    """
     stoics = {}
+    reaction_types = {}
+    failed = {}
+    values = {}
+    for rxn_name, rxn_str in rxn_strs.items():
+        try:
+            parsed = _parse_reaction(rxn_str, values)
+        except (TypeError, ValueError):
+            parsed = None
+        if parsed is None:
+            failed[rxn_name] = rxn_str
+        else:
+            stoics[rxn_name], reaction_types[rxn_name] = parsed
     
-    reaction_re = re.compile("(?P<reactants>.*)(?:=|->\[(?P<rxn_type>[kjdeu])\])\s*(?P<products>.*)")
+    return stoics, reaction_types, failed
 
-    species_re = re.compile("(\s?(?P<sign>[+-])?\s?)?((?P<stoic>\d{0,1}(\.(\d{1,3}(E\d{2})?)?)?)[* ])?(?P<name>[a-zA-Z]\w*)(?:[ +=]|$)+",re.M)
-    
-    reaction_match = reaction_re.match(rxn_str)
+def _parse_reaction(rxn_str, values):
+    """
+    Parse one reaction string; values is a cache of coefficient
+    strings to floats that is shared across a reaction list.  Returns
+    None if rxn_str is not a reaction
+    """
+    reaction_match = _reaction_re.match(rxn_str)
     if reaction_match is None:
-        raise SyntaxError("Reactions must match the following patter\n\n<%%d> stoic*spc ([+-] stoic*spc)* =[kjude]> [stoic*spc] ([+-] stoic*spc)*\n\n%s" % (rxn_str,))
+        return None
 
-    reactants = reaction_match.groupdict()['reactants']
-    reaction_type = reaction_match.groupdict()['rxn_type']
+    reactants, reaction_type, products = reaction_match.group('reactants', 'rxn_type', 'products')
     if reaction_type is None:
         reaction_type = 'u'
-    products = reaction_match.groupdict()['products']
-
-    for spc in species_re.finditer(reactants):
-        spc_g = spc.groupdict()
-        name = spc_g['name']
-        sign = spc_g['sign']
-        stoic = spc_g['stoic']
-        if sign is None:
-            sign = ''
-
-        if stoic is None:
-            stoic = '1'
-
-        if (name, 'r') in stoics:
-            stoics[name, 'r'] += -float(sign + stoic)
-        else:
-            stoics[name, 'r'] = -float(sign + stoic)
 
+    stoics = {}
+    for side, role, default_sign in ((reactants, 'r', ''), (products, 'p', '+')):
+        for spc in _species_re.finditer(side):
+            sign, stoic, name = spc.group('sign', 'stoic', 'name')
+            if sign is None:
+                sign = default_sign
     
-    for spc in species_re.finditer(products):
-        spc_g = spc.groupdict()
-        name = spc_g['name']
-        sign = spc_g['sign']
-        stoic = spc_g['stoic']
-        if sign is None:
-            sign = '+'
-
-        if stoic is None:
-            stoic = '1'
-        
-        value = float(sign + stoic)
-        if (name, 'p') in stoics:
-            stoics[name, 'p'] += value
-        else:
-            stoics[name, 'p'] = value
+            if stoic is None:
+                stoic = '1'
+            
+            coeff = sign + stoic
+            try:
+                value = values[coeff]
+            except KeyError:
+                value = values[coeff] = float(coeff)
+            
+            if role == 'r':
+                value = -value
+            
+            key = name, role
+            if key in stoics:
+                stoics[key] += value
+            else:
+                stoics[key] = value
 
     return stoics, reaction_type
     
@@ -182,7 +242,7 @@ class Reaction(object):
     """
     __array_priority__ = 1000.
 
-    def __init__(self, stoic, reaction_type = 'k', safe = False):
+    def __init__(self, stoic, reaction_type = 'k', safe = False, rate = None, copy = True):
         """
             roles - dictionary of specific roles; for species whose 
                     stoichiometric sign is inconsistent with their 
@@ -192,13 +252,32 @@ class Reaction(object):
                     can be scalars or ndarrays
             safe - when species roles are not found, find any version of
                    that species to prevent an error
+            rate - optional array shared by all species; when provided, stoic
+                   values must be scalar coefficients and each species 
+                   stoichiometry is coefficient * rate (see FactorizedStoic)
+            copy - when False, the stoic dictionary and its arrays are adopted
+                   rather than copied; reactions never change their arrays 
+                   in place, so adopted arrays can be shared
         """
         if isinstance(stoic, str):
             stoic, reaction_type = ParseReactionString(stoic)
+        
+        if isinstance(stoic, FactorizedStoic) and rate is None:
+            stoic, rate = stoic.coeff, stoic.rate
 
         self.reaction_type = reaction_type
         self._safe = safe
-        self._stoic = deepcopy(stoic)
+        self._rate = rate
+        if rate is not None:
+            self._stoic = FactorizedStoic(dict([(k, float64(v)) for k, v in stoic.items()]), rate)
+            self.shape = getattr(rate, 'shape', ())
+            self._update_roles()
+            return
+            
+        if copy:
+            self._stoic = deepcopy(stoic)
+        else:
+            self._stoic = stoic
         self._update_roles()
         try:
             first_key = list(self._stoic.keys())[0]
@@ -211,7 +290,14 @@ class Reaction(object):
         except IndexError as xxx_todo_changeme1:
             (e) = xxx_todo_changeme1
             self.shape = ()
-            
+    
+    @classmethod
+    def _adopt(cls, stoic, reaction_type):
+        """
+        Create a reaction from stoic without copying; arrays may be shared
+        with other reactions
+        """
+        return cls(stoic, reaction_type = reaction_type, copy = False)
     
     def _update_roles(self):
         keys = list(self._stoic.keys())
@@ -249,6 +335,15 @@ class Reaction(object):
         else:
             raise TypeError('Unknown comparison: __contains__ for Reaction and %s' % str(type(lhs)))
             
+    @property
+    def nbytes(self):
+        """
+        Bytes held by stoichiometry (and shared rate) arrays
+        """
+        if isinstance(self._stoic, FactorizedStoic):
+            return getattr(self._stoic.rate, 'nbytes', 0)
+        return int(builtins.sum(dict([(id(v), getattr(v, 'nbytes', 0)) for v in self._stoic.values()]).values()))
+    
     def __getitem__(self, item):
         """
         Return a stoichiometry for a species or, if item is not a species, return
@@ -270,25 +365,22 @@ class Reaction(object):
                     role = 'u'
                 
             return Stoic(outvalue, role = role)
+        elif self._rate is not None:
+            return Reaction(self._stoic.coeff, reaction_type = self.reaction_type, rate = self._rate[item])
         else:
-            return Reaction(dict([(k,v[item]) for k, v in self._stoic.items()]), reaction_type = self.reaction_type)
+            return Reaction._adopt(dict([(k,v[item]) for k, v in self._stoic.items()]), self.reaction_type)
     
     def __str__(self):
         """
         Report all values followed by the sum value for the reaction
         """
         result = ''
-        temp = self.copy()
-        temp.shape = ()
         if self.shape != ():
             result += '%d Reactions with shape %s\n' % (reduce(int.__mul__, self.shape), str(self.shape))
             for idx in indices(self.shape).reshape(len(self.shape), -1).swapaxes(0,1):
                 idx = tuple(idx)
                 result += str(idx) + ': '
-                for spc in list(self._stoic.keys()):
-                    temp._stoic[spc] = self._stoic[spc][idx]
-                temp._update_roles()
-                result += str(temp)+', \n'
+                result += str(self[idx])+', \n'
             result = result[:-3]+'\n'
         sum_result = self.display(digits = 5, nspc = 1000)
 
@@ -310,13 +402,17 @@ class Reaction(object):
         """
         reactants = []
         products = []
-        for (spcn, role), v in self._stoic.items():
+        if self._rate is not None:
+            rate_sum = self._rate.sum()
+            sums = [(key, c * rate_sum) for key, c in self._stoic.coeff.items()]
+        else:
+            sums = [(key, v.sum()) for key, v in self._stoic.items()]
+        for (spcn, role), v in sums:
             if role == 'r':
-                reactants.append((self._stoic[spcn, role].sum(), spcn))
+                reactants.append((v, spcn))
             elif role == 'p':
-                products.append((self._stoic[spcn, role].sum(), spcn))
+                products.append((v, spcn))
             else:
-                v = self._stoic[spcn, role].sum()
                 if v < 0:
                     reactants.append((v, spcn))
                 else:
@@ -348,39 +444,54 @@ class Reaction(object):
         """
         Add reactions to make a net reaction or add species to an existing reaction.
         """
-        if isinstance(rhs,Reaction):
-            kwds = {}
-            
-            for key, v in self._stoic.items():
-                kwds[key] = self._stoic[key].copy()
-            
-            for key, v in rhs._stoic.items():
-                if key in kwds:
-                    kwds[key] += rhs._stoic[key].copy()
-                else:
-                    kwds[key] = rhs._stoic[key].copy()
+        if isinstance(rhs, LazyReaction):
+            return self.lazy() + rhs
 
+        elif isinstance(rhs,Reaction):
             if self.reaction_type == rhs.reaction_type:
                 reaction_type = self.reaction_type
             else:
                 reaction_type = 'n'
 
+            if self._rate is not None and self._rate is rhs._rate:
+                # Same rate; only coefficients need to be added
+                coeff = dict(self._stoic.coeff)
+                for key, v in rhs._stoic.coeff.items():
+                    coeff[key] = coeff.get(key, 0.) + v
+                return Reaction(coeff, reaction_type = reaction_type, rate = self._rate)
+
+            # Arrays found on one side only are shared with the new reaction
+            kwds = dict(self._stoic)
+            for key, v in rhs._stoic.items():
+                if key in kwds:
+                    kwds[key] = kwds[key] + v
+                else:
+                    kwds[key] = v
+
         elif isinstance(rhs,Species):
             return self.__add_if_in_spclist(rhs,self._species)
 
         else:
             raise TypeError("Currently, only reactions can be added together")
         
-        return Reaction(kwds, reaction_type = reaction_type)
-        
+        return Reaction._adopt(kwds, reaction_type)
+    
     def __rmul__(self,irrs):
         return self.__mul__(irrs)
         
     def __mul__(self,irrs):
-        species = self._species
+        """
+        Multiply stoichiometry by a scalar or array.  A scalar reaction
+        multiplied by an array (e.g., IRR) stores the array once as a 
+        shared rate rather than one product per species.
+        """
+        if self._rate is not None:
+            return Reaction(self._stoic.coeff, reaction_type = self.reaction_type, rate = self._rate * irrs)
+        elif self.shape == () and isinstance(irrs, ndarray) and irrs.ndim > 0:
+            return Reaction(self._stoic, reaction_type = self.reaction_type, rate = irrs)
+        
         values = dict([(k,v*irrs) for k, v in self._stoic.items()])
-        result = Reaction(values, reaction_type = self.reaction_type)
-        return result
+        return Reaction._adopt(values, self.reaction_type)
 
     def __add_if_in_spclist(self,rhs,spc_list):
         if not self.has_spc(rhs):
@@ -390,44 +501,48 @@ class Reaction(object):
             return self.copy()
         elif rhs.exclude:
             raise ValueError('Exclude is not supported')
-        result = self.copy()
-        new_stoic = result[rhs]
-        
-        result._roles[rhs.name] = new_stoic.role
-        result._species += (rhs.name,)
-        result._stoic[rhs.name] = new_stoic.view(ndarray)
-        result._update_roles()
-
-        return result
+        stoic = dict(self._stoic)
+        new_stoic = self[rhs]
+        stoic[rhs.name, new_stoic.role] = new_stoic.view(ndarray)
+        return Reaction._adopt(stoic, self.reaction_type)
             
     def copy(self):
         """
         Create a copy of the reaction such that stoichiometry 
         are not shared
         """
-        return Reaction(dict([(k, v.copy()) for k, v in self._stoic.items()]), reaction_type = self.reaction_type, )
+        if self._rate is not None:
+            return Reaction(self._stoic.coeff, reaction_type = self.reaction_type, rate = self._rate.copy())
+        stoic = dict([(k, v.copy()) for k, v in self._stoic.items()])
+        return Reaction._adopt(stoic, self.reaction_type)
 
+    def lazy(self):
+        """
+        Return a LazyReaction for deferred algebra with this reaction
+        """
+        return LazyReaction(('leaf', 1, self))
+    
     def sum(self, axis = None):
         """
         Sum stoichiometries and create a scalar reaction
         """
-        result = self.copy()
-        for key in list(result._stoic.keys()):
-            result._stoic[key] = self._stoic[key].sum(axis)
-        result.shape = ()
-        result._update_roles()
-        return result
+        return self.__reduce_stoic('sum', axis)
         
     def mean(self, axis = None):
         """
         Mean stoichiometries and create a scalar reaction
         """
-        result = self.copy()
-        for spc in result._species:
-            result._stoic[spc] = self._stoic[spc].mean(axis)
-        result.shape = ()
-        result._update_roles()
-        return result
+        return self.__reduce_stoic('mean', axis)
+    
+    def __reduce_stoic(self, method, axis):
+        if self._rate is not None:
+            rate = getattr(self._rate, method)(axis)
+            if axis is not None:
+                return Reaction(self._stoic.coeff, reaction_type = self.reaction_type, rate = rate)
+            values = dict([(k, c * rate) for k, c in self._stoic.coeff.items()])
+        else:
+            values = dict([(k, getattr(v, method)(axis)) for k, v in self._stoic.items()])
+        return Reaction._adopt(values, self.reaction_type)
         
     def reactants(self):
         """
@@ -468,12 +583,14 @@ class Reaction(object):
             
         item = args[0]
 
-        values = []
+        # terms are (weight, (spc, role), sign filter)
+        terms = []
         roles = []
         if item.exclude:
             item_spc_roles = [k for k in item.iter_species_roles()]
             item_spcs = [k[0] for k in item_spc_roles]
             for spc, role in self._stoic:
+                key = (spc, role)
                 if role == 'u' and spc in item_spcs and (spc, 'u') not in item_spc_roles:
                     val = self._stoic[spc, role]
                     if greater(val, 0).all():
@@ -482,7 +599,7 @@ class Reaction(object):
                         role = 'r'
                 
                 if not (spc, role) in item_spc_roles:
-                    values.append(1 * self._stoic[spc, role])
+                    terms.append((1, key, None))
                     roles.append(role)
                     
                 
@@ -491,21 +608,17 @@ class Reaction(object):
                 spc_roles = props['role']
                 for role in spc_roles:
                     if (spc, role) in self._stoic:
-                        values.append(item.spc_dict[spc]['stoic'] * self._stoic[spc, role])
+                        terms.append((props['stoic'], (spc, role), None))
                         roles.append(role)
                 
                 if 'u' not in spc_roles and (spc, 'u') in self._stoic:
-                    val = self._stoic[spc, 'u']
-                    if role == 'p':
-                        values.append(item.spc_dict[spc]['stoic'] * masked_less(val, 0).filled(0))
-                        roles.append(role)
-                    elif role == 'r':
-                        values.append(item.spc_dict[spc]['stoic'] * masked_greater(val, 0).filled(0))
+                    if role in ('p', 'r'):
+                        terms.append((props['stoic'], (spc, 'u'), role))
                         roles.append(role)
                     
                 
                 
-        if len(values) == 0:
+        if len(terms) == 0:
             if self._safe:
                 if nargs == 1:
                     if item.name in self:
@@ -525,6 +638,23 @@ class Reaction(object):
             role = last_role
         else:
             role = 'u'
+        
+        if self._rate is not None and all([sign is None for weight, key, sign in terms]):
+            # Factorized reactions only need a scalar weight for the shared rate
+            coeff = self._stoic.coeff
+            weight = 0.
+            for w, key, sign in terms:
+                weight += w * coeff[key]
+            return Stoic(weight * self._rate, role = role)
+
+        values = []
+        for weight, key, sign in terms:
+            val = self._stoic[key]
+            if sign == 'p':
+                val = masked_less(val, 0).filled(0)
+            elif sign == 'r':
+                val = masked_greater(val, 0).filled(0)
+            values.append(weight * val)
         return Stoic(sum(values, axis = 0), role = role)
     
     def produces(self, item):
@@ -602,7 +732,17 @@ class Reaction(object):
             unk = spc in self._unspecified
             if not prd ^ rct ^ unk:
                 net_spcs.append(spc)
-        kwds = deepcopy(self._stoic)
+        
+        if self._rate is not None:
+            coeff = dict(self._stoic.coeff)
+            rate_nonzero = self._rate.any()
+            for spc in net_spcs:
+                new_val = coeff.pop((spc, 'r'), 0.) + coeff.pop((spc, 'p'), 0.) + coeff.pop((spc, 'u'), 0.)
+                if new_val != 0. and rate_nonzero:
+                    coeff[spc, 'u'] = new_val
+            return Reaction(coeff, reaction_type = self.reaction_type, rate = self._rate)
+        
+        kwds = dict(self._stoic)
         dummy_stoic = Stoic(0., role = 'u')
         for spc in net_spcs:
             rval = kwds.pop((spc, 'r'), dummy_stoic)
@@ -613,7 +753,7 @@ class Reaction(object):
             if not equal(new_val, 0.).all():
                 kwds[spc, 'u'] = new_val
 
-        return Reaction(kwds, reaction_type = self.reaction_type)
+        return Reaction._adopt(kwds, self.reaction_type)
 
     def condense(self, spco, name = None):
         """
@@ -628,17 +768,494 @@ class Reaction(object):
             new_val_dict = dict([(role, []) for role in new_roles])
             new_name = name or spco.name
             
-            kwds = deepcopy(self._stoic)
+            if self._rate is not None:
+                coeff = dict(self._stoic.coeff)
+                for spc, role in net_keys:
+                    new_val_dict[role].append(coeff.pop((spc, role)))
+                for new_role, new_vals in new_val_dict.items():
+                    coeff[new_name, new_role] = reduce(operator.add, new_vals)
+                return Reaction(coeff, reaction_type = self.reaction_type, rate = self._rate)
+
+            kwds = dict(self._stoic)
             for spc, role in net_keys:
                 new_val_dict[role].append(kwds.pop((spc, role)))
 
             for new_role, new_vals in new_val_dict.items():
                 kwds[new_name, new_role] = reduce(operator.add, new_vals)
-
-            return Reaction(kwds, reaction_type = self.reaction_type)
+            
+            return Reaction._adopt(kwds, self.reaction_type)
         else:
             return self.copy()
+
+def reaction_sum(reactions):
+    """
+    Return the sum of reactions; values are the same as 
+    reduce(Reaction.__add__, reactions), but each (species, role) is
+    accumulated once into its own buffer (see reaction_sums) rather than
+    copied at every addition
+    """
+    reactions = list(reactions)
+    if len(reactions) == 0:
+        return Reaction(stoic = dict())
+    return reaction_sums([[(1, rxn) for rxn in reactions]])[0]
+
+def reaction_sums(term_lists, workers = None):
+    """
+    Return a list of reactions; each is the sum of weight * reaction for a
+    list of (weight, reaction) terms in term_lists.  Values are the same as
+    reduce(Reaction.__add__, [weight * reaction, ...]).
+    
+    All sums are computed together as one sparse contraction of weights
+    (stoichiometry key x rate) with the distinct rate arrays.  Rates are the
+    shared rate of factorized reactions (e.g., IRR) or the arrays of other
+    reactions.  Each distinct sum (same rates and weights in the same 
+    order) is accumulated once, in place, and shared by every key that 
+    uses it; a sum has the same value whether it is computed alone or 
+    with other term lists.
+    
+    term_lists - list of lists of (weight, Reaction)
+    workers - optional number of threads that accumulate distinct sums;
+              each sum is accumulated by one thread in the same order, 
+              so results do not depend on workers
+    """
+    rates = []
+    rate_cols = {}
+    def rate_col(rate):
+        try:
+            return rate_cols[id(rate)]
+        except KeyError:
+            rates.append(rate)
+            col = rate_cols[id(rate)] = len(rates) - 1
+            return col
+    
+    results = [None] * len(term_lists)
+    group_rows = []
+    for gi, terms in enumerate(term_lists):
+        reaction_types = set([rxn.reaction_type for weight, rxn in terms])
+        if len(reaction_types) == 1:
+            reaction_type, = reaction_types
+        else:
+            reaction_type = 'k' if len(terms) == 0 else 'n'
+        rxn_rates = set([id(rxn._rate) for weight, rxn in terms])
+        if len(terms) > 0 and len(rxn_rates) == 1 and terms[0][1]._rate is not None:
+            # All terms share one rate; only coefficients are summed
+            coeff = {}
+            for weight, rxn in terms:
+                for key, c in rxn._stoic.coeff.items():
+                    coeff[key] = coeff.get(key, 0.) + weight * c
+            results[gi] = Reaction(coeff, reaction_type = reaction_type, rate = terms[0][1]._rate)
+            continue
+        
+        rows = {}
+        for weight, rxn in terms:
+            if rxn._rate is not None:
+                col = rate_col(rxn._rate)
+                items = [(key, col, weight * c) for key, c in rxn._stoic.coeff.items()]
+            else:
+                items = [(key, rate_col(v), weight) for key, v in rxn._stoic.items()]
+            for key, col, value in items:
+                row = rows.setdefault(key, {})
+                row[col] = row.get(col, 0.) + value
+        group_rows.append((gi, reaction_type, rows))
+    
+    if len(group_rows) == 0:
+        return results
+    
+    shapes = [getattr(rate, 'shape', ()) for rate in rates]
+    # dtype matches coefficient * rate (e.g., float32 IRR)
+    dtypes = [(float64(1.) * asarray(rate).ravel()[:1]).dtype for rate in rates]
+    
+    # Unique sums; sums that mix rate shapes are added pairwise
+    signatures = {}
+    row_keys = []
+    for gi, reaction_type, rows in group_rows:
+        if len(set([shapes[col] for row in rows.values() for col in row])) > 1:
+            results[gi] = reduce(operator.add, [rxn if weight == 1 else weight * rxn for weight, rxn in term_lists[gi]])
+            row_keys.append(None)
+            continue
+        keys = []
+        for key, row in rows.items():
+            # terms are accumulated in the order of term_lists
+            signature = tuple(row.items())
+            keys.append((key, signatures.setdefault(signature, len(signatures))))
+        row_keys.append(keys)
+    
+    def accumulate(signature):
+        (col, weight), rest = signature[0], signature[1:]
+        value = empty(shapes[col], dtype = result_type(*[dtypes[c] for c, w in signature]))
+        multiply(rates[col], weight, out = value, casting = 'unsafe')
+        for col, weight in rest:
+            if weight == 1:
+                value += rates[col]
+            else:
+                value += weight * rates[col]
+        return value if value.ndim > 0 else value[()]
+    
+    signature_list = sorted(signatures, key = signatures.get)
+    if workers is None or workers < 2 or len(signature_list) < 2:
+        values = [accumulate(signature) for signature in signature_list]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            values = list(pool.map(accumulate, signature_list))
+    
+    for (gi, reaction_type, rows), keys in zip(group_rows, row_keys):
+        if keys is None:
+            continue
+        stoic = dict([(key, values[si]) for key, si in keys])
+        results[gi] = Reaction._adopt(stoic, reaction_type)
+    return results
         
+def _reaction_subset(rxn, names):
+    """
+    Return rxn with only the stoichiometry of species in names; arrays
+    (or the rate) are shared
+    """
+    if names is None:
+        return rxn
+    if rxn._rate is not None:
+        return Reaction(dict([(k, c) for k, c in rxn._stoic.coeff.items() if k[0] in names]), reaction_type = rxn.reaction_type, rate = rxn._rate)
+    stoic = dict([(k, v) for k, v in rxn._stoic.items() if k[0] in names])
+    return Reaction._adopt(stoic, rxn.reaction_type)
+
+def _is_array(value):
+    return isinstance(value, ndarray) and value.ndim > 0
+
+def _is_one(value):
+    return isinstance(value, (int, float)) and value == 1
+
+def _lazy_sum(children):
+    terms = []
+    for child in children:
+        if child[0] == 'sum':
+            terms.extend(child[1])
+        else:
+            terms.append(child)
+    return ('sum', terms)
+
+def _lazy_scale(node, weight):
+    """
+    Multiply a lazy node by weight; weights are pushed to component 
+    reactions through sums and condense
+    """
+    kind = node[0]
+    if kind == 'leaf':
+        return ('leaf', node[1] * weight, node[2])
+    elif kind == 'sum':
+        return ('sum', [_lazy_scale(child, weight) for child in node[1]])
+    elif kind == 'condense':
+        return ('condense', _lazy_scale(node[1], weight)) + node[2:]
+    return ('scale', node, weight)
+
+def _lazy_index(node, key):
+    """
+    Index a lazy node; indices are pushed to component reactions (as
+    views) through sums and condense
+    """
+    kind = node[0]
+    if kind == 'leaf':
+        weight, rxn = node[1:]
+        if rxn.shape == () and _is_array(weight):
+            return ('leaf', weight[key], rxn)
+        elif rxn.shape != () and (not _is_array(weight) or weight.shape == rxn.shape):
+            return ('leaf', weight[key] if _is_array(weight) else weight, rxn[key])
+    elif kind == 'sum':
+        return ('sum', [_lazy_index(child, key) for child in node[1]])
+    elif kind == 'condense':
+        return ('condense', _lazy_index(node[1], key)) + node[2:]
+    return ('index', node, key)
+
+def _lazy_shape(node):
+    """
+    Shape of a lazy node when it is known without evaluation; otherwise, None
+    """
+    kind = node[0]
+    if kind == 'leaf':
+        weight, rxn = node[1:]
+        try:
+            return broadcast(broadcast_to(0., getattr(weight, 'shape', ())), broadcast_to(0., rxn.shape)).shape
+        except ValueError:
+            return None
+    elif kind == 'sum':
+        shapes = set([_lazy_shape(child) for child in node[1]])
+        if len(shapes) == 1:
+            return shapes.pop()
+    elif kind == 'condense':
+        return _lazy_shape(node[1])
+    return None
+
+def _lazy_evaluate(node, reduction = None, names = None):
+    """
+    Return the Reaction for a lazy node.  reduction - optional (method,
+    axis) for sum or mean; it is applied to component reactions before
+    they are added when shapes allow.  names - optional set of species
+    names that are needed; other species may be left out.
+    """
+    kind = node[0]
+    if reduction is not None:
+        method, axis = reduction
+    if kind == 'leaf':
+        weight, rxn = node[1:]
+        rxn = _reaction_subset(rxn, names)
+        if reduction is None:
+            return rxn if _is_one(weight) else rxn * weight
+        elif _is_array(weight):
+            return getattr(rxn * weight, method)(axis)
+        result = getattr(rxn, method)(axis)
+        return result if _is_one(weight) else result * weight
+    elif kind == 'sum':
+        if reduction is not None and _lazy_shape(node) is None:
+            return getattr(_lazy_evaluate(node, None, names), method)(axis)
+        terms = []
+        for child in node[1]:
+            if child[0] == 'leaf' and reduction is None and not _is_array(child[1]):
+                terms.append((child[1], _reaction_subset(child[2], names)))
+            else:
+                terms.append((1, _lazy_evaluate(child, reduction, names)))
+        return reaction_sums([terms])[0]
+    elif kind == 'condense':
+        child, spco, name = node[1:]
+        if names is not None and (spco.exclude or (name or spco.name) in names):
+            names = None if spco.exclude else names.union(spco.spc_dict)
+        return _lazy_evaluate(child, reduction, names).condense(spco, name)
+    elif kind == 'scale' and reduction is not None and not _is_array(node[2]):
+        return _lazy_evaluate(node[1], reduction, names) * node[2]
+    
+    if kind == 'net':
+        child, spco = node[1:]
+        if names is not None and spco is not None:
+            names = names.union([spco.name])
+        result = _lazy_evaluate(child, None, names).net(spco)
+    elif kind == 'scale':
+        result = _lazy_evaluate(node[1], None, names) * node[2]
+    elif kind == 'index':
+        result = _lazy_evaluate(node[1], None, names)[node[2]]
+    if reduction is None:
+        return result
+    return getattr(result, method)(axis)
+
+class LazyReaction(Reaction):
+    """
+    Deferred Reaction algebra (see Reaction.lazy).  Addition, 
+    multiplication, slicing, net, condense and get_spc build an 
+    expression graph; values are computed at sum, mean, array conversion
+    (of get_spc results) or printing.  Only requested species are 
+    computed and reductions are applied to component reactions before 
+    they are added.  Other attributes come from the evaluated Reaction.
+    
+    LazyReaction is a Reaction (isinstance checks pass), but it does not 
+    call Reaction.__init__; stoichiometry, shape and reaction_type are 
+    read from the evaluated Reaction when needed.
+    """
+    def __init__(self, node):
+        self._node = node
+        self._value = None
+    
+    def evaluate(self):
+        """
+        Return the evaluated Reaction
+        """
+        if self._value is None:
+            self._value = _lazy_evaluate(self._node)
+        return self._value
+    
+    def lazy(self):
+        return self
+    
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in ('_node', '_value'):
+            raise AttributeError(attr)
+        return getattr(self.evaluate(), attr)
+    
+    def __add__(self, rhs):
+        if isinstance(rhs, Reaction):
+            return LazyReaction(_lazy_sum([self._node, rhs.lazy()._node]))
+        return self.evaluate() + rhs
+    
+    def __radd__(self, lhs):
+        if isinstance(lhs, Reaction):
+            return lhs.lazy() + self
+        return lhs + self.evaluate()
+    
+    def __mul__(self, weight):
+        if isinstance(weight, LazyStoic):
+            weight = weight.evaluate()
+        return LazyReaction(_lazy_scale(self._node, weight))
+    
+    __rmul__ = __mul__
+    
+    def __getitem__(self, item):
+        if isinstance(item, Species):
+            return self.get_spc(item)
+        elif isinstance(item, str):
+            return self.evaluate()[item]
+        return LazyReaction(_lazy_index(self._node, item))
+    
+    def __contains__(self, item):
+        return item in self.evaluate()
+    
+    def get_spc(self, *args):
+        return LazyStoic(self._node, args)
+    
+    def net(self, spco = None):
+        return LazyReaction(('net', self._node, spco))
+    
+    def condense(self, spco, name = None):
+        if not isinstance(spco, Species):
+            raise TypeError('condense can only take Species objects')
+        return LazyReaction(('condense', self._node, spco, name))
+    
+    def sum(self, axis = None):
+        """
+        Sum stoichiometries and create a scalar reaction
+        """
+        return _lazy_evaluate(self._node, ('sum', axis))
+    
+    def mean(self, axis = None):
+        """
+        Mean stoichiometries and create a scalar reaction
+        """
+        return _lazy_evaluate(self._node, ('mean', axis))
+    
+    def __str__(self):
+        return str(self.evaluate())
+    
+    def __repr__(self):
+        return repr(self.evaluate())
+
+def _sign_filtered(rxn, item):
+    """
+    True when get_spc(item) would filter stoichiometry by sign (i.e., 
+    is not linear in the reaction stoichiometry)
+    """
+    if item.exclude:
+        return True
+    for spc, props in item.spc_dict.items():
+        if (spc, 'u') in rxn._stoic and len(props['role']) > 0 and 'u' not in props['role']:
+            return True
+    return False
+
+class LazyStoic(object):
+    """
+    Deferred stoichiometry of a species in a LazyReaction (see
+    LazyReaction.get_spc); sum and mean are applied to the component
+    reactions when get_spc is linear in their stoichiometry
+    """
+    def __init__(self, node, args):
+        self._node = node
+        self._args = args
+        self._value = None
+    
+    def __names(self):
+        item = self._args[0]
+        if item.exclude:
+            return None
+        return set(item.spc_dict).union([item.name])
+    
+    def evaluate(self):
+        """
+        Return the evaluated Stoic
+        """
+        if self._value is None:
+            self._value = _lazy_evaluate(self._node, None, self.__names()).get_spc(*self._args)
+        return self._value
+    
+    def __reduce_stoic(self, method, axis):
+        if self._value is None and not self._args[0].exclude:
+            rxn = _lazy_evaluate(self._node, (method, axis), self.__names())
+            if not _sign_filtered(rxn, self._args[0]):
+                return rxn.get_spc(*self._args)
+        return getattr(self.evaluate(), method)(axis)
+    
+    def sum(self, axis = None):
+        return self.__reduce_stoic('sum', axis)
+    
+    def mean(self, axis = None):
+        return self.__reduce_stoic('mean', axis)
+    
+    def asarray(self):
+        return self.evaluate().asarray()
+    
+    def __array__(self, dtype = None, copy = None):
+        return asarray(self.evaluate(), dtype = dtype)
+    
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in ('_node', '_args', '_value'):
+            raise AttributeError(attr)
+        return getattr(self.evaluate(), attr)
+    
+    # Arithmetic, comparison and indexing use the evaluated Stoic
+    def __add__(self, rhs):
+        return self.evaluate() + rhs
+    
+    def __radd__(self, lhs):
+        return lhs + self.evaluate()
+    
+    def __sub__(self, rhs):
+        return self.evaluate() - rhs
+    
+    def __rsub__(self, lhs):
+        return lhs - self.evaluate()
+    
+    def __mul__(self, rhs):
+        return self.evaluate() * rhs
+    
+    def __rmul__(self, lhs):
+        return lhs * self.evaluate()
+    
+    def __truediv__(self, rhs):
+        return self.evaluate() / rhs
+    
+    def __rtruediv__(self, lhs):
+        return lhs / self.evaluate()
+    
+    def __neg__(self):
+        return -self.evaluate()
+    
+    def __pos__(self):
+        return +self.evaluate()
+    
+    def __abs__(self):
+        return abs(self.evaluate())
+    
+    def __lt__(self, rhs):
+        return self.evaluate() < rhs
+    
+    def __le__(self, rhs):
+        return self.evaluate() <= rhs
+    
+    def __gt__(self, rhs):
+        return self.evaluate() > rhs
+    
+    def __ge__(self, rhs):
+        return self.evaluate() >= rhs
+    
+    def __eq__(self, rhs):
+        return self.evaluate() == rhs
+    
+    def __ne__(self, rhs):
+        return self.evaluate() != rhs
+    
+    def __getitem__(self, item):
+        return self.evaluate()[item]
+    
+    def __len__(self):
+        return len(self.evaluate())
+    
+    def __iter__(self):
+        return iter(self.evaluate())
+    
+    def __float__(self):
+        return float(self.evaluate())
+    
+    __hash__ = None
+    
+    def __str__(self):
+        return str(self.evaluate())
+    
+    def __repr__(self):
+        return repr(self.evaluate())
+
 import unittest
 
 class ReactionTestCase(unittest.TestCase):
@@ -662,6 +1279,7 @@ class ReactionTestCase(unittest.TestCase):
                        'OplO3': 'O + O2 + M ->[k] O3 + M',
                        'NTRplOH': 'NTR + OH ->[k] HNO3 + HO2 + 0.330*FORM + 0.330*ALD2 + 0.330*ALDX - 0.660*PAR'
                       }
+        self.rxn_strings = rxn_strings
         self.rxns = {}
         for label, rxn_str in rxn_strings.items():
             self.rxns[label] = Reaction(rxn_str)
@@ -764,6 +1382,158 @@ class ReactionTestCase(unittest.TestCase):
         for spcn in ["PAR"]:
             spc = self.spcs[spcn]
             self.assertTrue((r2[spc] == (-a * .66)).all())
+    
+    def testCopyOnWrite(self):
+        from numpy import arange
+        a = arange(4, dtype = 'd')
+        r1 = self.rxns['NO2hv'] * (a * 1.)
+        r2 = self.rxns['OplO3'] * (a * 2.)
+        r3 = r1 + r2
+        self.assertTrue(r3._stoic['NO2', 'r'] is not r1._stoic['NO2', 'r'])
+        before = r3
+        r4 = r3 + r3
+        r3 += r4
+        self.assertTrue(r3 is not before)
+        self.assertTrue((before[self.spcs['O3']] == a * 2).all())
+        self.assertTrue((r3[self.spcs['O3']] == a * 6).all())
+        self.assertTrue((r4[self.spcs['O3']] == a * 4).all())
+        r5 = r4[:2]
+        r5 *= 2
+        self.assertTrue((r5[self.spcs['O3']] == a[:2] * 8).all())
+        self.assertTrue((r4[self.spcs['O3']] == a * 4).all())
+        r6 = self.rxns['NTRplOH'] + self.spcs['ALD']
+        self.assertTrue((r6[self.spcs['ALD']] == .99).all())
+        self.assertEqual(r6.roles(self.spcs['ALD'].name), set('p'))
+
+    def testSharedArrays(self):
+        from numpy import array, arange
+        a = Reaction({('X', 'p'): array([1., 2.])})
+        b = a + Reaction({('Y', 'p'): array([1., 2.])})
+        a *= 3.
+        self.assertTrue((b._stoic['X', 'p'] == [1., 2.]).all())
+        c = Reaction({('X', 'p'): array([1., 2.])}) + Reaction({('Y', 'p'): array([1., 2.])})
+        d = c + Reaction({('Z', 'p'): array([1., 2.])})
+        c += c
+        self.assertTrue((d._stoic['X', 'p'] == [1., 2.]).all())
+        e = Reaction({('Y', 'p'): array([1., 2.])})
+        e += c
+        c *= 2.
+        self.assertTrue((e._stoic['X', 'p'] == [2., 4.]).all())
+        
+        NO2, O3, NOx, ALD = self.spcs['NO2'], self.spcs['O3'], self.spcs['NOx'], self.spcs['ALD']
+        def check(make):
+            rxn = Reaction({('NO2', 'r'): array([2., 1.]), ('NO2', 'p'): array([1., 1.]), ('NO', 'p'): array([1., 2.]), ('O3', 'p'): array([3., 4.])})
+            result = make(rxn)
+            rxn *= 3.
+            self.assertTrue((result._stoic['O3', 'p'] == [3., 4.]).all())
+        check(lambda rxn: rxn.net())
+        check(lambda rxn: rxn.condense(NOx))
+        check(lambda rxn: _reaction_subset(rxn, ['O3']))
+        rxn = self.rxns['NTRplOH'] * arange(2.)
+        result = rxn + ALD
+        rxn *= 3.
+        self.assertTrue((result[ALD] == .99 * arange(2.)).all())
+        self.assertTrue((result._stoic['OH', 'r'] == -arange(2.)).all())
+
+    def testReactionSums(self):
+        from numpy import arange, allclose
+        a = arange(12, dtype = 'f').reshape(3, 4)
+        r1 = self.rxns['NO2hv'] * a
+        r2 = self.rxns['OplO3'] * (a + 1)
+        r3 = self.rxns['NTRplOH'] * (a + 2)
+        groups = [[(1, r1), (1, r2)], [(1, r1), (2, r3), (1, r2)], [(1, r1)], [(1, r1 + r2), (1, r3)],
+                  [(1, self.rxns['NO2hv']), (.5, self.rxns['OplO3'])]]
+        results = reaction_sums(groups)
+        for terms, result in zip(groups, results):
+            check = reduce(operator.add, [rxn if weight == 1 else weight * rxn for weight, rxn in terms])
+            self.assertEqual(result.reaction_type, check.reaction_type)
+            self.assertEqual(set(result._stoic.keys()), set(check._stoic.keys()))
+            for key in check._stoic:
+                self.assertTrue(allclose(result._stoic[key], check._stoic[key]))
+        self.assertTrue(results[2]._rate is a)
+        self.assertTrue(results[0]._stoic['M', 'r'] is results[1]._stoic['M', 'r'])
+        threaded = reaction_sums(groups, workers = 3)
+        for result, check in zip(threaded, results):
+            self.assertEqual(set(result._stoic.keys()), set(check._stoic.keys()))
+            for key in check._stoic:
+                self.assertTrue((asarray(result._stoic[key]) == asarray(check._stoic[key])).all())
+
+    def testLazy(self):
+        from numpy import arange, allclose
+        a = arange(12, dtype = 'f').reshape(3, 4)
+        r1 = self.rxns['NO2hv'] * a
+        r2 = self.rxns['OplO3'] * (a + 1)
+        r3 = self.rxns['NTRplOH'] * (a + 2)
+        NO2, NOx, PAR = self.spcs['NO2'], self.spcs['NOx'], self.spcs['PAR']
+        lazy = r1.lazy() + r2 * 2 + r3
+        self.assertTrue(isinstance(lazy, LazyReaction))
+        self.assertTrue(isinstance(lazy[:2][NOx], LazyStoic))
+        self.assertTrue(isinstance(lazy, Reaction))
+        self.assertTrue(isinstance(r1 + lazy, LazyReaction))
+        self.assertEqual(lazy._value, None)
+        eager = r1 + r2 * 2 + r3
+        checks = [(lazy[NO2].sum(), eager[NO2].sum()),
+                  (lazy[:2][PAR].mean(0), eager[:2][PAR].mean(0)),
+                  (lazy.net().condense(NOx, 'LUMP')[Species('LUMP')].sum(1), eager.net().condense(NOx, 'LUMP')[Species('LUMP')].sum(1)),
+                  ((lazy * a)[NO2.reactant()].sum(), (eager * a)[NO2.reactant()].sum()),
+                  (lazy.net()[-NOx].sum(), eager.net()[-NOx].sum()),
+                  (asarray(lazy[NOx]), eager[NOx]),
+                  (2 - lazy[NO2] * 3, 2 - eager[NO2] * 3),
+                  (-lazy[NO2] / 2, -eager[NO2] / 2)]
+        for result, check in checks:
+            self.assertTrue(allclose(result, check))
+        for result, check in [(lazy.sum(), eager.sum()), (lazy[1:].net(), eager[1:].net())]:
+            result = result.lazy().evaluate()
+            self.assertEqual(result.reaction_type, check.reaction_type)
+            self.assertEqual(set(result._stoic.keys()), set(check._stoic.keys()))
+            for key in check._stoic:
+                self.assertTrue(allclose(result._stoic[key], check._stoic[key]))
+        self.assertEqual(str(lazy), str(eager))
+        self.assertEqual(set(lazy.species()), set(eager.species()))
+        self.assertRaises(KeyError, lazy[Species('ISOP')].sum)
+
+    def testReactionSum(self):
+        from numpy import arange, allclose
+        rxns = [self.rxns[k] * (arange(6, dtype = 'd') + i) for i, k in enumerate(sorted(self.rxns) * 3)]
+        result = reaction_sum(rxns)
+        check = reduce(operator.add, rxns)
+        self.assertEqual(set(result._stoic.keys()), set(check._stoic.keys()))
+        for key in check._stoic:
+            self.assertTrue(allclose(result._stoic[key], check._stoic[key]))
+        self.assertEqual(len(reaction_sum([])._stoic), 0)
+
+    def testParseReactionStrings(self):
+        rxn_strings = dict(self.rxn_strings, BAD = 'NO2 + O3')
+        stoics, reaction_types, failed = ParseReactionStrings(rxn_strings)
+        self.assertEqual(failed, dict(BAD = 'NO2 + O3'))
+        for label, rxn_str in self.rxn_strings.items():
+            self.assertEqual((stoics[label], reaction_types[label]), ParseReactionString(rxn_str))
+        self.assertEqual(stoics['NTRplOH'][('PAR', 'p')], -0.66)
+        self.assertEqual(reaction_types['NO2hv'], 'j')
+        self.assertRaises(SyntaxError, ParseReactionString, 'NO2 + O3')
+
+    def testFactorized(self):
+        from numpy import arange, allclose
+        a = arange(0, 60, dtype = 'd').reshape(3,4,5) + .3
+        r1 = self.rxns['NTRplOH']
+        r2 = r1 * a
+        self.assertTrue(r2._rate is a)
+        self.assertTrue(isinstance(r2._stoic, FactorizedStoic))
+        self.assertEqual(r2.shape, a.shape)
+        self.assertTrue((r2[:2]._rate == a[:2]).all())
+        self.assertTrue(allclose(r2.sum()[self.spcs['PAR']], -.66 * a.sum()))
+        self.assertTrue(allclose(r2.sum(0)[self.spcs['HO2']], a.sum(0)))
+        self.assertTrue(allclose(r2.produces(self.spcs['ALD']), a * .99))
+        self.assertTrue(allclose(r2.consumes(self.spcs['OH']), a))
+        r3 = r2 + r2
+        self.assertTrue(r3._rate is a)
+        self.assertTrue(allclose(r3[self.spcs['HNO3']], 2 * a))
+        r4 = r2.condense(self.spcs['ALD'])
+        check = r1.condense(self.spcs['ALD']) * a
+        self.assertTrue(r4._rate is a)
+        self.assertEqual(set(r4._stoic.keys()), set(check._stoic.keys()))
+        for key in check._stoic:
+            self.assertTrue(allclose(r4._stoic[key], check._stoic[key]))
         
 if __name__ == '__main__':
     unittest.main()
@@ -773,8 +1543,7 @@ if __name__ == '__main__':
     NO = Species('NO')
     O = Species('O')
     O3 = Species('O3')
-    Ox = O3 + NO2
-    Ox.name = 'Ox'
+    Ox = Species(O3 + NO2, name = 'Ox')
     print(r1[NO2])
     print(r1[NO])
     print(r1[O])
@@ -1,86 +1,223 @@
-from copy import deepcopy
 import re
 import yaml
+from types import MappingProxyType
+from weakref import WeakValueDictionary
 from numpy import float32, float64, int8, int16, int32, int64
 
 _spc_def_re = re.compile(r'(?P<stoic>[-+]?[0-9]*\.?[0-9]+)?(?P<atom>\S+)\b(?=\s*\+\s*)?')
 
+# 'NAME: definition' strings that plain YAML would read as one 
+# {str: str or None} mapping; anything else is passed to yaml.load
+_spc_str_re = re.compile(r'''^\s*(?:'(?P<single>[^']*)'|"(?P<double>[^"\\]*)"|(?P<plain>[^\s'"#{}\[\]&*!|>%@`,:?-][^\s'"#{}\[\]&*!|>%@`,:]*))\s*:(?:\s+(?P<value>[^\s'"#{}\[\]&*!|>%@`,:?-][^'"#{}\[\]&*!|>%@`,:]*?))?\s*$''')
+_spc_value_re = re.compile(r'''^\s*(?P<value>[^\s'"#{}\[\]&*!|>%@`,:?-][^'"#{}\[\]&*!|>%@`,:]*?)?\s*$''')
+_yaml_resolver = yaml.resolver.Resolver()
+
+_atom_re = None
+_atom_guess_cache = {}
+_spc_str_cache = {}
+_interned = WeakValueDictionary()
+
+def _number(stoic):
+    try:
+        return int(stoic)
+    except ValueError:
+        return float(stoic)
+
+def _is_yaml_str(plain):
+    """
+    True if YAML reads the plain scalar as a string (e.g., NO is False)
+    """
+    return _yaml_resolver.resolve(yaml.ScalarNode, plain, (True, False)) == yaml.resolver.BaseResolver.DEFAULT_SCALAR_TAG
+
 def atom_parse(spc_def):
-    global _spc_def_re
-    from ..mechanisms import atoms as ALL_ATOMS
     atomdict = {}
     for stoic, atom in _spc_def_re.findall(spc_def):
         if stoic == '':
             stoic = '1'
         if atom not in atomdict:
-            atomdict[atom] = eval(stoic)
+            atomdict[atom] = _number(stoic)
         else:
-            atomdict[atom] += eval(stoic)
+            atomdict[atom] += _number(stoic)
     
     return atomdict
 
 def atom_guess(spc_name):
-    from ..mechanisms import atoms as ALL_ATOMS
+    """
+    Return {atom: count} from a definition (e.g., 2C + 1O + 4H) or 
+    a name (e.g., CH3CHO); results are memoized
+    """
+    global _atom_re
+    try:
+        return dict(_atom_guess_cache[spc_name])
+    except KeyError:
+        pass
     if '+' in spc_name or spc_name[:1].isdigit():
-        return atom_parse(spc_name)
-    lastl = ''
-    atom_dict = {}
-    atre = re.compile(
-        '(' + '|'.join(sorted(ALL_ATOMS, key=lambda x: -len(x))) + ')\s*(\d{1,10})'
-    )
-    for at, mul in atre.findall(spc_name):
-        if mul == '':
-            mul = '1'
-        atom_dict.setdefault(at, 0)
-        atom_dict[at] += int(mul)
-        # if l.isdigit():
-        #     atom_dict[lastl] += int(l) - 1
-        # elif l in ALL_ATOMS:
-        #     atom_dict.setdefault(l, 0)
-        #     atom_dict[l] += 1
-        #     
-        # lastl = l
-    return atom_dict
+        atom_dict = atom_parse(spc_name)
+    else:
+        if _atom_re is None:
+            from ..mechanisms import atoms as ALL_ATOMS
+            _atom_re = re.compile(
+                '(' + '|'.join(sorted(ALL_ATOMS, key=lambda x: -len(x))) + r')\s*(\d{1,10})'
+            )
+        atom_dict = {}
+        for at, mul in _atom_re.findall(spc_name):
+            if mul == '':
+                mul = '1'
+            atom_dict.setdefault(at, 0)
+            atom_dict[at] += int(mul)
+    _atom_guess_cache[spc_name] = atom_dict
+    return dict(atom_dict)
+
+def _atom_dict(name, spc_def):
+    if spc_def in (None, '', 'GUESS'):
+        return atom_guess(name)
+    elif spc_def != 'IGNORE':
+        return atom_guess(spc_def)
+    else:
+        return {}
+
+def _parse_spc_str(spc_str):
+    """
+    Return name, atom dictionary from a 'NAME: definition' string;
+    results are memoized
+    """
+    try:
+        name, atom_dict = _spc_str_cache[spc_str]
+        return name, dict(atom_dict)
+    except KeyError:
+        pass
+    text = spc_str
+    if not ':' in text:
+        text = text.strip() + ':'
+    match = _spc_str_re.match(text)
+    if match is not None:
+        k = match.group('single')
+        if k is None:
+            k = match.group('double')
+        if k is None:
+            k = match.group('plain')
+            if not _is_yaml_str(k):
+                match = None
+        v = match and match.group('value')
+        if v is not None and not _is_yaml_str(v):
+            match = None
+    if match is None:
+        defs = yaml.load(text)
+        if len(defs) > 1:
+            raise ValueError('Species class can only initialize one object at a time')
+        (k, v), = list(defs.items())
+        if k is False: k = 'NO'
+    
+    atom_dict = _atom_dict(k, v)
+    _spc_str_cache[spc_str] = k, atom_dict
+    return k, dict(atom_dict)
+
+def species_from_defs(spc_defs):
+    """
+    Create Species from a dictionary of name: definition (e.g., a 
+    mechanism species_list) in one pass; definitions use the Species
+    string syntax (2C + 1O + 4H, GUESS, IGNORE or empty)
+    """
+    species = {}
+    for name, spc_def in spc_defs.items():
+        if isinstance(spc_def, str):
+            match = _spc_value_re.match(spc_def)
+            if match is None or (match.group('value') is not None and not _is_yaml_str(match.group('value'))):
+                spc_def = yaml.load(spc_def)
+            else:
+                spc_def = match.group('value')
+        species[name] = Species({name: dict(stoic = 1, atoms = _atom_dict(name, spc_def))}, name = name)
+    return species
     
+_role_sets = {}
+_props_cache = {}
+
+def _frozen_props(stoic, role, atoms):
+    """
+    Return a read-only subspecies property mapping and its interning
+    key; role sets and unit stoichiometry properties (e.g., from
+    species definitions) are shared
+    """
+    role = frozenset(role)
+    role = _role_sets.setdefault(role, role)
+    # 1 and 1. hash equal; keep their types apart when interning
+    key = [type(stoic), stoic, role]
+    for atom, count in atoms.items():
+        key.extend((atom, type(count), count))
+    key = tuple(key)
+    try:
+        return _props_cache[key], key
+    except KeyError:
+        pass
+    props = MappingProxyType(dict(stoic = stoic, role = role, atoms = MappingProxyType(dict(atoms))))
+    if stoic == 1 and type(stoic) is int:
+        _props_cache[key] = props
+    return props, key
+
 class Species(object):
     """
     Species object has subspecies (e.g., NOx = NO + NO2) with
     stoichiometries and specified roles
+    
+    Species are immutable and interned: equal definitions (name, exclude
+    and spc_dict) return the same object, so Species hash and compare by
+    identity.  spc_dict is a read-only view; role variants (reactant,
+    product and unspecified) and name sets are built on first use and 
+    cached.
     """
-    def __init__(self, spc_dict, name = None, exclude = False):
+    __slots__ = ('spc_dict', 'name', 'exclude', '_name_set', '_species_roles', '_roles', '__weakref__')
+    
+    def __new__(cls, spc_dict, name = None, exclude = False):
         if isinstance(spc_dict, str):
-            if not ':' in spc_dict:
-                spc_dict = spc_dict.strip() + ':'
-            defs = yaml.load(spc_dict)
-            
-            if len(defs) > 1:
-                raise ValueError('Species class can only initialize one object at a time')
-            else:
-                (k, v), = list(defs.items())
-                if k is False: k = 'NO'
-                name = k
-                if v in (None, '', 'GUESS'):
-                    atom_dict = atom_guess(k)
-                elif v != 'IGNORE':
-                    atom_dict = atom_guess(v)
-                else:
-                    atom_dict = {}
-                spc_dict = {k: dict(stoic = 1, atoms = atom_dict)}
+            name, atom_dict = _parse_spc_str(spc_dict)
+            spc_dict = {name: dict(stoic = 1, atoms = atom_dict)}
+        elif isinstance(spc_dict, Species):
+            spc_dict = spc_dict.spc_dict
         
-        self.spc_dict = deepcopy(spc_dict)
-        if name:
-            self.name = name
-        else:
+        exclude = bool(exclude)
+        if not name:
             sep = {False: '+', True: '-'}[exclude]
             prefix = {False: '', True: '-'}[exclude]
-            self.name = prefix + sep.join(list(spc_dict.keys()))
-            
-        for spc, props in self.spc_dict.items():
-            props.setdefault('stoic', 1)
-            props['role'] = set(props.get('role', 'rup'))
-            props.setdefault('atoms', {})
-
-        self.exclude = exclude
+            name = prefix + sep.join(list(spc_dict.keys()))
+        
+        frozen = {}
+        key = [name, exclude]
+        for spc, props in spc_dict.items():
+            frozen[spc], props_key = _frozen_props(props.get('stoic', 1), props.get('role', 'rup'), props.get('atoms', {}))
+            key.append(spc)
+            key.append(props_key)
+        key = tuple(key)
+        try:
+            return _interned[key]
+        except KeyError:
+            pass
+        
+        self = object.__new__(cls)
+        set_attr = object.__setattr__
+        set_attr(self, 'spc_dict', MappingProxyType(frozen))
+        set_attr(self, 'name', name)
+        set_attr(self, 'exclude', exclude)
+        set_attr(self, '_name_set', None)
+        set_attr(self, '_species_roles', None)
+        set_attr(self, '_roles', None)
+        _interned[key] = self
+        return self
+    
+    def __setattr__(self, attr, value):
+        raise AttributeError("Species are immutable; use Species(spc, name = ...) to rename")
+    
+    def __delattr__(self, attr):
+        raise AttributeError("Species are immutable")
+    
+    def __reduce__(self):
+        spc_dict = dict([(spc, dict(stoic = props['stoic'], role = set(props['role']), atoms = dict(props['atoms']))) for spc, props in self.spc_dict.items()])
+        return Species, (spc_dict, self.name, self.exclude)
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
     
     def __getitem__(self, spc_key):
         if isinstance(spc_key, str):
@@ -93,7 +230,7 @@ class Species(object):
                 if this_props['role'].issubset(check_props['role']):
                     out_spc[this_spc] = new_props = {}
                     new_props['stoic'] = this_props['stoic'] * check_props['stoic']
-                    new_props['atoms'] = deepcopy(this_props['atoms'])
+                    new_props['atoms'] = dict(this_props['atoms'])
                     new_props['atoms'].update(check_props['atoms'])
                     new_props['role'] = this_props['role']
         if len(out_spc) == 0:
@@ -102,7 +239,7 @@ class Species(object):
         return Species(out_spc, exclude = spc_key.exclude)
     
     def __neg__(self):
-        return Species(deepcopy(self.spc_dict), name = '-(%s)' % self.name, exclude = True)
+        return Species(self.spc_dict, name = '-(%s)' % self.name, exclude = True)
     
     def __str__(self):
         if len(self.spc_dict) == 1:
@@ -125,13 +262,21 @@ class Species(object):
         """
         Return list of subspecies names
         """
-        return [n for n in list(self.spc_dict.keys())]
+        return list(self.spc_dict.keys())
+    
+    def name_set(self):
+        """
+        Return frozenset of subspecies names (cached)
+        """
+        if self._name_set is None:
+            object.__setattr__(self, '_name_set', frozenset(self.spc_dict.keys()))
+        return self._name_set
     
     def __contains__(self, lhs):
         if isinstance(lhs, Species):
-            return len(set(lhs.names()).intersection(self.names())) > 0
+            return not self.name_set().isdisjoint(lhs.name_set())
         elif isinstance(lhs, str):
-            return lhs in list(self.keys())
+            return lhs in self.spc_dict
             
     def __rmul__(self, y):
         return self.__mul__(y)
@@ -140,9 +285,7 @@ class Species(object):
         is_number = isinstance(y,(int,float, float32, float64, int8, int16, int32, int64))
         
         if is_number:
-            new_props = deepcopy(self.spc_dict)
-            for k, props in new_props.items():
-                props['stoic'] *= y
+            new_props = dict([(k, dict(props, stoic = props['stoic'] * y)) for k, props in self.spc_dict.items()])
             new_name = "%s * %f" % (self.name,float(y))
             new_exclude = y <= 0
             return Species(new_props, name = new_name, exclude = new_exclude)
@@ -188,8 +331,7 @@ class Species(object):
             for spc, props in self.spc_dict.items():
                 mul = props['atoms'].get(atom, 0)
                 if mul > 0:
-                    out_props[spc] = deepcopy(props)
-                    out_props[spc]['stoic'] *= mul
+                    out_props[spc] = dict(props, stoic = props['stoic'] * mul)
             if out_props == {}:
                 raise KeyError("Atom provided (%s) is not in %s" % (atom, self.name))
             else:
@@ -198,8 +340,10 @@ class Species(object):
             raise KeyError("Atom provided (%s) is not an atom" % atom)
     
     def copy(self):
-        result =  1*self
-        return result
+        """
+        Species are immutable, so copy returns self
+        """
+        return self
 
     def stoic(self, spc = None):
         """
@@ -215,9 +359,9 @@ class Species(object):
         """
         Iterate of subspecies and roles.
         """
-        for spc, props in self.spc_dict.items():
-            for role in props['role']:
-                yield spc, role
+        if self._species_roles is None:
+            object.__setattr__(self, '_species_roles', tuple([(spc, role) for spc, props in self.spc_dict.items() for role in props['role']]))
+        return iter(self._species_roles)
                 
     def role(self, spc = None):
         """
@@ -242,32 +386,37 @@ class Species(object):
         """
         return role in self.spc_dict[spc]['role']
         
+    def __with_role(self, role):
+        """
+        Return (and cache) this species with every subspecies as role
+        """
+        if self._roles is None:
+            object.__setattr__(self, '_roles', {})
+        try:
+            return self._roles[role]
+        except KeyError:
+            pass
+        new_props = dict([(spc, dict(props, role = role)) for spc, props in self.spc_dict.items()])
+        result = self._roles[role] = Species(new_props, name = self.name, exclude = self.exclude)
+        return result
+    
     def reactant(self):
         """
-        Return a copy of species as a reactant only
+        Return species as a reactant only
         """
-        new_props = deepcopy(self.spc_dict)
-        for v in new_props.values():
-            v['role'] = set('r')
-        return Species(new_props, name = self.name, exclude = self.exclude)
+        return self.__with_role('r')
 
     def unspecified(self):
         """
-        Return a copy of species as an unspecified role
+        Return species as an unspecified role
         """
-        new_props = deepcopy(self.spc_dict)
-        for v in new_props.values():
-            v['role'] = set('u')
-        return Species(new_props, name = self.name, exclude = self.exclude)
+        return self.__with_role('u')
 
     def product(self):
         """
-        Return a copy of species as a product
+        Return species as a product
         """
-        new_props = deepcopy(self.spc_dict)
-        for v in new_props.values():
-            v['role'] = set('p')
-        return Species(new_props, name = self.name, exclude = self.exclude)
+        return self.__with_role('p')
 
 def species_sum(species_list):
     if not all([isinstance(spc,Species) for spc in species_list]):
@@ -393,5 +542,43 @@ class SpeciesTestCase(unittest.TestCase):
         self.assertEqualSpecies(s1, s4)
         self.assertEqualSpecies(s1 + s2 + s3, s5)
 
+    def testFromStr(self):
+        OH = self.species['OH']
+        O3 = self.species['O3']
+        self.assertEqualSpecies(Species('OH: 1H + 1O'), OH)
+        self.assertEqualSpecies(Species("'OH': 1H + 1O"), OH)
+        self.assertEqualSpecies(Species('O3: GUESS'), O3)
+        self.assertEqualSpecies(Species('O3'), O3)
+        self.assertEqual(Species('NO').name, 'NO')
+        self.assertEqual(Species('NO: 1N + 1O').spc_dict['NO']['atoms'], dict(N = 1, O = 1))
+        self.assertEqual(Species('HNO3: IGNORE').spc_dict['HNO3']['atoms'], {})
+        self.assertEqual(Species('PAR: 0.5C').spc_dict['PAR']['atoms'], dict(C = .5))
+        self.assertRaises(ValueError, Species, '{OH: 1H + 1O, HO2: 1H + 2O}')
+        
+    def testFromDefs(self):
+        species = species_from_defs(dict(OH = '1H + 1O', HO2 = '1H + 2O', O3 = '', NO = 'IGNORE'))
+        for key in ['OH', 'HO2', 'O3']:
+            self.assertEqualSpecies(species[key], self.species[key])
+            self.assertEqual(species[key].name, key)
+        self.assertEqual(species['NO'].spc_dict['NO']['atoms'], {})
+
+    def testInterned(self):
+        import pickle
+        import operator
+        s1 = Species('NO') + Species('NO2')
+        s2 = Species('NO') + Species('NO2')
+        self.assertTrue(s1 is s2)
+        self.assertTrue(pickle.loads(pickle.dumps(s1)) is s1)
+        self.assertTrue(s1.copy() is s1)
+        self.assertTrue(s1.reactant() is s1.reactant())
+        self.assertEqual(s1.reactant().role(), set('r'))
+        self.assertEqual(s1.role(), set('rup'))
+        self.assertRaises(AttributeError, setattr, s1, 'name', 'NOx')
+        self.assertRaises(TypeError, operator.setitem, s1.spc_dict['NO'], 'stoic', 2)
+        s3 = Species(s1, name = 'NOx')
+        self.assertEqual(s3.name, 'NOx')
+        self.assertEqual(s1.name, 'NO+NO2')
+        self.assertEqualSpecies(s1, s3)
+
 if __name__ == '__main__':
     unittest.main()
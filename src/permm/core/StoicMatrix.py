@@ -0,0 +1,493 @@
+from numpy import array, \
+                  asarray, \
+                  zeros, \
+                  where, \
+                  maximum, \
+                  minimum, \
+                  diff, \
+                  add, \
+                  bincount, \
+                  cumsum, \
+                  flatnonzero, \
+                  lexsort, \
+                  packbits, \
+                  unpackbits, \
+                  frombuffer, \
+                  uint8, \
+                  intp, \
+                  int8, \
+                  float64, \
+                  newaxis
+
+from .Species import Species
+
+__all__ = ['StoicMatrix']
+
+_roles = ('r', 'p', 'u')
+_role_index = dict(r = 0, p = 1, u = 2)
+_role_names = dict(r = 'reactant', p = 'product', u = 'unspecified')
+
+# Family weight planes: reactant, product and positive/negative unspecified
+_planes = ('r', 'p', 'u+', 'u-')
+
+class StoicMatrix(object):
+    """
+    StoicMatrix is a sparse species x reaction stoichiometry matrix with
+    one plane per role: reactant (r), product (p) and unspecified (u).
+
+    Entries are stored in coordinate form (species, reaction, role, coefficient)
+    ordered by reaction.  Entries with a zero coefficient are kept so that
+    membership matches the (species, role) keys of each Reaction.
+
+    Reactions are indexed in sorted name order so that a boolean mask over
+    reactions converts directly to the sorted lists reported by find_rxns.
+    
+    The matrix also serves as an inverted species -> reaction index; bit i
+    of an integer bitset is reaction i.  Bitsets for each (species, role) 
+    are built on first use; reaction type bitsets are built with the 
+    matrix.  Queries combine them with &, | and ^.
+
+    StoicMatrix supports:
+        bits: bitset of reactions with any (species, role) of a Species
+        type_bits: bitset of reactions of a reaction type (e.g., 'kj')
+        contains: bits as a boolean mask
+        type_mask: type_bits as a boolean mask
+        names: reaction names for a mask or bitset
+        net: scalar net stoichiometry of a set of reactions
+        budget: production and loss of every species from reaction rates
+        family_weights: species families (e.g., NOx) as stacked weights
+        family_budget: production and loss of every family by reaction
+        element_balance: products - reactants of each element by reaction
+    """
+    def __init__(self, species, reactions, reaction_types, spc_idx, rxn_idx, role_idx, coeff):
+        """
+            species - sequence of species names (row labels)
+            reactions - sequence of reaction names (column labels)
+            reaction_types - sequence of reaction type characters
+            spc_idx, rxn_idx, role_idx - entry coordinates
+            coeff - entry stoichiometric coefficients
+        """
+        self.species = tuple(species)
+        self.reactions = tuple(reactions)
+        self.reaction_types = array(list(reaction_types), dtype = 'U1').reshape(len(self.reactions))
+        self.species_index = dict([(spc, i) for i, spc in enumerate(self.species)])
+        self.reaction_index = dict([(rxn, i) for i, rxn in enumerate(self.reactions)])
+        self.shape = (len(self.species), len(self.reactions), len(_roles))
+
+        spc_idx = array(spc_idx, dtype = intp).ravel()
+        rxn_idx = array(rxn_idx, dtype = intp).ravel()
+        role_idx = array(role_idx, dtype = int8).ravel()
+        coeff = array(coeff, dtype = float64).ravel()
+
+        # Reaction-major order for column access
+        order = lexsort((role_idx, spc_idx, rxn_idx))
+        self.spc_idx = spc_idx[order]
+        self.rxn_idx = rxn_idx[order]
+        self.role_idx = role_idx[order]
+        self.coeff = coeff[order]
+        self.rxn_ptr = self.__pointers(self.rxn_idx, self.shape[1])
+
+        # (species, role)-major order for row access
+        self.key_idx = self.spc_idx * len(_roles) + self.role_idx
+        self.key_order = lexsort((self.rxn_idx, self.key_idx))
+        self.key_ptr = self.__pointers(self.key_idx[self.key_order], self.shape[0] * len(_roles))
+        self.spc_ptr = self.key_ptr[::len(_roles)]
+
+        # Inverted index bitsets
+        self.all_bits = (1 << self.shape[1]) - 1
+        self.__key_bit_cache = {}
+        self.__type_bits = {}
+        for rt in set(self.reaction_types.tolist()):
+            self.__type_bits[rt] = self.__to_bits(self.reaction_types == rt)
+
+    @classmethod
+    def from_reactions(cls, reaction_dict):
+        """
+        Create a StoicMatrix from a dictionary of scalar Reaction objects
+        (e.g., Mechanism.reaction_dict)
+        """
+        stoics = dict([(rxn_name, rxn._stoic) for rxn_name, rxn in reaction_dict.items()])
+        reaction_types = dict([(rxn_name, rxn.reaction_type) for rxn_name, rxn in reaction_dict.items()])
+        return cls.from_stoics(stoics, reaction_types)
+
+    @classmethod
+    def from_stoics(cls, stoics, reaction_types):
+        """
+        Create a StoicMatrix from dictionaries of {(spc, role): coeff} 
+        stoichiometry and reaction types keyed by reaction name (e.g., 
+        the output of ParseReactionStrings)
+        """
+        reactions = sorted(stoics.keys())
+        species = sorted(set([spc for stoic in stoics.values() for spc, role in stoic]))
+        species_index = dict([(spc, i) for i, spc in enumerate(species)])
+        spc_idx = []
+        rxn_idx = []
+        role_idx = []
+        coeff = []
+        for ri, rxn_name in enumerate(reactions):
+            for (spc, role), value in stoics[rxn_name].items():
+                spc_idx.append(species_index[spc])
+                rxn_idx.append(ri)
+                role_idx.append(_role_index[role])
+                coeff.append(float64(value))
+
+        return cls(species, reactions, [reaction_types[rxn_name] for rxn_name in reactions], spc_idx, rxn_idx, role_idx, coeff)
+
+    @staticmethod
+    def __pointers(sorted_idx, n):
+        ptr = zeros(n + 1, dtype = intp)
+        ptr[1:] = cumsum(bincount(sorted_idx, minlength = n))
+        return ptr
+
+    def __key_rows(self, spc, role):
+        """
+        Return reaction indices for a (species name, role) pair
+        """
+        try:
+            key = self.species_index[spc] * len(_roles) + _role_index[role]
+        except KeyError:
+            return self.rxn_idx[:0]
+        start, end = self.key_ptr[key], self.key_ptr[key + 1]
+        return self.rxn_idx[self.key_order[start:end]]
+
+    def __to_bits(self, mask):
+        return int.from_bytes(packbits(mask, bitorder = 'little').tobytes(), 'little')
+    
+    def mask(self, bits):
+        """
+        Return a boolean mask over reactions from a bitset
+        """
+        nbytes = (self.shape[1] + 7) // 8
+        return unpackbits(frombuffer(bits.to_bytes(nbytes, 'little'), dtype = uint8), count = self.shape[1], bitorder = 'little').astype('bool')
+    
+    def key_bits(self, spc, role):
+        """
+        Return the bitset of reactions with species name spc as role
+        """
+        try:
+            return self.__key_bit_cache[spc, role]
+        except KeyError:
+            mask = zeros(self.shape[1], dtype = 'bool')
+            mask[self.__key_rows(spc, role)] = True
+            bits = self.__key_bit_cache[spc, role] = self.__to_bits(mask)
+            return bits
+    
+    def bits(self, spc, role = None):
+        """
+        Return a bitset of reactions that have any subspecies of spc in 
+        one of its roles.  This is the indexed equivalent of 
+        Reaction.has_spc.
+
+        spc - Species object
+        role - optional role ('r', 'p', or 'u') that replaces the roles
+               of spc (i.e., Reaction.has_rct uses 'r')
+        """
+        bits = 0
+        if role is None:
+            for spcn, spc_role in spc.iter_species_roles():
+                bits |= self.key_bits(spcn, spc_role)
+        else:
+            for spcn, props in spc.spc_dict.items():
+                if not role in props['role']:
+                    raise TypeError('Requesting %s role from species %s with %s that has roles %s' % (_role_names[role], spc.name, spcn, str(list(props['role']))))
+                bits |= self.key_bits(spcn, role)
+
+        if spc.exclude:
+            bits ^= self.all_bits
+        return bits
+    
+    def type_bits(self, reaction_type):
+        """
+        Return a bitset of reactions whose type is in reaction_type
+        """
+        bits = 0
+        for rt in set(reaction_type):
+            bits |= self.__type_bits.get(rt, 0)
+        return bits
+    
+    def contains(self, spc, role = None):
+        """
+        Return a boolean mask over reactions that have any subspecies of
+        spc in one of its roles (see bits)
+        """
+        return self.mask(self.bits(spc, role))
+
+    def type_mask(self, reaction_type):
+        """
+        Return a boolean mask over reactions whose type is in reaction_type
+        """
+        return self.mask(self.type_bits(reaction_type))
+
+    def names(self, mask):
+        """
+        Return reaction names (sorted) where mask (boolean array or bitset)
+        is true
+        """
+        reactions = self.reactions
+        if isinstance(mask, int):
+            mask = self.mask(mask)
+        return [reactions[i] for i in flatnonzero(mask)]
+
+    def indices(self, rxn_names):
+        """
+        Return reaction indices for reaction names
+        """
+        return array([self.reaction_index[rxn] for rxn in rxn_names], dtype = intp)
+
+    def net(self, rxn_names):
+        """
+        Return a scalar stoichiometry dictionary ({(spc, role): coeff}) and reaction
+        type for the sum of reactions (rxn_names); the result matches
+        reduce(Reaction.__add__, reactions) for scalar reactions
+        """
+        ridx = self.indices(rxn_names)
+        if len(ridx) == 0:
+            return {}, 'k'
+        # Repeated reactions are counted once per occurrence
+        counts = bincount(ridx, minlength = self.shape[1])[self.rxn_idx]
+        nkeys = self.shape[0] * len(_roles)
+        values = bincount(self.key_idx, weights = self.coeff * counts, minlength = nkeys)
+        present = bincount(self.key_idx, weights = counts, minlength = nkeys) > 0
+        stoic = {}
+        for key in flatnonzero(present):
+            spci, rolei = divmod(key, len(_roles))
+            stoic[self.species[spci], _roles[rolei]] = float64(values[key])
+
+        reaction_types = set(self.reaction_types[ridx].tolist())
+        if len(reaction_types) == 1:
+            reaction_type, = reaction_types
+        else:
+            reaction_type = 'n'
+        return stoic, reaction_type
+
+    def budget(self, rates):
+        """
+        Return gross production and gross loss (positive) of every species
+        as arrays with dimensions (species, ...).  This is the product of
+        the stoichiometry planes and rates along the reaction axis.
+        
+        Unspecified (u) entries count as production where positive and loss
+        where negative, consistent with Reaction.produces and 
+        Reaction.consumes.
+        
+        rates - array (reactions, ...) in the reaction order of the matrix
+        """
+        rates = asarray(rates)
+        order = self.key_order
+        extra_shape = rates.shape[1:]
+        coeff = self.coeff[order].reshape((-1,) + (1,) * len(extra_shape))
+        role_idx = self.role_idx[order].reshape(coeff.shape)
+        values = coeff * rates[self.rxn_idx[order]]
+        
+        prd_values = where(role_idx == _role_index['p'], values, 0.)
+        prd_values += where(role_idx == _role_index['u'], maximum(values, 0.), 0.)
+        rct_values = where(role_idx == _role_index['r'], values, 0.)
+        rct_values += where(role_idx == _role_index['u'], minimum(values, 0.), 0.)
+        
+        production = zeros((self.shape[0],) + extra_shape, dtype = values.dtype)
+        loss = zeros((self.shape[0],) + extra_shape, dtype = values.dtype)
+        has_entries = diff(self.spc_ptr) > 0
+        starts = self.spc_ptr[:-1][has_entries]
+        if len(starts) > 0:
+            production[has_entries] = add.reduceat(prd_values, starts, axis = 0)
+            loss[has_entries] = -add.reduceat(rct_values, starts, axis = 0)
+        return production, loss
+
+    def element_balance(self, composition):
+        """
+        Return the element imbalance (products - reactants) of every 
+        reaction as an array (reaction, element).  This is the product of
+        the stoichiometry (all roles) and the composition.
+        
+        composition - array (species, element) of atom counts in the 
+                      species order of the matrix
+        """
+        composition = asarray(composition, dtype = 'd')
+        values = self.coeff[:, newaxis] * composition[self.spc_idx]
+        balance = zeros((self.shape[1], composition.shape[1]), dtype = 'd')
+        has_entries = diff(self.rxn_ptr) > 0
+        starts = self.rxn_ptr[:-1][has_entries]
+        if len(starts) > 0:
+            balance[has_entries] = add.reduceat(values, starts, axis = 0)
+        return balance
+
+    def family_weights(self, families):
+        """
+        Return weights (family, species, plane) for a sequence of Species
+        families.  Planes are reactant, product, positive unspecified and
+        negative unspecified stoichiometry; a plane is weighted by the 
+        subspecies stoic when the subspecies role includes it (role mask).
+        Unspecified values are counted by sign for product or reactant only 
+        subspecies and excluded families weight everything outside the 
+        family by 1, as in Reaction.get_spc.  Subspecies that are not in
+        the matrix are ignored.
+        """
+        weights = zeros((len(families), self.shape[0], len(_planes)), dtype = 'd')
+        for fi, family in enumerate(families):
+            if family.exclude:
+                weights[fi] = 1.
+            for spc, props in family.spc_dict.items():
+                si = self.species_index.get(spc)
+                if si is None:
+                    continue
+                roles = props['role']
+                if 'u' in roles:
+                    mask = array(['r' in roles, 'p' in roles, True, True])
+                else:
+                    mask = array(['r' in roles, 'p' in roles, 'p' in roles, 'r' in roles])
+                if family.exclude:
+                    weights[fi, si] = ~mask
+                else:
+                    weights[fi, si] = where(mask, props['stoic'], 0.)
+        return weights
+
+    def __family_coefficients(self, weights):
+        """
+        Return family x reaction coefficients that multiply the positive
+        and negative parts of the rates: production for positive rates,
+        production for negative rates, loss for positive rates and loss
+        for negative rates.  Unspecified entries change plane with the
+        sign of coefficient * rate.
+        """
+        plane_weights = weights[:, self.spc_idx, :] * self.coeff[:, None]
+        is_u = self.role_idx == _role_index['u']
+        u_pos = is_u & (self.coeff > 0)
+        u_neg = is_u & (self.coeff < 0)
+        fixed_p = where(self.role_idx == _role_index['p'], plane_weights[..., 1], 0.)
+        fixed_r = where(self.role_idx == _role_index['r'], plane_weights[..., 0], 0.)
+        entries = [fixed_p + where(u_pos, plane_weights[..., 2], 0.),
+                   fixed_p + where(u_neg, plane_weights[..., 2], 0.),
+                   fixed_r + where(u_neg, plane_weights[..., 3], 0.),
+                   fixed_r + where(u_pos, plane_weights[..., 3], 0.)]
+
+        has_entries = diff(self.rxn_ptr) > 0
+        starts = self.rxn_ptr[:-1][has_entries]
+        coefficients = []
+        for entry in entries:
+            coefficient = zeros((weights.shape[0], self.shape[1]), dtype = 'd')
+            if len(starts) > 0:
+                coefficient[:, has_entries] = add.reduceat(entry, starts, axis = 1)
+            coefficients.append(coefficient)
+        return coefficients
+
+    def family_budget(self, weights, rates):
+        """
+        Return gross production and gross loss (positive) of every family
+        in every reaction as arrays with dimensions (family, reaction, ...).
+        Net change is production - loss; summing over the reaction axis
+        gives the family budget.
+        
+        weights - family weights from family_weights
+        rates - array (reactions, ...) in the reaction order of the matrix
+        """
+        rates = asarray(rates)
+        extra_shape = rates.shape[1:]
+        pos_rates = maximum(rates, 0.)[newaxis]
+        neg_rates = minimum(rates, 0.)[newaxis]
+        prd_pos, prd_neg, rct_pos, rct_neg = [c.reshape(c.shape + (1,) * len(extra_shape)) for c in self.__family_coefficients(weights)]
+        production = prd_pos * pos_rates + prd_neg * neg_rates
+        loss = rct_pos * pos_rates
+        loss += rct_neg * neg_rates
+        loss *= -1
+        return production, loss
+
+import unittest
+
+class StoicMatrixTestCase(unittest.TestCase):
+    def setUp(self):
+        from .Reaction import Reaction
+        self.rxns = dict(NO2hv = Reaction('NO2 ->[j] NO + O'),
+                         OplO3 = Reaction('O + O2 + M ->[k] O3 + M'),
+                         NTRplOH = Reaction('NTR + OH ->[k] HNO3 + HO2 + 0.330*FORM + 0.330*ALD2 + 0.330*ALDX - 0.660*PAR'))
+        self.spcs = dict(NO2 = Species('NO2'), O = Species('O'), M = Species('M'),
+                         PAR = Species('PAR: C'), OH = Species('OH'))
+        self.matrix = StoicMatrix.from_reactions(self.rxns)
+
+    def testShape(self):
+        self.assertEqual(self.matrix.shape, (14, 3, 3))
+        self.assertEqual(self.matrix.reactions, ('NO2hv', 'NTRplOH', 'OplO3'))
+
+    def testContains(self):
+        matrix = self.matrix
+        for spc in self.spcs.values():
+            for role in (None, 'r', 'p'):
+                for test_spc in (spc, -spc):
+                    if role is None:
+                        check = [self.rxns[rxn].has_spc(test_spc) for rxn in matrix.reactions]
+                    elif role == 'r':
+                        check = [self.rxns[rxn].has_rct(test_spc) for rxn in matrix.reactions]
+                    else:
+                        check = [self.rxns[rxn].has_prd(test_spc) for rxn in matrix.reactions]
+                    self.assertEqual(matrix.contains(test_spc, role).tolist(), check)
+
+    def testBits(self):
+        matrix = self.matrix
+        for spc in self.spcs.values():
+            for role in (None, 'r', 'p'):
+                for test_spc in (spc, -spc):
+                    bits = matrix.bits(test_spc, role)
+                    self.assertEqual(matrix.mask(bits).tolist(), matrix.contains(test_spc, role).tolist())
+                    self.assertEqual(matrix.names(bits), matrix.names(matrix.contains(test_spc, role)))
+        self.assertEqual(matrix.names(matrix.type_bits('j')), ['NO2hv'])
+        self.assertEqual(matrix.type_bits('x'), 0)
+
+    def testTypeMask(self):
+        self.assertEqual(self.matrix.names(self.matrix.type_mask('j')), ['NO2hv'])
+        self.assertEqual(self.matrix.names(self.matrix.type_mask('kj')), ['NO2hv', 'NTRplOH', 'OplO3'])
+
+    def testNet(self):
+        stoic, reaction_type = self.matrix.net(['NO2hv', 'OplO3'])
+        check = self.rxns['NO2hv'] + self.rxns['OplO3']
+        self.assertEqual(reaction_type, check.reaction_type)
+        self.assertEqual(stoic, check._stoic)
+
+    def testBudget(self):
+        from numpy import arange, allclose
+        rates = arange(12, dtype = 'd').reshape(3, 4) + 1
+        production, loss = self.matrix.budget(rates)
+        self.assertEqual(production.shape, (14, 4))
+        for spcn in ['NO2', 'O', 'PAR', 'OH']:
+            spc = Species(spcn)
+            si = self.matrix.species_index[spcn]
+            check_prd = sum([(self.rxns[rxn] * rates[ri]).produces(spc) for ri, rxn in enumerate(self.matrix.reactions)])
+            check_lss = sum([(self.rxns[rxn] * rates[ri]).consumes(spc) for ri, rxn in enumerate(self.matrix.reactions)])
+            self.assertTrue(allclose(production[si], check_prd))
+            self.assertTrue(allclose(loss[si], check_lss))
+
+    def testFamilyBudget(self):
+        from numpy import arange, allclose
+        from .Reaction import Reaction
+        rxns = dict(self.rxns, NOplO = Reaction('NO + O = NO2 - 0.5*PAR'))
+        matrix = StoicMatrix.from_reactions(rxns)
+        rates = arange(16, dtype = 'd').reshape(4, 4) - 6
+        NO = Species('NO')
+        families = [NO + Species('NO2'), Species('PAR: C') + Species('O'), (NO + Species('NO2')).product(), Species('PAR: C').reactant()]
+        weights = matrix.family_weights(families)
+        self.assertEqual(weights.shape, (4, len(matrix.species), 4))
+        production, loss = matrix.family_budget(weights, rates)
+        self.assertEqual(production.shape, (4, 4, 4))
+        for fi, family in enumerate(families):
+            for ri, rxn_name in enumerate(matrix.reactions):
+                rxn = rxns[rxn_name] * rates[ri]
+                if rxn.has_spc(family):
+                    self.assertTrue(allclose(production[fi, ri] - loss[fi, ri], rxn[family]))
+                    if len(family.role()) == 3:
+                        self.assertTrue(allclose(production[fi, ri], rxn.produces(family)))
+                        self.assertTrue(allclose(loss[fi, ri], rxn.consumes(family)))
+                else:
+                    self.assertTrue((production[fi, ri] == 0).all() and (loss[fi, ri] == 0).all())
+
+    def testElementBalance(self):
+        from numpy import allclose
+        composition = zeros((len(self.matrix.species), 2))
+        for spcn, c, o in [('O', 0, 1), ('O2', 0, 2), ('O3', 0, 3), ('NO2', 0, 2), ('NO', 0, 1), ('PAR', 1, 0), ('FORM', 1, 1)]:
+            composition[self.matrix.species_index[spcn]] = c, o
+        balance = self.matrix.element_balance(composition)
+        self.assertEqual(balance.shape, (3, 2))
+        ri = self.matrix.reaction_index
+        self.assertTrue(allclose(balance[ri['NO2hv']], 0))
+        self.assertTrue(allclose(balance[ri['OplO3']], 0))
+        self.assertTrue(allclose(balance[ri['NTRplOH']], [.33 - .66, .33]))
+
+if __name__ == '__main__':
+    unittest.main()
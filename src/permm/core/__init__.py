@@ -1,5 +1,6 @@
-__all__ = ['Species', 'Reaction', 'Mechanism']
+__all__ = ['Species', 'Reaction', 'Mechanism', 'StoicMatrix']
 
 from . import Mechanism
 from . import Reaction
 from . import Species
+from . import StoicMatrix
\ No newline at end of file
@@ -1,6 +1,9 @@
-__all__ = ['AttrDict']
+__all__ = ['AttrDict', 'LazyDict', 'LRUCache']
 
+import sys
 import unittest
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 class AttrDict(dict):
     """For easy access to values"""
@@ -26,6 +29,118 @@ class AttrDict(dict):
             raise AttributeError(attr)
 
 
+_unloaded = object()
+
+class LazyDict(MutableMapping):
+    """
+    Dictionary whose values are made by factory(key) on first access
+    and then kept; keys are known up front
+    """
+    def __init__(self, keys, factory):
+        self.factory = factory
+        self.data = dict.fromkeys(keys, _unloaded)
+    
+    def __getitem__(self, key):
+        value = self.data[key]
+        if value is _unloaded:
+            value = self.data[key] = self.factory(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        self.data[key] = value
+    
+    def __delitem__(self, key):
+        del self.data[key]
+    
+    def __contains__(self, key):
+        return key in self.data
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def loaded_items(self):
+        """
+        Return (key, value) pairs for values that have been made
+        """
+        return [(k, v) for k, v in self.data.items() if v is not _unloaded]
+    
+    def unloaded_keys(self):
+        """
+        Return keys whose values have not been made
+        """
+        return [k for k, v in self.data.items() if v is _unloaded]
+
+
+class LRUCache(object):
+    """
+    Cache of values limited to max_bytes; the least recently used
+    values are evicted first.  Value sizes come from their nbytes
+    attribute (sys.getsizeof when there is none) and values larger
+    than max_bytes are not kept.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default = None):
+        """
+        Return the value for key (default when not cached) and count
+        a hit or a miss
+        """
+        try:
+            value, size = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        """
+        Cache value for key; evicts least recently used values to
+        stay within max_bytes
+        """
+        size = getattr(value, 'nbytes', None)
+        if not isinstance(size, int):
+            size = sys.getsizeof(value)
+        if key in self.data:
+            self.nbytes -= self.data.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        while self.nbytes + size > self.max_bytes:
+            old_key, (old_value, old_size) = self.data.popitem(last = False)
+            self.nbytes -= old_size
+            self.evictions += 1
+        self.data[key] = (value, size)
+        self.nbytes += size
+    
+    def clear(self):
+        """
+        Remove all values; statistics are kept
+        """
+        self.data.clear()
+        self.nbytes = 0
+    
+    def __contains__(self, key):
+        return key in self.data
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def stats(self):
+        """
+        Return hits, misses, evictions, entries, nbytes and max_bytes
+        """
+        return AttrDict(hits = self.hits, misses = self.misses, evictions = self.evictions, entries = len(self.data), nbytes = self.nbytes, max_bytes = self.max_bytes)
+
 class TestAttrDict(unittest.TestCase):
     def setUp(self):
         self.base_dict = {'one': 1, "two": {"two": 2}}
@@ -36,4 +151,42 @@ class TestAttrDict(unittest.TestCase):
         ad = self.attr_dict
         for k in self.base_dict:
             self._assert(bd[k] == ad[k])
-            
\ No newline at end of file
+            
+
+class TestLazyDict(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        def factory(key):
+            self.calls.append(key)
+            return key * 2
+        self.lazy_dict = LazyDict(['a', 'b'], factory)
+    
+    def testLazy(self):
+        ld = self.lazy_dict
+        self.assertEqual(len(ld), 2)
+        self.assertTrue('b' in ld)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(ld['a'], 'aa')
+        self.assertEqual(ld['a'], 'aa')
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual(ld.loaded_items(), [('a', 'aa')])
+        self.assertRaises(KeyError, ld.__getitem__, 'c')
+        del ld['b']
+        self.assertEqual(list(ld), ['a'])
+
+class TestLRUCache(unittest.TestCase):
+    def testEviction(self):
+        from numpy import zeros
+        cache = LRUCache(200)
+        cache.put('a', zeros(10))
+        cache.put('b', zeros(10))
+        self.assertTrue(cache.get('a') is not None)
+        cache.put('c', zeros(10))
+        self.assertEqual(sorted(cache.data), ['a', 'c'])
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        cache.put('d', zeros(100))
+        self.assertTrue('d' not in cache)
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.evictions, stats.entries, stats.nbytes), (1, 1, 1, 2, 160))
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes, cache.stats().hits), (0, 0, 1))